@@ -3,6 +3,8 @@ import os
 import pandas as pd
 import json
 from tempfile import NamedTemporaryFile
+from src.ui.job_status import current_job, job_manager, session_user, show_job
+from src.ui.session_cache import fcs_channels, file_bytes, result_table, save_upload, session_cache
 
 st.set_page_config(page_title="FlowSense", layout="wide")
 st.title("🧬 FlowSense: Smart Flow Cytometry Analysis")
@@ -12,27 +14,33 @@ if "map_confirmed" not in st.session_state:
     st.session_state.map_confirmed = False
 if "fluor_map" not in st.session_state:
     st.session_state.fluor_map = {}
+# Tasks run as background jobs; each user's stage results (graph, model, anomaly
+# table) stay in memory in the job manager between tasks
+user = session_user()
+
+# Pipeline stages each task needs; their dependencies are run automatically
+TASK_TARGETS = {
+    "CD4/CD8 Classification": ["gnn", "gnn_plots"],
+    "Anomaly Detection": ["anomalies", "marker_plots"],
+    "Marker Expression Visualization": ["marker_plots"],
+}
 
 # === Step 1: Upload FCS File ===
 st.header("1. Upload .fcs File")
 fcs_file = st.file_uploader("Upload a flow cytometry .fcs file", type=["fcs"])
 
 if fcs_file:
-    temp_path = os.path.join("data", fcs_file.name)
-    with open(temp_path, "wb") as f:
-        f.write(fcs_file.read())
+    # Written (and hashed) once per upload; reruns reuse the cached header
+    temp_path, digest = save_upload(fcs_file)
+    if st.session_state.get("upload_digest") != digest:
+        # Different file contents: finished jobs and stage results describe the old upload
+        job_manager().invalidate(user)
+        st.session_state.upload_digest = digest
     st.success(f"Uploaded: {fcs_file.name}")
 
     # === Step 2: Map Fluorochromes ===
     st.header("2. Map Fluorochromes to Markers")
-    import FlowCal
-    fcs = FlowCal.io.FCSFile(temp_path)
-    param_count = int(fcs.text['$PAR'])
-    channel_names = []
-    for i in range(1, param_count + 1):
-        label = fcs.text.get(f"$P{i}S") or fcs.text.get(f"$P{i}N")
-        if label:
-            channel_names.append(label)
+    channel_names = fcs_channels(temp_path, digest)
 
     st.markdown("Assign biological marker names for each detected channel:")
     for ch in channel_names:
@@ -45,6 +53,8 @@ if fcs_file:
         with open("data/processed/fluor_map.json", "w") as f:
             json.dump(st.session_state.fluor_map, f, indent=2)
         st.session_state.map_confirmed = True
+        # New inputs: everything downstream of gating has to be recomputed
+        job_manager().invalidate(user)
         st.success("✅ Fluorochrome mapping saved!")
 
 # === Step 3: Task Selection ===
@@ -57,26 +67,39 @@ if st.session_state.map_confirmed:
     ])
 
     if st.button("Run Task"):
-        with st.spinner("Running analysis..."):
-            if task == "CD4/CD8 Classification":
-                os.system("python3 models/gnn_model.py")
-                st.image("plots/Flow_Tcell_umap_kmeans_3.png")
+        # Returns immediately; an identical earlier job is reused instead of rerun
+        st.session_state.job_id = job_manager().submit(user, TASK_TARGETS[task]).id
+        st.session_state.job_task = task
+
+    job = current_job()
+    if show_job(job):
+        job_task, results = st.session_state.job_task, job.result
+        if job_task == "CD4/CD8 Classification":
+            st.metric("Test accuracy", f"{results['gnn']['accuracy']:.3f}")
+            for path in results["gnn_plots"]:
+                st.image(path)
 
-            elif task == "Anomaly Detection":
-                os.system("python3 models/detect_anomalies_with_markers.py")
-                os.system("python3 models/analyze_gnn_markers.py")
-                st.image("plots/Flow_Tcell_anomalies_umap.png")
+        elif job_task == "Anomaly Detection":
+            st.image(results["anomalies"]["plot"])
+            for path in results["marker_plots"].values():
+                st.image(path)
 
-            elif task == "Marker Expression Visualization":
-                os.system("python3 models/analyze_gnn_markers.py")
-                for marker in st.session_state.fluor_map.values():
-                    path = f"plots/marker_full_umap_{marker}.png"
-                    if os.path.exists(path):
-                        st.image(path)
+        elif job_task == "Marker Expression Visualization":
+            for marker in st.session_state.fluor_map.values():
+                path = results["marker_plots"].get(marker)
+                if path and os.path.exists(path):
+                    st.image(path)
 
     # === Downloadable Outputs ===
     st.header("4. Download Results")
     if os.path.exists("data/processed/gated_data.csv"):
-        st.download_button("Download Gated Data CSV", open("data/processed/gated_data.csv", "rb"), file_name="gated_data.csv")
+        st.download_button("Download Gated Data CSV", file_bytes("data/processed/gated_data.csv"), file_name="gated_data.csv")
     if os.path.exists("data/processed/Flow_Tcell_anomalies.csv"):
-        st.download_button("Download Anomaly Table", open("data/processed/Flow_Tcell_anomalies.csv", "rb"), file_name="Flow_Tcell_anomalies.csv")
+        st.download_button("Download Anomaly Table", file_bytes("data/processed/Flow_Tcell_anomalies.csv"), file_name="Flow_Tcell_anomalies.csv")
+        table = result_table("data/processed/Flow_Tcell_anomalies.csv")
+        st.caption(f"{int(table['anomaly'].sum())} of {len(table)} cells flagged as anomalous")
+        st.dataframe(table.head(100))
+
+    stats = session_cache().stats()
+    st.sidebar.caption(f"💾 Cache: {stats['entries']} entries, {stats['mb']:.0f}/{stats['budget_mb']:.0f} MB "
+                       f"({stats['hits']} hits, {stats['misses']} misses)")
@@ -0,0 +1,162 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import argparse
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from src.preprocessing.fcs_reader import FCSFile, read_text
+
+# Native memory-mapped FCS reader vs FlowCal on large files.
+#
+#   python benchmarks/bench_fcs_reader.py path/to/a.fcs path/to/b.fcs
+#   python benchmarks/bench_fcs_reader.py --synthetic 1000000
+#
+# Each reader loads the file and applies the FSC/SSC + singlet gates from
+# apply_gates.py; wall time and peak traced allocations are reported.
+
+CHANNELS = ["FSC-A", "FSC-H", "SSC-A", "BV421-A", "BV510-A", "BB515-A", "PE-A", "APC-A", "Time"]
+
+
+def write_synthetic_fcs(path, n_events, seed=42, values=None, datatype="F", byteorder=">", bits=None,
+                        ranges=262144, offsets_in_text=False):
+    """
+    Write an FCS 3.1 file, by default big-endian float32 with realistic-looking scatter
+    channels. values (n_events × parameters) replaces the random events; datatype "F",
+    "D" or "I" with per-parameter bits, ranges ($PnR) and byteorder ("<"/">") select the
+    layout, and offsets_in_text leaves the DATA offsets to $BEGINDATA/$ENDDATA only.
+    """
+    if values is None:
+        rng = np.random.default_rng(seed)
+        values = rng.lognormal(mean=9.5, sigma=1.0, size=(n_events, len(CHANNELS)))
+        values[:, 1] = values[:, 0] * rng.normal(1.0, 0.1, n_events)
+    values = np.asarray(values)
+    n_par = values.shape[1]
+    channels = CHANNELS if n_par == len(CHANNELS) else [f"P{i}" for i in range(1, n_par + 1)]
+    bits = bits or {"F": 32, "D": 64, "I": 32}[datatype]
+    bits = [bits] * n_par if np.isscalar(bits) else list(bits)
+    ranges = [ranges] * n_par if np.isscalar(ranges) else list(ranges)
+    kind = {"F": "f", "D": "f", "I": "u"}[datatype]
+    records = np.empty(len(values), dtype=[(f"p{i}", f"{byteorder}{kind}{b // 8}") for i, b in enumerate(bits)])
+    for i in range(n_par):
+        records[f"p{i}"] = values[:, i]
+    data = records.tobytes()
+
+    keywords = {"$BYTEORD": "4,3,2,1" if byteorder == ">" else "1,2,3,4", "$DATATYPE": datatype, "$MODE": "L",
+                "$NEXTDATA": "0", "$BEGINANALYSIS": "0", "$ENDANALYSIS": "0", "$BEGINSTEXT": "0", "$ENDSTEXT": "0",
+                "$PAR": str(n_par), "$TOT": str(len(values))}
+    for i, ch in enumerate(channels, start=1):
+        keywords.update({f"$P{i}N": ch, f"$P{i}B": str(bits[i - 1]), f"$P{i}E": "0,0", f"$P{i}R": str(ranges[i - 1])})
+
+    def text_segment(begin, end):
+        kw = dict(keywords, **{"$BEGINDATA": f"{begin:020d}", "$ENDDATA": f"{end:020d}"})
+        return ("/" + "".join(f"{k}/{v}/" for k, v in kw.items())).encode("ascii")
+
+    # Offsets are zero-padded to a fixed width so the TEXT length doesn't depend on them
+    text_start = 58
+    data_start = text_start + len(text_segment(0, 0))
+    data_end = data_start + len(data) - 1
+    text = text_segment(data_start, data_end)
+
+    def field(v, in_header=True):
+        return f"{v if v <= 99999999 and in_header else 0:>8}"
+
+    data_fields = field(data_start, not offsets_in_text) + field(data_end, not offsets_in_text)
+    header = f"FCS3.1    {field(text_start)}{field(text_start + len(text) - 1)}{data_fields}{0:>8}{0:>8}"
+    with open(path, "wb") as f:
+        f.write(header.encode("ascii"))
+        f.write(text)
+        f.write(data)
+
+
+def gate_frame(df):
+    df = df[(df['FSC-A'] > 10000) & (df['FSC-A'] < 80000)]
+    df = df[(df['SSC-A'] > 1000) & (df['SSC-A'] < 60000)]
+    ratio = df['FSC-A'] / (df['FSC-H'] + 1e-6)
+    return df[(ratio > 0.85) & (ratio < 1.15)]
+
+
+def run_flowcal(path):
+    import FlowCal
+    data = FlowCal.io.FCSData(path)
+    # Same copies as the old apply_gates.py path (byteswap + new byte order view)
+    df_np = np.asarray(data).byteswap()
+    df_np = df_np.view(df_np.dtype.newbyteorder())
+    df = pd.DataFrame(df_np, columns=data.channels)
+    return len(gate_frame(df))
+
+
+def run_native(path):
+    fcs = FCSFile(path)
+    fsc_a, fsc_h, ssc_a = fcs.column("FSC-A"), fcs.column("FSC-H"), fcs.column("SSC-A")
+    mask = (fsc_a > 10000) & (fsc_a < 80000) & (ssc_a > 1000) & (ssc_a < 60000)
+    ratio = fsc_a / (fsc_h + 1e-6)
+    mask &= (ratio > 0.85) & (ratio < 1.15)
+    return len(fcs.to_frame(rows=mask))
+
+
+def run_header_flowcal(path):
+    import FlowCal
+    return int(FlowCal.io.FCSFile(path).text["$PAR"])
+
+
+def run_header_native(path):
+    return int(read_text(path)["$PAR"])
+
+
+def measure(fn, path, repeats):
+    times = []
+    peak = 0
+    result = None
+    for _ in range(repeats):
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = fn(path)
+        times.append(time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return min(times), peak, result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the native FCS reader against FlowCal.")
+    parser.add_argument("paths", nargs="*", help=".fcs files to benchmark")
+    parser.add_argument("--synthetic", type=int, default=0, help="also benchmark a generated file with N events")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    paths = list(args.paths)
+    tmp = None
+    if args.synthetic:
+        tmp = tempfile.TemporaryDirectory()
+        synthetic_path = os.path.join(tmp.name, f"synthetic_{args.synthetic}.fcs")
+        print(f"🧪 Writing synthetic FCS with {args.synthetic} events...")
+        write_synthetic_fcs(synthetic_path, args.synthetic)
+        paths.append(synthetic_path)
+
+    if not paths:
+        parser.error("pass .fcs paths and/or --synthetic N")
+
+    try:
+        import FlowCal  # noqa: F401
+        have_flowcal = True
+    except ImportError:
+        have_flowcal = False
+        print("⚠️ FlowCal not installed; reporting native reader only.")
+
+    rows = []
+    for path in paths:
+        size_mb = os.path.getsize(path) / 1e6
+        cases = [("native", run_native), ("native header", run_header_native)]
+        if have_flowcal:
+            cases += [("FlowCal", run_flowcal), ("FlowCal header", run_header_flowcal)]
+        for name, fn in cases:
+            seconds, peak, result = measure(fn, path, args.repeats)
+            rows.append({"file": os.path.basename(path), "MB": round(size_mb, 1), "reader": name,
+                         "seconds": round(seconds, 4), "peak_MB": round(peak / 1e6, 1), "result": result})
+
+    print(pd.DataFrame(rows).to_string(index=False))
+    if tmp is not None:
+        tmp.cleanup()
@@ -0,0 +1,64 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from src.modeling.neighbors import knn, edge_index_from_knn
+
+# Recall vs speed of the kNN backends used by build_graph.py.
+#
+#   python benchmarks/bench_knn.py --sizes 100000 1000000 --k 15
+#
+# Data is a synthetic 8-marker Gaussian mixture (standardized like build_graph.py).
+# Recall@k is measured against exact search on a random sample of query cells.
+
+
+def synthetic_markers(n, dims=8, clusters=12, seed=42):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(0, 3, size=(clusters, dims))
+    labels = rng.integers(0, clusters, size=n)
+    X = centers[labels] + rng.normal(0, 1, size=(n, dims))
+    return ((X - X.mean(0)) / X.std(0)).astype(np.float32)
+
+
+def recall_at_k(approx, exact):
+    hits = 0
+    for start in range(0, len(approx), 10000):
+        a, e = approx[start:start + 10000], exact[start:start + 10000]
+        hits += (a[:, :, None] == e[:, None, :]).any(axis=2).sum()
+    return hits / exact.size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark exact vs approximate kNN graph construction.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50000, 200000])
+    parser.add_argument("--k", type=int, default=15)
+    parser.add_argument("--n-jobs", type=int, default=-1)
+    parser.add_argument("--recall-sample", type=int, default=5000, help="query cells used to measure recall")
+    parser.add_argument("--backends", nargs="+", default=["exact", "nndescent"])
+    args = parser.parse_args()
+
+    rows = []
+    for n in args.sizes:
+        X = synthetic_markers(n)
+        rng = np.random.default_rng(0)
+        sample = rng.choice(n, size=min(args.recall_sample, n), replace=False)
+
+        # Ground truth for the sampled cells only, so recall is cheap even at 10M cells
+        from sklearn.neighbors import NearestNeighbors
+        truth = NearestNeighbors(n_neighbors=args.k + 1, n_jobs=args.n_jobs).fit(X)
+        true_idx = truth.kneighbors(X[sample], return_distance=False)[:, 1:]
+
+        for backend in args.backends:
+            start = time.perf_counter()
+            _, neighbors, _ = knn(X, k=args.k, backend=backend, n_jobs=args.n_jobs)
+            edge_index = edge_index_from_knn(neighbors)
+            seconds = time.perf_counter() - start
+            rows.append({"cells": n, "backend": backend, "seconds": round(seconds, 2),
+                         "edges": edge_index.size(1), "edges_per_s": int(edge_index.size(1) / seconds),
+                         f"recall@{args.k}": round(recall_at_k(neighbors[sample], true_idx), 4)})
+            print(rows[-1])
+
+    print(pd.DataFrame(rows).to_string(index=False))
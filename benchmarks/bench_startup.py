@@ -0,0 +1,109 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import argparse
+import json
+import subprocess
+import time
+
+# Cold-start cost of the app and of every pipeline stage module.
+#
+#   python benchmarks/bench_startup.py --repeats 3
+#
+# Each measurement runs in a fresh interpreter (nothing already imported, but
+# the OS file cache and numba's on-disk cache are warm after the first repeat):
+#
+#   import     wall time of `import <module>`, plus which heavy dependencies
+#              (torch, torch_geometric, umap, numba, sklearn, matplotlib,
+#              seaborn, FlowCal) the import pulled in
+#   app        time to first render of each Streamlit app: the script run to
+#              completion by streamlit.testing's AppTest, with and without the
+#              cost of importing streamlit itself
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+HEAVY = ["torch", "torch_geometric", "umap", "numba", "sklearn", "matplotlib", "seaborn", "FlowCal"]
+MODULES = [
+    "src.pipeline.runner",
+    "src.pipeline.jobs",
+    "src.preprocessing.apply_gates",
+    "src.preprocessing.event_store",
+    "src.modeling.graph_state",
+    "src.modeling.build_graph",
+    "src.modeling.gnn_model",
+    "src.modeling.gnn_visualize",
+    "src.analysis.anomaly",
+    "src.analysis.embedding",
+    "src.analysis.detect_anomalies",
+    "src.analysis.analyze_gnn_markers",
+    "src.ui.session_cache",
+    "src.ui.job_status",
+]
+APPS = ["FlowSense.py", "src/ui/streamlit_app.py"]
+
+IMPORT_SNIPPET = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+APP_SNIPPET = """
+import time, json
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+imported = time.perf_counter()
+at = AppTest.from_file({path!r}, default_timeout=300)
+at.run()
+done = time.perf_counter()
+print(json.dumps({{"seconds": done - start, "render": done - imported,
+                   "exceptions": [str(e.value) for e in at.exception]}}))
+"""
+
+
+def run_snippet(code):
+    # The modules' scripts are run from argv-free interpreters; keep their CLIs quiet
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True,
+                         env=dict(os.environ, PYTHONWARNINGS="ignore"))
+    if out.returncode != 0:
+        return {"error": out.stderr.strip().splitlines()[-1] if out.stderr.strip() else "failed"}
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def best_of(code, repeats):
+    results = [run_snippet(code) for _ in range(repeats)]
+    ok = [r for r in results if "error" not in r]
+    return min(ok, key=lambda r: r["seconds"]) if ok else results[-1]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import time of stage modules and time to first render of the apps.")
+    parser.add_argument("--repeats", type=int, default=3, help="fresh interpreters per measurement (best is reported)")
+    parser.add_argument("--modules", nargs="+", default=MODULES)
+    parser.add_argument("--apps", nargs="*", default=APPS)
+    parser.add_argument("--json", default=None, help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = {"imports": {}, "apps": {}}
+    print(f"{'module':<36} {'import':>8}  heavy dependencies loaded")
+    for module in args.modules:
+        r = best_of(IMPORT_SNIPPET.format(module=module, heavy=HEAVY), args.repeats)
+        results["imports"][module] = r
+        if "error" in r:
+            print(f"{module:<36} {'error':>8}  {r['error']}")
+        else:
+            print(f"{module:<36} {r['seconds']:>7.2f}s  {', '.join(r['heavy']) or '-'}")
+
+    for path in args.apps:
+        r = best_of(APP_SNIPPET.format(path=path), args.repeats)
+        results["apps"][path] = r
+        if "error" in r:
+            print(f"⏱️ {path}: {r['error']}")
+        else:
+            print(f"⏱️ {path}: first render in {r['render']:.2f}s ({r['seconds']:.2f}s including streamlit import)"
+                  + (f" ⚠️ {r['exceptions']}" if r["exceptions"] else ""))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results saved to: {args.json}")
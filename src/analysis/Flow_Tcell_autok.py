@@ -1,58 +1,61 @@
 import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
 import pandas as pd
 import matplotlib.pyplot as plt
 from sklearn.preprocessing import StandardScaler
-from sklearn.utils import resample
-from sklearn.cluster import KMeans
-from sklearn.metrics import silhouette_score
-import umap
+import argparse
+from src.preprocessing.event_store import read_events, ID_COLUMN
+from src.preprocessing.downsample import METHODS, downsample_events
+from src.analysis.kmeans_sweep import CRITERIA, best_k, sweep_k
 
 # ========== Setup Paths ==========
 script_dir = os.path.dirname(os.path.abspath(__file__))
 processed_dir = os.path.join(script_dir, "..", "data", "processed")
+events_dir = os.path.join(processed_dir, "events")
 plots_dir = os.path.join(script_dir, "..", "plots")
+selection_path = os.path.join(processed_dir, "selections", "autok.npz")
+kmeans_dir = os.path.join(processed_dir, "models", "kmeans")
 os.makedirs(plots_dir, exist_ok=True)
 
-# ========== Load Combined CSVs ==========
-df_list = []
-for fname in os.listdir(processed_dir):
-    if fname.endswith(".csv"):
-        path = os.path.join(processed_dir, fname)
-        try:
-            df = pd.read_csv(path)
-            if df.empty:
-                continue
-            df["source_file"] = fname
-            df_list.append(df)
-        except:
-            continue
-
-combined_df = pd.concat(df_list, ignore_index=True)
-X = combined_df.select_dtypes(include="number").dropna(axis=1)
+parser = argparse.ArgumentParser(description="Choose the KMeans k by silhouette score (or another criterion).")
+parser.add_argument("--downsample", choices=METHODS, default="density",
+                    help="per-sample caps, optionally favoring cells in sparse regions")
+parser.add_argument("--criterion", choices=sorted(CRITERIA), default="silhouette")
+parser.add_argument("--silhouette-sample", type=int, default=5000, help="cells used to estimate the silhouette")
+parser.add_argument("--k-min", type=int, default=2)
+parser.add_argument("--k-max", type=int, default=9)
+parser.add_argument("--workers", type=int, default=0, help="k values fitted concurrently (0 = one per core)")
+args = parser.parse_args()
+
+# ========== Load Combined Events ==========
+combined_df = read_events(events_dir)
+X = combined_df.drop(columns=[ID_COLUMN], errors="ignore").select_dtypes(include="number").dropna(axis=1)
 
 # ========== Subsample & Scale ==========
-X_small = resample(X, n_samples=20000, random_state=42)
+X_small = downsample_events(combined_df, X, 20000, method=args.downsample, record_path=selection_path)
 scaler = StandardScaler()
 X_scaled = scaler.fit_transform(X_small)
 
 # ========== Silhouette Scoring ==========
 print("🔍 Running KMeans for different k values...")
-k_range = range(2, 10)
-scores = []
+k_range = range(args.k_min, args.k_max + 1)
+results = sweep_k(X_scaled, k_range, criterion=args.criterion, workers=args.workers,
+                  cache_dir=kmeans_dir, sample_size=args.silhouette_sample)
+scores = [r["score"] for r in results]
 
-for k in k_range:
-    kmeans = KMeans(n_clusters=k, random_state=42, n_init=10)
-    labels = kmeans.fit_predict(X_scaled)
-    score = silhouette_score(X_scaled, labels)
-    scores.append(score)
-    print(f"k = {k}, silhouette score = {score:.4f}")
+for r in results:
+    timing = "cached fit" if r["cached"] else f"⏱️ {r['seconds']:.2f}s"
+    print(f"k = {r['k']}, {args.criterion} score = {r['score']:.4f} ({timing})")
+print(f"✅ Best k = {best_k(results, args.criterion)} (fits cached in {kmeans_dir} for Flow_Tcell_cluster.py)")
 
 # ========== Plot Silhouette Scores ==========
+label = args.criterion.replace("_", "-").title()
 plt.figure(figsize=(8, 5))
 plt.plot(k_range, scores, marker='o')
-plt.title("Silhouette Score vs Number of Clusters (k)")
+plt.title(f"{label} Score vs Number of Clusters (k)")
 plt.xlabel("Number of Clusters (k)")
-plt.ylabel("Silhouette Score")
+plt.ylabel(f"{label} Score")
 plt.grid(True)
 plt.tight_layout()
 
@@ -1,49 +1,84 @@
 import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
-import umap
+import argparse
+import time
+import numpy as np
+from src.preprocessing.event_store import read_events, ID_COLUMN
+from src.analysis.embedding import load_or_fit
+from src.preprocessing.downsample import METHODS, downsample_events
+from src.analysis.kmeans_sweep import fingerprint, load_best_k, load_or_fit_kmeans, prune_fits
+from src.analysis.centroids import DEFAULT_CHUNK_SIZE, assign_store
 from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import KMeans
-from sklearn.utils import resample
 
 # ========== Setup ==========
 script_dir = os.path.dirname(os.path.abspath(__file__))
 processed_dir = os.path.join(script_dir, "..", "data", "processed")
+events_dir = os.path.join(processed_dir, "events")
 plots_dir = os.path.join(script_dir, "..", "plots")
+umap_path = os.path.join(processed_dir, "models", "umap_cluster.joblib")
+selection_path = os.path.join(processed_dir, "selections", "cluster.npz")
+kmeans_dir = os.path.join(processed_dir, "models", "kmeans")
 os.makedirs(plots_dir, exist_ok=True)
 
-# ========== Load and Combine CSVs ==========
-df_list = []
-for fname in os.listdir(processed_dir):
-    if fname.endswith(".csv"):
-        path = os.path.join(processed_dir, fname)
-        try:
-            df = pd.read_csv(path)
-            if df.empty:
-                continue
-            df["source_file"] = fname
-            df_list.append(df)
-        except:
-            continue
-
-combined_df = pd.concat(df_list, ignore_index=True)
-X = combined_df.select_dtypes(include="number").dropna(axis=1)
+parser = argparse.ArgumentParser(description="KMeans clusters on a UMAP of the event store.")
+parser.add_argument("--refit-umap", action="store_true", help="refit the reference UMAP instead of reusing it")
+parser.add_argument("--downsample", choices=METHODS, default="density",
+                    help="per-sample caps, optionally favoring cells in sparse regions")
+parser.add_argument("--k", type=int, default=None, help="clusters (default: best k from Flow_Tcell_autok.py, else 3)")
+parser.add_argument("--subsample-only", action="store_true",
+                    help="summarize the 20k subsample only instead of assigning every event to its nearest centroid")
+parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="events per assignment chunk")
+parser.add_argument("--save-labels", action="store_true", help="save the cluster of every event (by event_id)")
+args = parser.parse_args()
+
+timings = {}
+stage_start = time.perf_counter()
+
+
+def end_stage(name):
+    global stage_start
+    now = time.perf_counter()
+    timings[name] = now - stage_start
+    print(f"⏱️ {name}: {timings[name]:.2f}s")
+    stage_start = now
+
+
+# ========== Load Combined Events ==========
+combined_df = read_events(events_dir)
+X = combined_df.drop(columns=[ID_COLUMN], errors="ignore").select_dtypes(include="number").dropna(axis=1)
+end_stage("load events")
 
 # ========== Subsample, Scale, UMAP ==========
-X_small = resample(X, n_samples=20000, random_state=42)
-combined_df_small = combined_df.iloc[X_small.index]  # align metadata
+X_small = downsample_events(combined_df, X, 20000, method=args.downsample, record_path=selection_path)
+combined_df_small = combined_df.loc[X_small.index]  # align metadata
+end_stage("downsample")
 
+# Reference UMAP (and its scaler) is fitted once and reused; later runs only project
+ref, embedding, fitted = load_or_fit(umap_path, X_small, feature_cols=list(X.columns), refit=args.refit_umap,
+                                     n_neighbors=10, min_dist=0.5, metric="cosine")
+print(f"{'✅ Fitted and saved' if fitted else '📦 Projected with'} reference UMAP: {umap_path}")
+end_stage("UMAP")
+
+# Same selection and scaling as Flow_Tcell_autok.py, so its cached per-k fits apply
 scaler = StandardScaler()
 X_scaled = scaler.fit_transform(X_small)
 
-reducer = umap.UMAP(n_neighbors=10, min_dist=0.5, metric="cosine", random_state=42)
-embedding = reducer.fit_transform(X_scaled)
-
 # ========== KMeans Clustering ==========
-k = 3
-kmeans = KMeans(n_clusters=k, random_state=42, n_init=10)
-labels = kmeans.fit_predict(X_scaled)
+# The sweep's k only applies to the matrix it was chosen on
+fp = fingerprint(X_scaled)
+best = load_best_k(kmeans_dir, fp) if args.k is None else None
+k = args.k or (best["k"] if best else 3)
+kmeans, cached = load_or_fit_kmeans(X_scaled, k, cache_dir=kmeans_dir, fp=fp)
+# Keep the latest sweep's fits and this matrix's; anything older can't be reused
+latest = load_best_k(kmeans_dir)
+prune_fits(kmeans_dir, {fp} | ({latest["fingerprint"]} if latest else set()))
+labels = kmeans.labels_
+print(f"{'📦 Reusing cached' if cached else '✅ Fitted'} KMeans with k={k}")
+end_stage("KMeans")
 
 # ========== Plot: UMAP with Cluster Labels ==========
 plt.figure(figsize=(10, 7))
@@ -133,10 +168,37 @@ csv_path = os.path.join(processed_dir, "Flow_Tcell_clustered_data.csv")
 X_small_df.to_csv(csv_path, index=False)
 print(f"✅ Clustered data saved to: {csv_path}")
 
+end_stage("plots + subsample CSV")
+
 # ========== Summary Table ==========
-summary = X_small_df.groupby(["source_file", "cluster"]).size().unstack(fill_value=0)
+if args.subsample_only:
+    summary = X_small_df.groupby(["source_file", "cluster"]).size().unstack(fill_value=0)
+else:
+    # Every event of every sample goes to its nearest subsample centroid, chunk by chunk
+    del combined_df
+    summary, labels_by_file = assign_store(events_dir, list(X.columns), scaler.mean_, scaler.scale_,
+                                           kmeans.cluster_centers_, chunk_size=args.chunk_size,
+                                           keep_labels=args.save_labels)
+    end_stage(f"assign {int(summary.to_numpy().sum())} events")
+    if args.save_labels:
+        from src.preprocessing.event_store import read_partition
+        ids = [read_partition(events_dir, name, columns=[ID_COLUMN]).get(ID_COLUMN) for name in labels_by_file]
+        if any(i is None for i in ids):
+            raise ValueError("❌ Events have no event_id; re-run Flow_Tcell.py to re-ingest them.")
+        labels_path = os.path.join(processed_dir, "Flow_Tcell_cluster_labels.npz")
+        np.savez(labels_path, event_id=np.concatenate(ids), cluster=np.concatenate(list(labels_by_file.values())))
+        print(f"✅ Per-event cluster labels saved to: {labels_path}")
+
 summary_path = os.path.join(processed_dir, "Flow_Tcell_cluster_summary.csv")
 summary.to_csv(summary_path)
+frequencies = summary.div(summary.sum(axis=1), axis=0) * 100
+frequencies_path = os.path.join(processed_dir, "Flow_Tcell_cluster_frequencies.csv")
+frequencies.round(4).to_csv(frequencies_path)
 print(f"✅ Summary table saved to: {summary_path}")
-print("\n📊 Cells per cluster per sample:")
+print(f"✅ Cluster frequencies (% of each sample) saved to: {frequencies_path}")
+print(f"\n📊 Cells per cluster per sample ({'subsample' if args.subsample_only else 'all events'}):")
 print(summary)
+
+print("\n⏱️ Stage timings:")
+for name, seconds in timings.items():
+    print(f"  {name:<28} {seconds:8.2f}s")
@@ -1,51 +1,57 @@
 import os
-import glob
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
+from src.analysis.render import draw_violins, violin_aggregates
 
 # === Setup paths ===
 processed_dir = "/Users/nididev/Documents/FlowTcell-MM/data/processed"
 plots_dir = "/Users/nididev/Documents/FlowTcell-MM/plots"
-os.makedirs(plots_dir, exist_ok=True)
-
-# === Load all .csvs from processed/ ===
-csv_files = glob.glob(os.path.join(processed_dir, "*.csv"))
-df_list = []
-
-for path in csv_files:
-    try:
-        df = pd.read_csv(path)
-        df["source_file"] = os.path.basename(path)
-        df_list.append(df)
-    except Exception as e:
-        print(f"❌ Error reading {path}: {e}")
-
-if not df_list:
-    raise ValueError("❌ No valid CSVs found.")
-
-df_all = pd.concat(df_list, ignore_index=True)
-
-# === Must have 'anomaly' column ===
-if "anomaly" not in df_all.columns:
-    raise ValueError("❌ 'anomaly' column missing. Run detect_anomalies.py first.")
+anomaly_csv = os.path.join(processed_dir, "Flow_Tcell_anomalies.csv")
 
 # === Markers to plot ===
-marker_cols = ['CD3', 'CD4', 'CD8', 'CD25', 'IL2', 'CD62L', 'TNFa', 'IFNg']
-
-# === Generate violin plots ===
-for marker in marker_cols:
-    if marker not in df_all.columns:
-        print(f"⚠️ Skipping: {marker} not in data")
-        continue
-
-    plt.figure(figsize=(6, 4))
-    sns.violinplot(data=df_all, x="anomaly", y=marker, palette=["gray", "red"])
-    plt.title(f"{marker} Expression by Anomaly")
-    plt.xlabel("Anomaly")
-    plt.ylabel("Expression")
-    plt.tight_layout()
-    plt.savefig(os.path.join(plots_dir, f"violin_{marker}.png"), dpi=300)
-    plt.close()
-
-print(f"✅ Violin plots saved to: {plots_dir}")
+MARKER_COLS = ['CD3', 'CD4', 'CD8', 'CD25', 'IL2', 'CD62L', 'TNFa', 'IFNg']
+
+
+def load_anomalies(marker_cols=MARKER_COLS):
+    """Only the anomaly flag and marker columns of the anomaly table."""
+    if not os.path.exists(anomaly_csv):
+        raise FileNotFoundError("❌ Flow_Tcell_anomalies.csv not found. Run detect_anomalies.py first.")
+    header = pd.read_csv(anomaly_csv, nrows=0).columns
+
+    # === Must have 'anomaly' column ===
+    if "anomaly" not in header:
+        raise ValueError("❌ 'anomaly' column missing. Run detect_anomalies.py first.")
+    return pd.read_csv(anomaly_csv, usecols=["anomaly"] + [m for m in marker_cols if m in header])
+
+
+def plot_violins(df_all=None, marker_cols=MARKER_COLS):
+    """Violin plot of every marker by anomaly flag; returns {marker: png path}."""
+    import matplotlib.pyplot as plt
+    # Binned densities instead of a KDE over every event (see src/analysis/render.py)
+    df_all = load_anomalies(marker_cols) if df_all is None else df_all
+    os.makedirs(plots_dir, exist_ok=True)
+
+    # === Generate violin plots ===
+    paths = {}
+    for marker in marker_cols:
+        if marker not in df_all.columns:
+            print(f"⚠️ Skipping: {marker} not in data")
+            continue
+
+        fig, ax = plt.subplots(figsize=(6, 4))
+        draw_violins(ax, violin_aggregates(df_all[marker], df_all["anomaly"], levels=[0, 1]), colors=["gray", "red"])
+        plt.title(f"{marker} Expression by Anomaly")
+        plt.xlabel("Anomaly")
+        plt.ylabel("Expression")
+        plt.tight_layout()
+        paths[marker] = os.path.join(plots_dir, f"violin_{marker}.png")
+        plt.savefig(paths[marker], dpi=300)
+        plt.close()
+
+    print(f"✅ Violin plots saved to: {plots_dir}")
+    return paths
+
+
+if __name__ == "__main__":
+    plot_violins()
@@ -0,0 +1,154 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from src.preprocessing.parallel import resolve_workers
+
+# Isolation-forest anomaly engine for cell features.
+#
+# The forest is fitted on a random subsample (isolation trees only ever see
+# max_samples=256 points each, so fitting on millions of rows buys nothing) and
+# the full dataset is then scored in fixed-size chunks on a thread pool; the tree
+# traversal runs in compiled code without the GIL, so chunks score in parallel
+# and memory stays bounded by chunk_size regardless of how many events there are.
+#
+#   anomaly_score  = -decision_function: > 0 means more anomalous than the
+#                    contamination threshold learned at fit time
+#   anomaly        = 1 if anomaly_score > 0 (what IsolationForest.predict would flag)
+#
+# A fitted detector is persisted with joblib together with its feature columns
+# and the scaler statistics of the graph, so new samples can be scored from raw
+# marker values without refitting.
+
+DEFAULT_CHUNK_SIZE = 100_000
+MODEL_FILE = "anomaly_iforest.joblib"
+
+
+class _ScaledColumns:
+    """Row slices of memory-mapped store columns as a scaled feature matrix (missing markers = 0)."""
+
+    def __init__(self, columns, n, feature_cols, transform):
+        self.columns, self.n, self.feature_cols, self.transform = columns, n, feature_cols, transform
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, rows):
+        length = len(range(*rows.indices(self.n)))
+        X = np.zeros((length, len(self.feature_cols)), dtype=np.float32)
+        for j, col in enumerate(self.feature_cols):
+            if col in self.columns:
+                X[:, j] = self.columns[col][rows]
+        return self.transform(np.nan_to_num(X, nan=0.0))
+
+
+class AnomalyDetector:
+    def __init__(self, n_estimators=100, contamination=0.05, max_fit_samples=200_000, random_state=42,
+                 n_jobs=-1, feature_cols=None, mean=None, scale=None):
+        self.n_estimators = n_estimators
+        self.contamination = contamination
+        self.max_fit_samples = max_fit_samples
+        self.random_state = random_state
+        self.n_jobs = n_jobs
+        self.feature_cols = list(feature_cols) if feature_cols is not None else None
+        self.mean = None if mean is None else np.asarray(mean, dtype=np.float32)
+        self.scale = None if scale is None else np.asarray(scale, dtype=np.float32)
+        self.model = None
+        self.n_fit = 0
+
+    def fit(self, X):
+        from sklearn.ensemble import IsolationForest
+        X = np.asarray(X, dtype=np.float32)
+        rng = np.random.default_rng(self.random_state)
+        if len(X) > self.max_fit_samples:
+            rows = np.sort(rng.choice(len(X), size=self.max_fit_samples, replace=False))
+            X = X[rows]
+        self.model = IsolationForest(n_estimators=self.n_estimators, contamination=self.contamination,
+                                     random_state=self.random_state, n_jobs=self.n_jobs).fit(X)
+        self.n_fit = len(X)
+        return self
+
+    def matches(self, n_features, feature_cols=None, mean=None, scale=None):
+        """True if the fitted forest takes n_features columns with these markers and scaler statistics."""
+        if self.model is None or getattr(self.model, "n_features_in_", n_features) != n_features:
+            return False
+        cols = list(feature_cols) if feature_cols is not None else None
+        if cols != self.feature_cols:
+            return False
+        for ours, theirs in ((self.mean, mean), (self.scale, scale)):
+            if (ours is None) != (theirs is None):
+                return False
+            if ours is not None and (np.shape(ours) != np.shape(theirs) or not np.allclose(ours, theirs)):
+                return False
+        return True
+
+    def score(self, X, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+        """
+        Continuous anomaly scores (float32) for every row of X, computed chunk by chunk.
+        progress(fraction, message) is called as chunks finish.
+        """
+        if self.model is None:
+            raise ValueError("❌ AnomalyDetector is not fitted")
+        n = len(X)
+        scores = np.empty(n, dtype=np.float32)
+
+        starts = range(0, n, chunk_size)
+        done = [0]
+        lock = threading.Lock()
+
+        def score_chunk(start):
+            chunk = np.asarray(X[start:start + chunk_size], dtype=np.float32)
+            scores[start:start + len(chunk)] = -self.model.decision_function(chunk)
+            if progress is not None:
+                with lock:
+                    done[0] += 1
+                    progress(done[0] / len(starts), f"scored chunk {done[0]}/{len(starts)}")
+
+        workers = min(resolve_workers(self.n_jobs), max(len(starts), 1))
+        # One level of parallelism: with several chunk threads each forest call stays single-threaded
+        self.model.n_jobs = 1 if workers > 1 else self.n_jobs
+        if workers == 1:
+            for start in starts:
+                score_chunk(start)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(score_chunk, starts))
+        return scores
+
+    @staticmethod
+    def flag(scores):
+        return (np.asarray(scores) > 0).astype(np.int8)
+
+    def transform(self, X):
+        """Raw marker values → the scaled features the detector was fitted on."""
+        if self.mean is None:
+            return np.asarray(X, dtype=np.float32)
+        return ((np.asarray(X, dtype=np.float32) - self.mean) / self.scale).astype(np.float32)
+
+    def score_frame(self, df, chunk_size=DEFAULT_CHUNK_SIZE):
+        """(scores, flags) for a DataFrame of raw marker values (missing markers count as 0)."""
+        X = df.reindex(columns=self.feature_cols).fillna(0).to_numpy(dtype=np.float32)
+        scores = self.score(self.transform(X), chunk_size)
+        return scores, self.flag(scores)
+
+    def score_partition(self, store_dir, source_file, chunk_size=DEFAULT_CHUNK_SIZE):
+        """(scores, flags) for one event-store partition, read chunk by chunk from its memory maps."""
+        from src.preprocessing.event_store import partition_info, read_partition
+        n = partition_info(store_dir, source_file)["n_events"]
+        columns = read_partition(store_dir, source_file, columns=self.feature_cols, mmap=True)
+        scores = self.score(_ScaledColumns(columns, n, self.feature_cols, self.transform), chunk_size)
+        return scores, self.flag(scores)
+
+    def save(self, path):
+        import joblib
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        joblib.dump(self, path)
+        return path
+
+    @staticmethod
+    def load(path):
+        import joblib
+        detector = joblib.load(path)
+        if not isinstance(detector, AnomalyDetector):
+            raise ValueError(f"❌ {path} does not contain an AnomalyDetector")
+        return detector
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+
+# Nearest-centroid assignment of every stored event to clusters fitted on a subsample.
+#
+# Partitions are read straight from the event store's memory maps in chunks of
+# chunk_size events; each chunk is scaled with the subsample's scaler and
+# assigned with one matrix product (|x|² - 2x·c + |c|²), so memory is bounded
+# by the chunk and the cost is O(events × k × features).
+
+DEFAULT_CHUNK_SIZE = 1_000_000
+
+
+def nearest_centroid(X, centers):
+    """Index of the nearest center (squared Euclidean) for every row of X."""
+    X = np.asarray(X, dtype=np.float32)
+    centers = np.asarray(centers, dtype=np.float32)
+    d = (centers ** 2).sum(axis=1)[None, :] - 2.0 * (X @ centers.T)
+    # |x|² is the same for every center, so it doesn't change the argmin
+    return d.argmin(axis=1)
+
+
+def assign_partition(store_dir, source_file, feature_cols, mean, scale, centers, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Cluster label (int16) of every event in one partition."""
+    from src.preprocessing.event_store import partition_info, read_partition
+    n = partition_info(store_dir, source_file)["n_events"]
+    columns = read_partition(store_dir, source_file, columns=feature_cols, mmap=True)
+    mean = np.asarray(mean, dtype=np.float32)
+    scale = np.asarray(scale, dtype=np.float32)
+    labels = np.empty(n, dtype=np.int16)
+    for start in range(0, n, chunk_size):
+        stop = min(start + chunk_size, n)
+        X = np.empty((stop - start, len(feature_cols)), dtype=np.float32)
+        for j, col in enumerate(feature_cols):
+            # Missing channels sit at the scaler mean, i.e. 0 after scaling
+            X[:, j] = columns[col][start:stop] if col in columns else mean[j]
+        X = (np.nan_to_num(X, nan=0.0) - mean) / scale
+        labels[start:stop] = nearest_centroid(X, centers)
+    return labels
+
+
+def assign_store(store_dir, feature_cols, mean, scale, centers, source_files=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                 keep_labels=False):
+    """
+    Assign every event of every partition; returns (counts DataFrame samples × clusters,
+    {source_file: labels} if keep_labels else None).
+    """
+    from src.preprocessing.event_store import list_partitions
+    names = source_files if source_files is not None else list_partitions(store_dir)
+    k = len(centers)
+    counts = {}
+    labels_by_file = {} if keep_labels else None
+    for name in names:
+        labels = assign_partition(store_dir, name, feature_cols, mean, scale, centers, chunk_size)
+        counts[name] = np.bincount(labels, minlength=k)
+        if keep_labels:
+            labels_by_file[name] = labels
+    table = pd.DataFrame.from_dict(counts, orient="index", columns=range(k))
+    table.index.name = "source_file"
+    table.columns.name = "cluster"
+    return table, labels_by_file
@@ -1,63 +1,237 @@
 import os
-import glob
-import torch
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+import argparse
+import time
 import pandas as pd
 import numpy as np
-import umap
-import matplotlib.pyplot as plt
-from sklearn.ensemble import IsolationForest
-from torch_geometric.data import Data
+from src.preprocessing.event_store import ID_COLUMN, event_positions, read_events, read_partition
+from src.analysis.anomaly import AnomalyDetector, DEFAULT_CHUNK_SIZE, MODEL_FILE
+from src.analysis.embedding import ReferenceEmbedding, load_or_fit
+from src.analysis.render import draw_raster, raster_aggregate
+from src.pipeline.profiling import span
+from src.pipeline.stage_cache import StageCache, code_version
 
 # === Paths ===
 graph_path = "/Users/nididev/Documents/FlowTcell-MM/src/modeling/cell_graph.pt"
+state_dir = os.path.join(os.path.dirname(graph_path), "graph_state")
 processed_dir = "/Users/nididev/Documents/FlowTcell-MM/data/processed"
+gated_dir = os.path.join(processed_dir, "gated")
+model_path = os.path.join(processed_dir, "models", MODEL_FILE)
+umap_path = os.path.join(processed_dir, "models", "umap_graph_features.joblib")
+samples_dir = os.path.join(processed_dir, "anomalies")
 out_csv = os.path.join(processed_dir, "Flow_Tcell_anomalies.csv")
+out_umap_csv = os.path.join(processed_dir, "Flow_Tcell_anomalies_umap.csv")
+cache_dir = os.path.join(processed_dir, "cache")
 out_umap = "/Users/nididev/Documents/FlowTcell-MM/plots/Flow_Tcell_anomalies_umap.png"
 
-# === Load graph ===
-data = torch.load(graph_path, weights_only=False)
-X = data.x.numpy()
-
-# === Load all CSVs
-csv_files = glob.glob(os.path.join(processed_dir, "*.csv"))
-df_list = []
-for path in csv_files:
-    try:
-        df = pd.read_csv(path)
-        df["source_file"] = os.path.basename(path)
-        df_list.append(df)
-    except Exception as e:
-        print(f"❌ Error reading {path}: {e}")
-
-if not df_list:
-    raise ValueError("❌ No valid CSVs found.")
-
-df_all = pd.concat(df_list, ignore_index=True)
-df_used = df_all.iloc[:X.shape[0]].reset_index(drop=True)
-
-# === Isolation Forest
-print("🔍 Detecting anomalies on GNN node features...")
-iso = IsolationForest(n_estimators=100, contamination=0.05, random_state=42)
-anomaly_labels = (iso.fit_predict(X) == -1).astype(int)
-
-# === Save
-df_used["anomaly"] = anomaly_labels
-df_used["true_label"] = data.y.numpy()
-df_used[[f"feat_{i}" for i in range(X.shape[1])]] = X
-df_used.to_csv(out_csv, index=False)
-print(f"✅ Anomaly-annotated CSV saved to: {out_csv}")
-
-# === UMAP
-print("📊 Visualizing anomalies in UMAP...")
-reducer = umap.UMAP(random_state=42)
-embedding = reducer.fit_transform(X)
-colors = ['gray' if a == 0 else 'red' for a in anomaly_labels]
-
-plt.figure(figsize=(10, 6))
-plt.scatter(embedding[:, 0], embedding[:, 1], c=colors, s=8, alpha=0.7)
-plt.title("UMAP of GNN Features with Anomalies Highlighted")
-plt.xlabel("UMAP 1")
-plt.ylabel("UMAP 2")
-plt.tight_layout()
-plt.savefig(out_umap, dpi=300)
-plt.show()
+
+
+def graph_scaling():
+    """(marker columns, mean, scale) of the persisted graph state, or Nones without one."""
+    if not os.path.exists(os.path.join(state_dir, "manifest.json")):
+        return None, None, None
+    from src.modeling.graph_state import GraphState
+    state, _ = GraphState.load_meta(state_dir)
+    return state.marker_cols, state.mean, state.scale
+
+
+def load_matching_detector(n_features, n_jobs=-1):
+    """
+    The saved detector if it was fitted on n_features columns with the graph's current
+    markers and scaling; None (after a warning) if it is missing or stale.
+    """
+    if not os.path.exists(model_path):
+        return None
+    detector = AnomalyDetector.load(model_path)
+    if not detector.matches(n_features, *graph_scaling()):
+        print(f"⚠️ Saved anomaly model {model_path} was fitted on other markers/scaling; refitting.")
+        return None
+    detector.n_jobs = n_jobs
+    return detector
+
+
+def fit_detector(X, max_fit_samples=200_000, n_jobs=-1):
+    # Scaler statistics let new samples be scored from raw marker values later
+    marker_cols, mean, scale = graph_scaling()
+    detector = AnomalyDetector(n_estimators=100, contamination=0.05, max_fit_samples=max_fit_samples,
+                               random_state=42, n_jobs=n_jobs,
+                               feature_cols=marker_cols, mean=mean, scale=scale)
+    start = time.perf_counter()
+    with span("isolation forest fit") as sp:
+        detector.fit(X)
+        sp.count("cells", detector.n_fit)
+    print(f"⏱️ Fitted on {detector.n_fit} of {len(X)} cells in {time.perf_counter() - start:.2f}s")
+    detector.save(model_path)
+    print(f"💾 Model saved to: {model_path}")
+    return detector
+
+
+def score_samples(names, n_jobs=-1, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Score gated samples with the saved model (no graph, no refit); one CSV per sample in samples_dir."""
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"❌ No saved anomaly model at {model_path}. Run without --samples first.")
+    detector = AnomalyDetector.load(model_path)
+    detector.n_jobs = n_jobs
+    if detector.feature_cols is None:
+        raise ValueError("❌ Saved model has no marker scaling; refit it after building the graph.")
+    os.makedirs(samples_dir, exist_ok=True)
+    for name in names:
+        start = time.perf_counter()
+        scores, flags = detector.score_partition(gated_dir, name, chunk_size=chunk_size)
+        ids = read_partition(gated_dir, name, columns=[ID_COLUMN]).get(ID_COLUMN)
+        out = pd.DataFrame({"anomaly_score": scores, "anomaly": flags})
+        if ids is not None:
+            out.insert(0, ID_COLUMN, np.asarray(ids))
+        out.to_csv(os.path.join(samples_dir, f"{name}.csv"), index=False)
+        print(f"✅ {name}: {int(flags.sum())}/{len(flags)} anomalous ({time.perf_counter() - start:.2f}s)")
+
+
+def score_graph(data, refit=False, max_fit_samples=200_000, n_jobs=-1, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    """Anomaly table of the graph's cells (gated events + anomaly flag/score + graph features), saved to out_csv."""
+    X = data.x.numpy()
+
+    # === Load gated events, aligned to graph nodes by event id
+    node_ids = getattr(data, ID_COLUMN, None)
+    if node_ids is None or bool((node_ids < 0).any()):
+        raise ValueError("❌ Graph has no event ids; re-run apply_gates.py and build_graph.py.")
+    with span("load events") as sp:
+        df_all = read_events(gated_dir)
+        sp.count("events", len(df_all))
+    positions = event_positions(df_all[ID_COLUMN], node_ids.numpy())
+    if (positions < 0).any():
+        raise ValueError(f"❌ {int((positions < 0).sum())} graph nodes are missing from the gated store; rebuild the graph.")
+    df_used = df_all.iloc[positions].reset_index(drop=True)
+
+    # === Isolation Forest
+    print("🔍 Detecting anomalies on GNN node features...")
+    detector = None if refit else load_matching_detector(X.shape[1], n_jobs)
+    if detector is not None:
+        print(f"📦 Using saved model: {model_path} (--refit to retrain)")
+    else:
+        detector = fit_detector(X, max_fit_samples, n_jobs)
+
+    start = time.perf_counter()
+    with span("anomaly scoring", n_jobs=n_jobs) as sp:
+        anomaly_scores = detector.score(X, chunk_size=chunk_size, progress=progress)
+        sp.count("cells", len(X))
+    anomaly_labels = detector.flag(anomaly_scores)
+    print(f"⏱️ Scored {len(X)} cells in {time.perf_counter() - start:.2f}s; {int(anomaly_labels.sum())} anomalous")
+
+    # === Save
+    df_used["anomaly"] = anomaly_labels
+    df_used["anomaly_score"] = anomaly_scores
+    df_used["true_label"] = data.y.numpy()
+    df_used[[f"feat_{i}" for i in range(X.shape[1])]] = X
+    df_used.to_csv(out_csv, index=False)
+    print(f"✅ Anomaly-annotated CSV saved to: {out_csv}")
+    return df_used
+
+
+def embed_graph(data, refit_umap=False):
+    """UMAP coordinates of the graph's cells in the persisted reference embedding, saved to out_umap_csv."""
+    # Graph features are already scaled, so the reference UMAP has no scaler of its own. Its
+    # feature columns carry the graph's markers and scaling, so a reference fitted on another
+    # graph layout is refitted instead of reused
+    marker_cols, mean, scale = graph_scaling()
+    if marker_cols is not None and len(marker_cols) == data.x.shape[1]:
+        feature_cols = [f"{col}:{m:.6g}/{s:.6g}" for col, m, s in zip(marker_cols, mean, scale)]
+    else:
+        feature_cols = [f"feat_{i}" for i in range(data.x.shape[1])]
+    _, embedding, fitted = load_or_fit(umap_path, data.x.numpy(), feature_cols=feature_cols, refit=refit_umap,
+                                       scale=False)
+    print(f"{'✅ Fitted and saved' if fitted else '📦 Projected with'} reference UMAP: {umap_path}")
+    pd.DataFrame({ID_COLUMN: getattr(data, ID_COLUMN).numpy(), "UMAP1": embedding[:, 0],
+                  "UMAP2": embedding[:, 1]}).to_csv(out_umap_csv, index=False)
+    print(f"✅ UMAP coordinates saved to: {out_umap_csv}")
+    return embedding
+
+
+def detect(data=None, refit=False, refit_umap=False, max_fit_samples=200_000, n_jobs=-1,
+           chunk_size=DEFAULT_CHUNK_SIZE, use_cache=True, show=False, embed_umap=True, progress=None):
+    """
+    Score every graph cell, embed the graph features and plot the anomalies;
+    returns (anomaly table, UMAP embedding). `data` defaults to cell_graph.pt.
+    With embed_umap=False only the scores are computed (the embedding is None).
+    progress(fraction, message): scoring reports 0-0.8 by chunk, the UMAP the rest.
+    """
+    if data is None:
+        import torch
+        data = torch.load(graph_path, weights_only=False)
+
+    # === Run (or restore from the stage cache)
+    # Scores depend on the graph, the gated events and the forest: a saved model is an
+    # input, a refit one is an output. The same holds for the reference UMAP.
+    results = {}
+    reuse_model = not refit and load_matching_detector(data.x.shape[1]) is not None
+
+    def score():
+        report = None if progress is None else (lambda f, msg: progress(0.8 * f, msg))
+        results["table"] = score_graph(data, not reuse_model, max_fit_samples, n_jobs, chunk_size, report)
+
+    def embed():
+        if progress is not None:
+            progress(0.8, "embedding graph features (UMAP)")
+        results["embedding"] = embed_graph(data, refit_umap)
+
+    if not use_cache:
+        score()
+    else:
+        cache = StageCache(cache_dir)
+        hit, key = cache.run("anomalies", score, inputs=[graph_path, gated_dir] + [model_path] * reuse_model,
+                             params={"max_fit_samples": max_fit_samples, "refit": not reuse_model},
+                             code=code_version(__file__, AnomalyDetector), outputs=[out_csv, model_path])
+        if hit:
+            print(f"💾 Restored anomaly scores from stage cache ({key[:12]})")
+    table = results["table"] if "table" in results else pd.read_csv(out_csv)
+    if not embed_umap:
+        return table, None
+
+    print("📊 Visualizing anomalies in UMAP...")
+    if not use_cache:
+        embed()
+    else:
+        reuse_umap = os.path.exists(umap_path) and not refit_umap
+        hit, key = cache.run("anomaly_umap", embed, inputs=[graph_path] + [umap_path] * reuse_umap,
+                             params={"refit": not reuse_umap}, code=code_version(__file__, ReferenceEmbedding),
+                             outputs=[out_umap_csv, umap_path])
+        if hit:
+            print(f"💾 Restored UMAP coordinates from stage cache ({key[:12]})")
+
+    embedding = (results["embedding"] if "embedding" in results
+                 else pd.read_csv(out_umap_csv, usecols=["UMAP1", "UMAP2"]).to_numpy())
+
+    # Rasterized: every cell is binned into a pixel instead of drawn as a marker
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots(figsize=(10, 6))
+    draw_raster(ax, raster_aggregate(embedding[:, 0], embedding[:, 1], table["anomaly"].to_numpy(), levels=[0, 1]),
+                colors=["gray", "red"])
+    plt.title("UMAP of GNN Features with Anomalies Highlighted")
+    plt.xlabel("UMAP 1")
+    plt.ylabel("UMAP 2")
+    plt.tight_layout()
+    plt.savefig(out_umap, dpi=300)
+    if show:
+        plt.show()
+    plt.close()
+    return table, embedding
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Isolation-forest anomaly detection on GNN node features.")
+    parser.add_argument("--refit", action="store_true", help="refit even if a saved model exists")
+    parser.add_argument("--max-fit-samples", type=int, default=200_000, help="cells subsampled to fit the forest")
+    parser.add_argument("--n-jobs", type=int, default=-1, help="threads for fitting and chunked scoring")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="cells scored per chunk")
+    parser.add_argument("--refit-umap", action="store_true", help="refit the reference UMAP instead of reusing it")
+    parser.add_argument("--samples", nargs="+", default=None,
+                        help="only score these gated samples with the saved model (no graph, no refit)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always rescore instead of restoring unchanged results from the stage cache")
+    args = parser.parse_args()
+
+    if args.samples:
+        score_samples(args.samples, n_jobs=args.n_jobs, chunk_size=args.chunk_size)
+    else:
+        detect(refit=args.refit, refit_umap=args.refit_umap, max_fit_samples=args.max_fit_samples,
+               n_jobs=args.n_jobs, chunk_size=args.chunk_size, use_cache=not args.no_cache, show=True)
@@ -0,0 +1,112 @@
+import os
+import sys
+import numpy as np
+from src.pipeline.profiling import span
+
+# Reference UMAP embeddings that are fitted once and reused.
+#
+# A ReferenceEmbedding holds a fitted umap.UMAP plus the StandardScaler it was
+# fitted behind, and is persisted with joblib (e.g. data/processed/models/).
+# Later runs load it and only pay for reducer.transform(), so embeddings of new
+# samples land in the same coordinate system as the reference cohort.
+#
+#   ref, embedding, fitted = load_or_fit(path, X, feature_cols=cols, n_neighbors=15, min_dist=0.1)
+#
+# A persisted reference is refitted automatically if it was built for other
+# feature columns or UMAP parameters.
+#
+# umap is imported only when a reference is fitted or loaded (it pulls in numba),
+# and numba's on-disk cache is pointed at NUMBA_CACHE_DIR (default
+# ~/.cache/flowsense/numba), so UMAP's JIT-compiled functions are compiled once
+# per machine instead of once per process.
+
+NUMBA_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "flowsense", "numba")
+
+
+def import_umap():
+    """Import umap with numba's compilation cache enabled."""
+    if "NUMBA_CACHE_DIR" not in os.environ:
+        os.makedirs(NUMBA_CACHE_DIR, exist_ok=True)
+        os.environ["NUMBA_CACHE_DIR"] = NUMBA_CACHE_DIR
+        # numba reads the variable once at import (torch_geometric may have imported it already)
+        if "numba" in sys.modules:
+            sys.modules["numba"].config.CACHE_DIR = NUMBA_CACHE_DIR
+    import umap
+    return umap
+
+
+class ReferenceEmbedding:
+    def __init__(self, feature_cols=None, scale=True, random_state=42, **umap_params):
+        self.feature_cols = list(feature_cols) if feature_cols is not None else None
+        self.scale = scale
+        self.random_state = random_state
+        self.umap_params = dict(umap_params)
+        self.scaler = None
+        self.reducer = None
+        self.n_fit = 0
+
+    def matches(self, feature_cols=None, scale=True, random_state=42, **umap_params):
+        cols = list(feature_cols) if feature_cols is not None else None
+        return (cols == self.feature_cols and scale == self.scale and random_state == self.random_state
+                and dict(umap_params) == self.umap_params)
+
+    def scale_features(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        return self.scaler.transform(X) if self.scaler is not None else X
+
+    def fit_transform(self, X):
+        umap = import_umap()
+        from sklearn.preprocessing import StandardScaler
+        X = np.asarray(X, dtype=np.float32)
+        self.scaler = StandardScaler().fit(X) if self.scale else None
+        self.reducer = umap.UMAP(random_state=self.random_state, **self.umap_params)
+        self.n_fit = len(X)
+        return self.reducer.fit_transform(self.scale_features(X))
+
+    def fit(self, X):
+        self.fit_transform(X)
+        return self
+
+    def transform(self, X):
+        """Project new cells into the reference embedding (no refit)."""
+        if self.reducer is None:
+            raise ValueError("❌ ReferenceEmbedding is not fitted")
+        return self.reducer.transform(self.scale_features(X))
+
+    def save(self, path):
+        import joblib
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        joblib.dump(self, path)
+        return path
+
+    @staticmethod
+    def load(path):
+        import joblib
+        # Unpickling the reducer imports umap; make sure the cache is set up first
+        import_umap()
+        ref = joblib.load(path)
+        if not isinstance(ref, ReferenceEmbedding):
+            raise ValueError(f"❌ {path} does not contain a ReferenceEmbedding")
+        return ref
+
+
+def load_or_fit(path, X, feature_cols=None, refit=False, scale=True, random_state=42, **umap_params):
+    """
+    (reference, embedding of X, fitted) — project X with the reference persisted at
+    `path`, or fit a new reference on X (and save it) if there is none, it does not
+    match the requested features/parameters, or refit=True.
+    """
+    if not refit and os.path.exists(path):
+        ref = ReferenceEmbedding.load(path)
+        if ref.matches(feature_cols, scale, random_state, **umap_params):
+            with span("umap transform") as sp:
+                embedding = ref.transform(X)
+                sp.count("cells", len(embedding))
+            return ref, embedding, False
+        print(f"⚠️ Reference embedding {os.path.basename(path)} was fitted with other features/parameters; refitting.")
+    ref = ReferenceEmbedding(feature_cols, scale, random_state, **umap_params)
+    with span("umap fit") as sp:
+        embedding = ref.fit_transform(X)
+        sp.count("cells", len(embedding))
+    ref.save(path)
+    return ref, embedding, True
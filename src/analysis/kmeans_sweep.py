@@ -0,0 +1,135 @@
+import os
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from src.preprocessing.parallel import resolve_workers
+
+# Choosing k for KMeans, with every k evaluated concurrently and every fit cached.
+#
+#   criteria     silhouette (on a random subset of sample_size cells, instead of
+#                the full O(n²) score), calinski_harabasz, davies_bouldin (lower is better)
+#   large inputs above MINIBATCH_THRESHOLD cells use MiniBatchKMeans
+#   cache        <cache_dir>/kmeans_k<k>_<fingerprint>.joblib, where the fingerprint
+#                hashes the exact matrix that was clustered, so Flow_Tcell_cluster.py
+#                reuses the fit made by Flow_Tcell_autok.py whenever it clusters the
+#                same cells; best_k.json records the last sweep's choice and the
+#                fingerprint it was made on, and fits of any other matrix are pruned
+#
+# Fits run on a thread pool: KMeans releases the GIL in its compiled loops, and
+# each fit's own OpenMP threads are limited so the workers don't oversubscribe.
+
+CRITERIA = {"silhouette": "max", "calinski_harabasz": "max", "davies_bouldin": "min"}
+MINIBATCH_THRESHOLD = 100_000
+BEST_K_FILE = "best_k.json"
+
+
+def fingerprint(X):
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    return hashlib.sha1(X.tobytes() + str(X.shape).encode()).hexdigest()[:16]
+
+
+def cache_path(cache_dir, k, fp):
+    return os.path.join(cache_dir, f"kmeans_k{k}_{fp}.joblib")
+
+
+def prune_fits(cache_dir, keep):
+    """Delete cached fits whose fingerprint isn't in keep; returns how many were removed."""
+    if not os.path.isdir(cache_dir):
+        return 0
+    removed = 0
+    for name in os.listdir(cache_dir):
+        if name.startswith("kmeans_k") and name.endswith(".joblib"):
+            if name[:-len(".joblib")].rsplit("_", 1)[-1] not in keep:
+                os.remove(os.path.join(cache_dir, name))
+                removed += 1
+    return removed
+
+
+def fit_kmeans(X, k, random_state=42):
+    from sklearn.cluster import KMeans, MiniBatchKMeans
+    if len(X) > MINIBATCH_THRESHOLD:
+        model = MiniBatchKMeans(n_clusters=k, random_state=random_state, n_init=3, batch_size=4096)
+    else:
+        model = KMeans(n_clusters=k, random_state=random_state, n_init=10)
+    return model.fit(X)
+
+
+def score_labels(X, labels, criterion="silhouette", sample_size=5000, random_state=42):
+    from sklearn import metrics
+    if criterion == "silhouette":
+        return float(metrics.silhouette_score(X, labels, sample_size=min(sample_size, len(X)),
+                                              random_state=random_state))
+    if criterion == "calinski_harabasz":
+        return float(metrics.calinski_harabasz_score(X, labels))
+    if criterion == "davies_bouldin":
+        return float(metrics.davies_bouldin_score(X, labels))
+    raise ValueError(f"❌ Unknown criterion {criterion!r}; choose from {sorted(CRITERIA)}")
+
+
+def load_or_fit_kmeans(X, k, cache_dir=None, random_state=42, fp=None):
+    """(fitted model, from_cache) for k clusters on X, reusing a cached fit of the same matrix."""
+    import joblib
+    if cache_dir:
+        path = cache_path(cache_dir, k, fp or fingerprint(X))
+        if os.path.exists(path):
+            return joblib.load(path), True
+    model = fit_kmeans(X, k, random_state)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        joblib.dump(model, path)
+    return model, False
+
+
+def sweep_k(X, k_values, criterion="silhouette", workers=0, cache_dir=None, sample_size=5000, random_state=42):
+    """
+    Fit and score every k concurrently; returns [{"k", "score", "seconds", "cached"}] in k order.
+    The best k (by criterion) is written to <cache_dir>/best_k.json, and cached fits of
+    other matrices are deleted.
+    """
+    import time
+    from threadpoolctl import threadpool_limits
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    fp = fingerprint(X)
+    k_values = list(k_values)
+    workers = min(resolve_workers(workers), len(k_values))
+
+    def run(k):
+        start = time.perf_counter()
+        model, cached = load_or_fit_kmeans(X, k, cache_dir, random_state, fp)
+        score = score_labels(X, model.labels_, criterion, sample_size, random_state)
+        return {"k": k, "score": score, "seconds": time.perf_counter() - start, "cached": cached}
+
+    with threadpool_limits(limits=max(1, (os.cpu_count() or 1) // workers)):
+        if workers == 1:
+            results = [run(k) for k in k_values]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(run, k_values))
+
+    if cache_dir:
+        best = best_k(results, criterion)
+        with open(os.path.join(cache_dir, BEST_K_FILE), "w") as f:
+            json.dump({"k": best, "criterion": criterion, "fingerprint": fp,
+                       "scores": {str(r["k"]): r["score"] for r in results}}, f, indent=2)
+        prune_fits(cache_dir, {fp})
+    return results
+
+
+def best_k(results, criterion="silhouette"):
+    pick = max if CRITERIA[criterion] == "max" else min
+    return pick(results, key=lambda r: r["score"])["k"]
+
+
+def load_best_k(cache_dir, fp=None):
+    """The last sweep's best_k.json, or None; with fp, also None if the sweep clustered a different matrix."""
+    path = os.path.join(cache_dir, BEST_K_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        best = json.load(f)
+    if fp is not None and best.get("fingerprint") != fp:
+        print(f"⚠️ best_k.json (k={best['k']}) was chosen on different cells "
+              f"(other --downsample or an older store); ignoring it.")
+        return None
+    return best
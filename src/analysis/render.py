@@ -0,0 +1,140 @@
+import numpy as np
+
+# Aggregate-then-draw plotting for millions of events.
+#
+# Nothing here hands per-event data to matplotlib or seaborn:
+#
+#   violins   violin_aggregates() bins every (group, value) pair in one
+#             np.bincount pass, lightly smooths each group's histogram and records
+#             its quartiles; draw_violins() fills one polygon per group
+#   scatters  raster_aggregate() bins points onto a width × height pixel grid
+#             (per category, if given) with np.bincount; shade() turns the counts
+#             into an RGBA image (category colors mixed by count, alpha on a log
+#             scale) and draw_raster() shows it with a single imshow
+#
+# Aggregation is O(events) with no sorting or KDE, and the aggregates are small
+# dicts of arrays, so the Streamlit apps can cache them and redraw on reruns
+# without touching the events again.
+
+DEFAULT_BINS = 128
+DEFAULT_QUANTILES = (0.25, 0.5, 0.75)
+
+
+def _as_codes(groups, n, levels=None):
+    """(group values, index of every row's group); fixed, sorted `levels` keep empty groups."""
+    if groups is None:
+        return np.array([0]), np.zeros(n, dtype=np.int64)
+    if levels is None:
+        return np.unique(np.asarray(groups), return_inverse=True)
+    levels = np.asarray(levels)
+    idx = np.searchsorted(levels, groups)
+    if len(idx) and (idx.max() >= len(levels) or not np.array_equal(levels[idx], groups)):
+        raise ValueError(f"❌ Groups outside levels {levels.tolist()}")
+    return levels, idx
+
+
+def _smooth(hist, sigma):
+    """Gaussian smoothing along the last axis (a KDE on the binned values)."""
+    if sigma <= 0:
+        return hist
+    radius = int(3 * sigma) + 1
+    kernel = np.exp(-0.5 * (np.arange(-radius, radius + 1) / sigma) ** 2)
+    kernel /= kernel.sum()
+    return np.apply_along_axis(lambda h: np.convolve(h, kernel, mode="same"), -1, hist)
+
+
+def violin_aggregates(values, groups=None, bins=DEFAULT_BINS, value_range=None, smooth=1.5,
+                      quantiles=DEFAULT_QUANTILES, levels=None):
+    """
+    {"edges", "groups", "density" (groups × bins, each row peaks at 1), "quantiles"
+    (groups × len(quantiles)), "n" (per group)} for a violin per group.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    keep = np.isfinite(values)
+    values = values[keep]
+    codes, idx = _as_codes(None if groups is None else np.asarray(groups)[keep], len(values), levels)
+    lo, hi = value_range if value_range is not None else (values.min(), values.max()) if len(values) else (0, 1)
+    if hi <= lo:
+        hi = lo + 1
+    edges = np.linspace(lo, hi, bins + 1)
+    b = np.clip(((values - lo) / (hi - lo) * bins).astype(np.int64), 0, bins - 1)
+    hist = np.bincount(idx * bins + b, minlength=len(codes) * bins).reshape(len(codes), bins).astype(np.float64)
+    n = hist.sum(axis=1)
+
+    # Quantiles from the cumulative histogram, interpolated within the bin
+    cdf = np.cumsum(hist, axis=1) / np.maximum(n, 1)[:, None]
+    qs = np.empty((len(codes), len(quantiles)))
+    for g in range(len(codes)):
+        qs[g] = np.interp(quantiles, np.concatenate([[0], cdf[g]]), edges)
+
+    density = _smooth(hist, smooth)
+    density /= np.maximum(density.max(axis=1, keepdims=True), 1e-12)
+    return {"edges": edges, "groups": codes, "density": density, "quantiles": qs, "n": n.astype(np.int64)}
+
+
+def draw_violins(ax, agg, colors=None, width=0.8, labels=None):
+    """One filled violin per group at x = 0, 1, ...; quartiles as lines, median as a dot."""
+    centers = (agg["edges"][:-1] + agg["edges"][1:]) / 2
+    for g, density in enumerate(agg["density"]):
+        if agg["n"][g] == 0:
+            continue
+        color = colors[g % len(colors)] if colors else f"C{g}"
+        half = density * width / 2
+        ax.fill_betweenx(centers, g - half, g + half, facecolor=color, edgecolor="black", linewidth=0.5, alpha=0.8)
+        q = agg["quantiles"][g]
+        if len(q) == 3:
+            ax.vlines(g, q[0], q[2], color="black", linewidth=3)
+            ax.scatter([g], [q[1]], color="white", s=12, zorder=3)
+    ax.set_xticks(range(len(agg["groups"])))
+    ax.set_xticklabels(labels if labels is not None else [str(g) for g in agg["groups"]])
+    return ax
+
+
+def raster_aggregate(x, y, categories=None, width=800, height=600, extent=None, levels=None):
+    """
+    {"counts" (categories × height × width), "categories", "extent" (xmin, xmax, ymin, ymax)}:
+    points binned onto a pixel grid, per category (per value of `levels`, if given).
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    keep = np.isfinite(x) & np.isfinite(y)
+    x, y = x[keep], y[keep]
+    codes, idx = _as_codes(None if categories is None else np.asarray(categories)[keep], len(x), levels)
+    if extent is None:
+        extent = (x.min(), x.max(), y.min(), y.max()) if len(x) else (0, 1, 0, 1)
+    xmin, xmax, ymin, ymax = extent
+    px = np.clip(((x - xmin) / max(xmax - xmin, 1e-12) * width).astype(np.int64), 0, width - 1)
+    py = np.clip(((y - ymin) / max(ymax - ymin, 1e-12) * height).astype(np.int64), 0, height - 1)
+    flat = (idx * height + py) * width + px
+    counts = np.bincount(flat, minlength=len(codes) * height * width).reshape(len(codes), height, width)
+    return {"counts": counts.astype(np.int32), "categories": codes, "extent": tuple(float(e) for e in extent)}
+
+
+def shade(agg, colors=None, cmap="viridis", min_alpha=0.25):
+    """
+    RGBA image (height × width × 4) of raster counts. With one category the log count
+    maps onto cmap; with several, each pixel mixes the category colors by count.
+    Alpha grows with log count from min_alpha, so single events stay visible.
+    """
+    from matplotlib import colormaps, colors as mcolors
+    counts = agg["counts"].astype(np.float64)
+    total = counts.sum(axis=0)
+    occupied = total > 0
+    level = np.log1p(total) / np.log1p(total.max()) if total.max() > 0 else total
+    img = np.zeros(total.shape + (4,))
+    if colors is None and len(counts) == 1:
+        img[..., :3] = colormaps[cmap](level)[..., :3]
+    else:
+        colors = colors or [f"C{i}" for i in range(len(counts))]
+        rgb = np.array([mcolors.to_rgb(colors[i % len(colors)]) for i in range(len(counts))])
+        img[..., :3] = np.einsum("khw,kc->hwc", counts, rgb) / np.maximum(total, 1)[..., None]
+    img[..., 3] = np.where(occupied, min_alpha + (1 - min_alpha) * level, 0)
+    return img
+
+
+def draw_raster(ax, agg, colors=None, cmap="viridis", min_alpha=0.25):
+    """imshow the shaded raster in data coordinates."""
+    xmin, xmax, ymin, ymax = agg["extent"]
+    ax.imshow(shade(agg, colors, cmap, min_alpha), origin="lower", extent=(xmin, xmax, ymin, ymax),
+              aspect="auto", interpolation="nearest")
+    return ax
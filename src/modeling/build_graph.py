@@ -1,60 +1,170 @@
 import os
 import sys
-import glob
-import pandas as pd
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+import argparse
+import shutil
+import time
 import numpy as np
-from sklearn.neighbors import kneighbors_graph
-from sklearn.preprocessing import StandardScaler
-import torch
-from torch_geometric.data import Data
+from src.preprocessing.event_store import ID_COLUMN, list_columns, list_partitions, partition_signature, read_events
+from src.modeling.neighbors import BACKENDS, knn
+from src.modeling.graph_state import GraphState
+from src.pipeline.profiling import span
+from src.pipeline.stage_cache import StageCache, code_version
 
 # === Setup paths ===
 processed_dir = "/Users/nididev/Documents/FlowTcell-MM/data/processed"
+gated_dir = os.path.join(processed_dir, "gated")
 output_path = "/Users/nididev/Documents/FlowTcell-MM/src/modeling/cell_graph.pt"
+state_dir = os.path.join(os.path.dirname(output_path), "graph_state")
+cache_dir = os.path.join(processed_dir, "cache")
 
-# === Load all CSVs ===
-csv_files = glob.glob(os.path.join(processed_dir, "*.csv"))
-df_list = []
+MARKER_COLS = ['CD3', 'CD4', 'CD8', 'CD25', 'CD62L', 'IL2', 'TNFa', 'IFNg']
 
-for path in csv_files:
-    try:
-        df = pd.read_csv(path)
-        df["source_file"] = os.path.basename(path)
-        df_list.append(df)
-    except Exception as e:
-        print(f"❌ Error reading {path}: {e}")
 
-if not df_list:
-    raise ValueError("❌ No valid CSVs found in processed folder.")
+def load_cells(marker_cols, source_files=None):
+    """CD4/CD8-positive cells from the gated store: (raw marker matrix, labels, event ids)."""
+    # === Load only the marker columns (and event ids) from the gated event store ===
+    columns = marker_cols + [ID_COLUMN] * (ID_COLUMN in list_columns(gated_dir, source_files))
+    combined_df = read_events(gated_dir, columns=columns, source_files=source_files)
+    return select_cells(combined_df, marker_cols)
 
-combined_df = pd.concat(df_list, ignore_index=True)
 
-# === Select marker columns ===
-marker_cols = ['CD3', 'CD4', 'CD8', 'CD25', 'CD62L', 'IL2', 'TNFa', 'IFNg']
-marker_cols = [col for col in marker_cols if col in combined_df.columns]
+def select_cells(combined_df, marker_cols):
+    """
+    (raw marker matrix, CD4=0 / CD8=1 labels, event ids) for the CD4- or CD8-positive
+    rows of a gated frame; event ids are None if the frame has no event_id column.
+    """
+    # === Apply CD4/CD8 gating mask
+    mask = (combined_df["CD4"] > 500) | (combined_df["CD8"] > 500)
+    filtered_df = combined_df[mask]
 
-if not marker_cols:
-    raise ValueError("❌ No known marker columns found.")
+    X = filtered_df[marker_cols].fillna(0).to_numpy(dtype=np.float32)
+    labels = np.where(filtered_df["CD4"] > filtered_df["CD8"], 0, 1)
+    event_ids = filtered_df[ID_COLUMN].to_numpy(dtype=np.int64) if ID_COLUMN in filtered_df else None
+    return X, labels, event_ids
 
-# === Apply CD4/CD8 gating mask
-mask = (combined_df["CD4"] > 500) | (combined_df["CD8"] > 500)
-filtered_df = combined_df[mask].copy()
 
-X = filtered_df[marker_cols].fillna(0)
-X_scaled = StandardScaler().fit_transform(X)
-labels = np.where(filtered_df["CD4"] > filtered_df["CD8"], 0, 1)
+def save_graph(state):
+    """Write the graph as a new version and point cell_graph.pt at it."""
+    data = state.to_data()
+    versioned_path = output_path.replace(".pt", f".v{state.version}.pt")
+    import torch
+    torch.save(data, versioned_path)
+    shutil.copyfile(versioned_path, output_path)
+    print(f"✅ Graph v{state.version} saved to: {versioned_path} (and {output_path})")
+    print(f"🔢 Nodes: {data.num_nodes}, Edges: {data.edge_index.size(1)}, Features: {data.num_node_features}")
+    return data
 
-# === Build kNN graph
-knn_graph = kneighbors_graph(X_scaled, n_neighbors=15, mode='connectivity', include_self=False)
-rows, cols = knn_graph.nonzero()
-edge_index = torch.tensor([rows, cols], dtype=torch.long)
 
-# === PyTorch Geometric Data object
-x = torch.tensor(X_scaled, dtype=torch.float)
-y = torch.tensor(labels, dtype=torch.long)
-data = Data(x=x, edge_index=edge_index, y=y)
+def build_full(k=15, knn_backend="exact", n_jobs=-1, progress=None, version=1):
+    # === Select marker columns ===
+    available = list_columns(gated_dir)
+    marker_cols = [col for col in MARKER_COLS if col in available]
 
-# === Save
-torch.save(data, output_path)
-print(f"✅ Graph saved to: {output_path}")
-print(f"🔢 Nodes: {x.size(0)}, Edges: {edge_index.size(1)}, Features: {x.size(1)}")
+    if not marker_cols:
+        raise ValueError("❌ No known marker columns found.")
+
+    samples = list_partitions(gated_dir)
+    with span("load cells") as sp:
+        X, labels, event_ids = load_cells(marker_cols, samples)
+        sp.count("cells", len(X))
+    from sklearn.preprocessing import StandardScaler
+    with span("scaling") as sp:
+        scaler = StandardScaler().fit(X)
+        X_scaled = scaler.transform(X).astype(np.float32)
+        sp.count("cells", len(X))
+    if progress is not None:
+        progress(0.1, f"{len(X_scaled)} cells loaded")
+
+    # === Build kNN graph
+    print(f"🔗 Building {k}-NN graph over {len(X_scaled)} cells ({knn_backend})...")
+    start = time.perf_counter()
+    with span("knn", backend=knn_backend, k=k) as sp:
+        index, neighbors, distances = knn(X_scaled, k=k, backend=knn_backend, n_jobs=n_jobs)
+        sp.count("edges", neighbors.size)
+    print(f"⏱️ kNN graph built in {time.perf_counter() - start:.2f}s")
+    if progress is not None:
+        progress(0.9, f"{len(X_scaled) * k} graph edges built")
+
+    # === Persist scaler, neighbor lists and index for incremental updates
+    state = GraphState.create(state_dir, marker_cols, scaler, X_scaled, labels, neighbors, distances,
+                              index, samples, k, knn_backend, event_ids=event_ids,
+                              signatures={s: partition_signature(gated_dir, s) for s in samples}, version=version)
+    with span("save state"):
+        state.save()
+    return state
+
+
+def build_incremental(n_jobs=-1, progress=None):
+    state = GraphState.load(state_dir)
+    partitions = list_partitions(gated_dir)
+
+    # Samples re-gated or removed since they were inserted: their nodes are stale, rebuild
+    changed = [s for s in state.samples
+               if s not in partitions or state.signatures.get(s) != partition_signature(gated_dir, s)]
+    if changed:
+        print(f"🔁 {len(changed)} sample(s) changed or removed since graph v{state.version} "
+              f"({', '.join(changed[:5])}{', ...' if len(changed) > 5 else ''}); rebuilding from scratch.")
+        return build_full(state.k, state.backend, n_jobs, progress, version=state.version + 1)
+
+    new_samples = [s for s in partitions if s not in state.samples]
+    if not new_samples:
+        print(f"✅ Graph v{state.version} already includes every gated sample.")
+        return None
+
+    # Same markers and scaling as the reference build, so existing node features don't move
+    X, labels, event_ids = load_cells(state.marker_cols, new_samples)
+    print(f"➕ Inserting {len(X)} cells from {len(new_samples)} new sample(s) into graph v{state.version}...")
+    start = time.perf_counter()
+    with span("knn insert", backend=state.backend, k=state.k) as sp:
+        updated = state.insert(state.transform(X), labels, new_samples, n_jobs=n_jobs, event_ids=event_ids,
+                               signatures={s: partition_signature(gated_dir, s) for s in new_samples})
+        sp.count("cells", len(X))
+    print(f"⏱️ Inserted in {time.perf_counter() - start:.2f}s; {updated} existing neighbor lists updated")
+    if progress is not None:
+        progress(0.9, f"{len(X)} cells inserted, {updated} neighbor lists updated")
+    state.save()
+    return state
+
+
+def build(k=15, knn_backend="exact", n_jobs=-1, incremental=False, use_cache=True, progress=None):
+    """Build (or update, or restore from the stage cache) the cell graph; returns its Data."""
+    if incremental and GraphState.exists(state_dir):
+        state = build_incremental(n_jobs, progress)
+        return save_graph(state) if state is not None else load_graph()
+    if incremental:
+        print("ℹ️ No graph state found; building from scratch.")
+    if not use_cache:
+        return save_graph(build_full(k, knn_backend, n_jobs, progress))
+
+    # A full build depends only on the gated store, k, the backend and this code
+    start = time.perf_counter()
+    built = []
+    hit, key = StageCache(cache_dir).run(
+        "graph", lambda: built.append(save_graph(build_full(k, knn_backend, n_jobs, progress))), inputs=[gated_dir],
+        params={"k": k, "knn_backend": knn_backend, "markers": MARKER_COLS},
+        code=code_version(__file__, GraphState, knn), outputs=[output_path, state_dir])
+    if hit:
+        print(f"💾 Restored graph from stage cache ({key[:12]}) in {time.perf_counter() - start:.2f}s")
+    return built[0] if built else load_graph()
+
+
+def load_graph():
+    import torch
+    return torch.load(output_path, weights_only=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the kNN cell graph from gated events.")
+    parser.add_argument("--k", type=int, default=15, help="neighbors per cell")
+    parser.add_argument("--knn-backend", choices=sorted(BACKENDS), default="exact",
+                        help="exact search, or approximate NN-descent for millions of cells")
+    parser.add_argument("--n-jobs", type=int, default=-1, help="threads for neighbor search (-1 = all cores)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="insert only samples not yet in the graph, reusing the persisted scaler and index")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always rebuild instead of restoring an unchanged graph from the stage cache")
+    args = parser.parse_args()
+
+    build(k=args.k, knn_backend=args.knn_backend, n_jobs=args.n_jobs, incremental=args.incremental,
+          use_cache=not args.no_cache)
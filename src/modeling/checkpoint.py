@@ -0,0 +1,62 @@
+import os
+import re
+import shutil
+import time
+
+# Versioned checkpoints of the CD4/CD8 GNN.
+#
+#   <ckpt_dir>/gnn.vN.pt   one file per training run
+#   <ckpt_dir>/gnn.pt      copy of the latest version
+#
+# A checkpoint holds everything needed to classify new cells without the
+# training graph: weights, model hyperparameters, the marker column order and
+# the StandardScaler statistics the graph was built with. Only tensors and plain
+# Python values are stored, so it loads with torch.load(weights_only=True).
+
+CHECKPOINT_NAME = "gnn"
+
+
+def checkpoint_versions(ckpt_dir):
+    if not os.path.isdir(ckpt_dir):
+        return []
+    pattern = re.compile(rf"^{CHECKPOINT_NAME}\.v(\d+)\.pt$")
+    return sorted(int(m.group(1)) for m in map(pattern.match, os.listdir(ckpt_dir)) if m)
+
+
+def latest_checkpoint(ckpt_dir):
+    path = os.path.join(ckpt_dir, f"{CHECKPOINT_NAME}.pt")
+    return path if os.path.exists(path) else None
+
+
+def save_checkpoint(ckpt_dir, model, hparams, marker_cols, mean, scale, graph=None, metrics=None):
+    """Write the model as the next gnn.vN.pt and point gnn.pt at it; returns the versioned path."""
+    import torch
+    os.makedirs(ckpt_dir, exist_ok=True)
+    version = (checkpoint_versions(ckpt_dir) or [0])[-1] + 1
+    ckpt = {
+        "version": version,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "state_dict": {name: t.detach().cpu() for name, t in model.state_dict().items()},
+        "hparams": dict(hparams),
+        "marker_cols": list(marker_cols),
+        "scaler": {"mean": torch.as_tensor(mean, dtype=torch.float32),
+                   "scale": torch.as_tensor(scale, dtype=torch.float32)},
+        "graph": dict(graph or {}),
+        "metrics": dict(metrics or {}),
+    }
+    versioned_path = os.path.join(ckpt_dir, f"{CHECKPOINT_NAME}.v{version}.pt")
+    torch.save(ckpt, versioned_path)
+    shutil.copyfile(versioned_path, os.path.join(ckpt_dir, f"{CHECKPOINT_NAME}.pt"))
+    return versioned_path
+
+
+def load_checkpoint(path):
+    """(model in eval mode, checkpoint dict)."""
+    import torch
+    from src.modeling.gnn_model import GNN
+    ckpt = torch.load(path, map_location="cpu", weights_only=True)
+    hp = ckpt["hparams"]
+    model = GNN(hp["in_channels"], hp["hidden_channels"], hp["out_channels"], dropout=hp.get("dropout", 0.2))
+    model.load_state_dict(ckpt["state_dict"])
+    model.eval()
+    return model, ckpt
@@ -3,65 +3,94 @@ import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
 
 import os
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import torch
-import torch.nn.functional as F
-from torch_geometric.nn import SAGEConv
+import torch.multiprocessing as mp
 from torch_geometric.data import Data
 from sklearn.model_selection import StratifiedKFold
 import torch.serialization
+from src.modeling.gnn_model import GNN, train_full_batch, evaluate
+from src.preprocessing.parallel import resolve_workers
+from src.pipeline.profiling import peak_rss_mb
 
 # === Fix for PyTorch 2.6+ ===
 from torch_geometric.data import Data
 torch.serialization.add_safe_globals([Data])
 
-# === Load Graph ===
 script_dir = os.path.dirname(os.path.abspath(__file__))
 graph_path = os.path.join(script_dir, "cell_graph.pt")
-data = torch.load(graph_path, weights_only=False)
-
-# === GNN Model ===
-class GNN(torch.nn.Module):
-    def __init__(self, in_channels, hidden_channels, out_channels):
-        super().__init__()
-        self.conv1 = SAGEConv(in_channels, hidden_channels)
-        self.conv2 = SAGEConv(hidden_channels, out_channels)
-
-    def forward(self, x, edge_index):
-        x = F.relu(self.conv1(x, edge_index))
-        x = F.dropout(x, p=0.2, training=self.training)
-        x = self.conv2(x, edge_index)
-        return x
-
-# === Cross-validation ===
-skf = StratifiedKFold(n_splits=5, shuffle=True, random_state=42)
-idx = torch.arange(data.num_nodes)
-accs = []
-
-print("🧪 Running 5-Fold Cross-Validation...")
-for fold, (train_idx, test_idx) in enumerate(skf.split(idx, data.y)):
-    model = GNN(data.num_node_features, 32, 2)
-    optimizer = torch.optim.Adam(model.parameters(), lr=0.01)
-    criterion = torch.nn.CrossEntropyLoss()
-
-    # Train
-    model.train()
-    for epoch in range(50):
-        optimizer.zero_grad()
-        out = model(data.x, data.edge_index)
-        loss = criterion(out[train_idx], data.y[train_idx])
-        loss.backward()
-        optimizer.step()
-
-    # Evaluate
-    model.eval()
-    with torch.no_grad():
-        logits = model(data.x, data.edge_index)
-        preds = logits.argmax(dim=1)
-        correct = (preds[test_idx] == data.y[test_idx]).sum().item()
-        acc = correct / len(test_idx)
-        accs.append(acc)
-        print(f"Fold {fold+1}: Accuracy = {acc:.3f}")
-
-# === Summary ===
-mean_acc = sum(accs) / len(accs)
-print(f"\n✅ Mean Accuracy (5-fold CV): {mean_acc:.3f}")
+
+# Graph tensors of the current process. In parallel mode they live in shared
+# memory and are handed to each worker once, through the pool initializer.
+_graph = None
+
+
+def _init_worker(x, edge_index, y, threads):
+    global _graph
+    _graph = Data(x=x, edge_index=edge_index, y=y)
+    if threads:
+        torch.set_num_threads(threads)
+
+
+def run_fold(fold, train_idx, test_idx, epochs=50, hidden=32, lr=0.01):
+    """Train and evaluate one fold on the process's graph; seeded per fold so serial and parallel runs agree."""
+    start = time.perf_counter()
+    torch.manual_seed(42 + fold)
+    model = GNN(_graph.num_node_features, hidden, 2)
+    train_full_batch(model, _graph, train_idx, epochs=epochs, lr=lr, log_every=0)
+    acc = evaluate(model, _graph, test_idx)
+    return {"fold": fold + 1, "accuracy": acc, "seconds": time.perf_counter() - start,
+            "peak_rss_mb": peak_rss_mb(), "pid": os.getpid()}
+
+
+def run_cv(data, folds, workers=1, **kwargs):
+    """Yield one result dict per fold, in completion order."""
+    workers = min(resolve_workers(workers), len(folds))
+    if workers == 1:
+        _init_worker(data.x, data.edge_index, data.y, None)
+        for fold, (train_idx, test_idx) in enumerate(folds):
+            yield run_fold(fold, train_idx, test_idx, **kwargs)
+        return
+
+    # Share the graph instead of pickling a copy per task; split the cores between workers
+    tensors = [t.share_memory_() for t in (data.x, data.edge_index, data.y)]
+    threads = max(1, torch.get_num_threads() // workers)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn"),
+                             initializer=_init_worker, initargs=(*tensors, threads)) as pool:
+        futures = [pool.submit(run_fold, fold, train_idx, test_idx, **kwargs)
+                   for fold, (train_idx, test_idx) in enumerate(folds)]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stratified k-fold cross-validation of the CD4/CD8 GNN.")
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--epochs", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="folds trained concurrently (1 = serial, 0 = one per core)")
+    args = parser.parse_args()
+
+    # === Load Graph ===
+    data = torch.load(graph_path, weights_only=False)
+
+    # === Cross-validation ===
+    skf = StratifiedKFold(n_splits=args.folds, shuffle=True, random_state=42)
+    idx = torch.arange(data.num_nodes)
+    folds = [(torch.from_numpy(tr), torch.from_numpy(te)) for tr, te in skf.split(idx, data.y)]
+
+    print(f"🧪 Running {args.folds}-Fold Cross-Validation ({resolve_workers(args.workers)} worker(s))...")
+    start = time.perf_counter()
+    results = []
+    for res in run_cv(data, folds, workers=args.workers, epochs=args.epochs):
+        results.append(res)
+        print(f"Fold {res['fold']}: Accuracy = {res['accuracy']:.3f} "
+              f"(⏱️ {res['seconds']:.2f}s, peak RSS {res['peak_rss_mb']:.0f} MB, pid {res['pid']})")
+
+    # === Summary ===
+    accs = [res["accuracy"] for res in sorted(results, key=lambda r: r["fold"])]
+    mean_acc = sum(accs) / len(accs)
+    print(f"\n✅ Mean Accuracy ({args.folds}-fold CV): {mean_acc:.3f}")
+    print(f"⏱️ Total: {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,177 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+import argparse
+import json
+import time
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn.functional as F
+from src.modeling.build_graph import processed_dir, load_cells, select_cells
+from src.modeling.checkpoint import latest_checkpoint, load_checkpoint
+from src.modeling.graph_state import GraphState, REVERSE_FACTOR
+from src.modeling.neighbors import knn, edge_index_from_knn
+from src.modeling.sampling import NeighborSampler
+
+# Classify a new sample's cells with a saved GNN checkpoint, without retraining.
+#
+#   python src/modeling/gnn_infer.py --sample new_tube.fcs              (already gated)
+#   python src/modeling/gnn_infer.py --fcs new_tube.fcs --mode reference
+#
+# "self" mode builds a kNN graph over the sample's cells only. "reference" mode
+# attaches every new cell to the cells of the persisted training graph (GraphState)
+# that would list it among their k nearest, the direction messages flow in during
+# training, and reuses their neighborhoods, so calls are independent of each other
+# and the reference graph is never modified.
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+ckpt_dir = os.path.join(script_dir, "checkpoints")
+state_dir = os.path.join(script_dir, "graph_state")
+predictions_dir = os.path.join(processed_dir, "gnn_predictions")
+CLASS_NAMES = ["CD4", "CD8"]
+
+
+class CellClassifier:
+    """Loads a checkpoint (and, for reference mode, the graph state) once; classify() is then cheap."""
+
+    def __init__(self, ckpt_path=None, state_dir=state_dir, reference=False):
+        ckpt_path = ckpt_path or latest_checkpoint(ckpt_dir)
+        if ckpt_path is None:
+            raise FileNotFoundError(f"❌ No GNN checkpoint in {ckpt_dir}. Run gnn_model.py first.")
+        self.model, self.ckpt = load_checkpoint(ckpt_path)
+        self.marker_cols = self.ckpt["marker_cols"]
+        self.mean = self.ckpt["scaler"]["mean"].numpy()
+        self.scale = self.ckpt["scaler"]["scale"].numpy()
+        self.k = self.ckpt["graph"].get("k", 15)
+        self.state = None
+        if reference:
+            self._load_reference(state_dir)
+
+    def _load_reference(self, state_dir):
+        state = GraphState.load(state_dir)
+        if state.marker_cols != self.marker_cols or not np.allclose(state.mean, self.mean):
+            print("⚠️ Graph state was rebuilt since this checkpoint was trained; scaling may differ.")
+        self.state = state
+        self.x_ref = torch.from_numpy(state.x)
+        # Full 1-hop neighborhoods of reference cells, for their first-layer embeddings
+        self.ref_sampler = NeighborSampler(edge_index_from_knn(state.neighbors), len(state.x), [-1])
+
+    def transform(self, X):
+        return ((np.asarray(X, dtype=np.float32) - self.mean) / self.scale).astype(np.float32)
+
+    @torch.no_grad()
+    def _logits_self(self, X_scaled):
+        k = min(self.k, len(X_scaled) - 1)
+        _, neighbors, _ = knn(X_scaled, k=k)
+        return self.model(torch.from_numpy(X_scaled), edge_index_from_knn(neighbors))
+
+    @torch.no_grad()
+    def _logits_reference(self, X_scaled):
+        """
+        Logits for new cells attached to the reference graph in the training edge direction.
+
+        Training edges run node → neighbor, so a node aggregates from the cells that list
+        it among their k nearest. A new cell therefore aggregates from the reference cells
+        it would displace from their kNN lists (closer than their current k-th neighbor),
+        found among its REVERSE_FACTOR * k nearest reference cells. Reference cells keep
+        their trained first-layer neighborhoods, i.e. the new cell's own message to them,
+        and messages between new cells, are left out. A new cell no reference cell would
+        list gets only its root term, like an in-degree-0 node during training.
+        """
+        model = self.model
+        cand, cand_dist = self.state.query(X_scaled, REVERSE_FACTOR * self.k)
+        n_new = len(X_scaled)
+        reverse = cand_dist < self.state.distances[cand, -1]
+        new_cells = np.broadcast_to(np.arange(n_new)[:, None], cand.shape)[reverse]
+        ref_nodes, local = np.unique(cand[reverse], return_inverse=True)
+        # Edges reference cell → new cell
+        edges = torch.stack([torch.from_numpy(local.reshape(-1).astype(np.int64)),
+                             torch.from_numpy(new_cells.astype(np.int64))])
+
+        # Layer 1 for the reference cells over their own (unchanged) neighborhoods
+        x_new = torch.from_numpy(X_scaled)
+        if len(ref_nodes):
+            batch = self.ref_sampler.sample(torch.from_numpy(ref_nodes))
+            h_ref = F.relu(model.conv1(self.x_ref[batch.n_id], batch.edge_index))[batch.seed_pos]
+            x_ref = self.x_ref[batch.seeds]
+        else:
+            h_ref = torch.zeros(0, model.conv1.out_channels)
+            x_ref = self.x_ref[:0]
+        # Layer 1 and 2 for the new cells, aggregating from those reference cells (as in GNN.forward)
+        h_new = F.relu(model.conv1((x_ref, x_new), edges, size=(len(ref_nodes), n_new)))
+        return model.conv2((h_ref, h_new), edges, size=(len(ref_nodes), n_new))
+
+    def classify(self, X, mode="self"):
+        """(predicted class per cell, P(CD8) per cell) for raw marker values X laid out as marker_cols."""
+        X_scaled = self.transform(X)
+        if mode == "reference":
+            if self.state is None:
+                raise ValueError("❌ Reference mode needs CellClassifier(reference=True)")
+            logits = self._logits_reference(X_scaled)
+        elif mode == "self":
+            logits = self._logits_self(X_scaled)
+        else:
+            raise ValueError(f"❌ Unknown mode {mode!r}; choose 'self' or 'reference'")
+        probs = torch.softmax(logits, dim=1)
+        return probs.argmax(dim=1).numpy(), probs[:, 1].numpy()
+
+
+def gate_fcs(fcs_path, marker_cols):
+    """
+    Gate a raw FCS file with the project's fluor map and gate spec, returning (X, labels, event ids).
+    The sample registry is only read: unregistered files get EPHEMERAL_SAMPLE_ID event ids.
+    """
+    from src.preprocessing import apply_gates
+    from src.preprocessing.event_store import EPHEMERAL_SAMPLE_ID, ID_COLUMN, registered_sample_ids
+    from src.preprocessing.fcs_reader import FCSFile
+    from src.preprocessing.gates import load_spec
+    from src.preprocessing.gating import iter_gated_chunks
+    with open(os.path.join(processed_dir, "fluor_map.json"), "r") as f:
+        fluor_map = json.load(f)
+    spec = load_spec(os.path.join(processed_dir, "gates.json"))
+    name = os.path.basename(fcs_path)
+    sample_id = registered_sample_ids(apply_gates.registry_path).get(name, EPHEMERAL_SAMPLE_ID)
+    chunks = list(iter_gated_chunks(FCSFile(fcs_path), fluor_map, spec, sample_id=sample_id))
+    df = pd.concat(chunks, ignore_index=True).reindex(columns=marker_cols + [ID_COLUMN])
+    return select_cells(df, marker_cols)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Classify a new sample's cells with the saved CD4/CD8 GNN.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--sample", help="source_file name of a sample in the gated event store")
+    source.add_argument("--fcs", help="raw .fcs file, gated on the fly with fluor_map.json and gates.json")
+    parser.add_argument("--mode", choices=["self", "reference"], default="self",
+                        help="kNN graph over the sample only, or attach cells to the reference graph")
+    parser.add_argument("--checkpoint", default=None, help="checkpoint path (default: latest)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    clf = CellClassifier(args.checkpoint, reference=args.mode == "reference")
+    print(f"📦 Loaded checkpoint v{clf.ckpt['version']} in {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    if args.sample:
+        name = args.sample
+        X, labels, event_ids = load_cells(clf.marker_cols, [name])
+    else:
+        name = os.path.basename(args.fcs)
+        X, labels, event_ids = gate_fcs(args.fcs, clf.marker_cols)
+    if len(X) < 2:
+        raise ValueError(f"❌ {name}: not enough CD4/CD8-positive cells to classify ({len(X)})")
+
+    preds, p_cd8 = clf.classify(X, mode=args.mode)
+    print(f"⏱️ Classified {len(X)} cells ({args.mode}) in {time.perf_counter() - start:.2f}s")
+    print(f"✅ Agreement with CD4/CD8 marker labels: {(preds == labels).mean():.3f}")
+
+    # === Save per-cell predictions ===
+    os.makedirs(predictions_dir, exist_ok=True)
+    out = pd.DataFrame(X, columns=clf.marker_cols)
+    if event_ids is not None:
+        out.insert(0, "event_id", event_ids)
+    out["predicted"] = np.array(CLASS_NAMES)[preds]
+    out["p_CD8"] = p_cd8
+    out_path = os.path.join(predictions_dir, f"{name}.csv")
+    out.to_csv(out_path, index=False)
+    print(f"💾 Predictions saved to: {out_path}")
@@ -1,12 +1,17 @@
-
 import os
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+import argparse
+import time
 import torch
 import torch.nn.functional as F
 from torch_geometric.nn import SAGEConv
 from torch_geometric.data import Data
 from sklearn.model_selection import train_test_split
+from src.modeling.sampling import NeighborSampler, neighbor_loader
+from src.modeling.graph_state import GraphState
+from src.modeling.checkpoint import save_checkpoint
+from src.pipeline.profiling import span
 
 # === Fix for PyTorch 2.6+ deserialization ===
 import torch.serialization
@@ -15,52 +20,175 @@ from torch_geometric.data import Data
 # Whitelist the Data class for deserialization
 torch.serialization.add_safe_globals([Data])
 
-
-# === Load Graph ===
 script_dir = os.path.dirname(os.path.abspath(__file__))
 graph_path = os.path.join(script_dir, "cell_graph.pt")
-data = torch.load(graph_path, weights_only=False)
+state_dir = os.path.join(script_dir, "graph_state")
+ckpt_dir = os.path.join(script_dir, "checkpoints")
 
-# === Split train/test indices ===
-idx = torch.arange(data.num_nodes)
-train_idx, test_idx = train_test_split(
-    idx, test_size=0.3, random_state=42, stratify=data.y)
 
 # === GNN Model ===
 class GNN(torch.nn.Module):
-    def __init__(self, in_channels, hidden_channels, out_channels):
+    def __init__(self, in_channels, hidden_channels, out_channels, dropout=0.2):
         super().__init__()
         self.conv1 = SAGEConv(in_channels, hidden_channels)
         self.conv2 = SAGEConv(hidden_channels, out_channels)
+        self.dropout = dropout
 
     def forward(self, x, edge_index):
         x = F.relu(self.conv1(x, edge_index))
-        x = F.dropout(x, p=0.2, training=self.training)
+        x = F.dropout(x, p=self.dropout, training=self.training)
         x = self.conv2(x, edge_index)
         return x
 
-model = GNN(in_channels=data.num_node_features, hidden_channels=32, out_channels=2)
-optimizer = torch.optim.Adam(model.parameters(), lr=0.01)
-criterion = torch.nn.CrossEntropyLoss()
 
-# === Training Loop ===
-model.train()
-for epoch in range(100):
-    optimizer.zero_grad()
-    out = model(data.x, data.edge_index)
-    loss = criterion(out[train_idx], data.y[train_idx])
-    loss.backward()
-    optimizer.step()
+def load_graph(path=None):
+    return torch.load(path or graph_path, weights_only=False)
+
+
+def split_nodes(data, test_size=0.3, random_state=42):
+    idx = torch.arange(data.num_nodes)
+    train_idx, test_idx = train_test_split(
+        idx, test_size=test_size, random_state=random_state, stratify=data.y)
+    return train_idx, test_idx
+
+
+# === Training ===
+def train_full_batch(model, data, train_idx, epochs=100, lr=0.01, log_every=10, progress=None):
+    """One optimizer step per epoch over the whole graph; progress(fraction, message) after each epoch."""
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+    criterion = torch.nn.CrossEntropyLoss()
+    model.train()
+    for epoch in range(epochs):
+        optimizer.zero_grad()
+        out = model(data.x, data.edge_index)
+        loss = criterion(out[train_idx], data.y[train_idx])
+        loss.backward()
+        optimizer.step()
+
+        if log_every and epoch % log_every == 0:
+            print(f"Epoch {epoch}, Loss: {loss.item():.4f}")
+        if progress is not None:
+            progress((epoch + 1) / epochs, f"epoch {epoch + 1}/{epochs}, loss {loss.item():.4f}")
+    return model
+
+
+def train_minibatch(model, data, train_idx, fanouts=(15, 10), batch_size=1024, epochs=10, lr=0.01,
+                    num_workers=0, log_every=1, progress=None):
+    """Neighbor-sampled mini-batches: memory is bounded by batch_size * prod(fanouts), not by the graph."""
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+    criterion = torch.nn.CrossEntropyLoss()
+    loader = neighbor_loader(data, train_idx, fanouts, batch_size=batch_size, shuffle=True,
+                             num_workers=num_workers)
+    model.train()
+    for epoch in range(epochs):
+        total_loss, total = 0.0, 0
+        for batch in loader:
+            optimizer.zero_grad()
+            out = model(data.x[batch.n_id], batch.edge_index)[batch.seed_pos]
+            loss = criterion(out, data.y[batch.seeds])
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item() * len(batch)
+            total += len(batch)
+
+        if log_every and epoch % log_every == 0:
+            print(f"Epoch {epoch}, Loss: {total_loss / total:.4f}")
+        if progress is not None:
+            progress((epoch + 1) / epochs, f"epoch {epoch + 1}/{epochs}, loss {total_loss / total:.4f}")
+    return model
 
-    if epoch % 10 == 0:
-        print(f"Epoch {epoch}, Loss: {loss.item():.4f}")
 
 # === Evaluation ===
-model.eval()
-with torch.no_grad():
-    logits = model(data.x, data.edge_index)
-    preds = logits.argmax(dim=1)
-    correct = (preds[test_idx] == data.y[test_idx]).sum().item()
-    acc = correct / len(test_idx)
-
-print(f"\n✅ Test Accuracy: {acc:.3f}")
+@torch.no_grad()
+def predict(model, data, nodes=None, batch_size=None, num_workers=0):
+    """Class predictions for `nodes` (default all). With batch_size, inference runs over
+    full-neighborhood subgraphs in batches, which gives the same result as a full pass."""
+    model.eval()
+    nodes = torch.arange(data.num_nodes) if nodes is None else torch.as_tensor(nodes)
+    if batch_size is None:
+        return model(data.x, data.edge_index).argmax(dim=1)[nodes]
+
+    sampler = NeighborSampler(data.edge_index, data.num_nodes, [-1, -1])
+    loader = neighbor_loader(data, nodes, None, batch_size=batch_size, shuffle=False,
+                             num_workers=num_workers, sampler=sampler)
+    preds = [model(data.x[batch.n_id], batch.edge_index)[batch.seed_pos].argmax(dim=1) for batch in loader]
+    return torch.cat(preds)
+
+
+def evaluate(model, data, test_idx, batch_size=None, num_workers=0):
+    preds = predict(model, data, test_idx, batch_size=batch_size, num_workers=num_workers)
+    return (preds == data.y[test_idx]).sum().item() / len(test_idx)
+
+
+def train(data=None, mode="full", epochs=None, batch_size=1024, fanouts=(15, 10), num_workers=0, lr=0.01,
+          hidden=32, dropout=0.2, save=True, progress=None):
+    """Train and evaluate the classifier; returns (model, test accuracy, checkpoint path or None)."""
+    # === Load Graph ===
+    data = load_graph() if data is None else data
+
+    # === Split train/test indices ===
+    train_idx, test_idx = split_nodes(data)
+
+    hparams = {"in_channels": data.num_node_features, "hidden_channels": hidden,
+               "out_channels": 2, "dropout": dropout}
+    model = GNN(**hparams)
+
+    # === Training Loop ===
+    start = time.perf_counter()
+    if mode != "full" and len(fanouts) != 2:
+        raise ValueError("❌ fanouts needs one value per SAGEConv layer (2)")
+    n_epochs = epochs or (100 if mode == "full" else 10)
+    with span("training", mode=mode, nodes=data.num_nodes) as sp:
+        if mode == "full":
+            train_full_batch(model, data, train_idx, epochs=n_epochs, lr=lr, progress=progress)
+            eval_batch_size = None
+        else:
+            train_minibatch(model, data, train_idx, fanouts=fanouts, batch_size=batch_size,
+                            epochs=n_epochs, lr=lr, num_workers=num_workers, progress=progress)
+            eval_batch_size = batch_size
+        sp.count("epochs", n_epochs)
+        sp.count("cells", n_epochs * len(train_idx))
+    print(f"⏱️ Trained ({mode}) in {time.perf_counter() - start:.2f}s")
+
+    # === Evaluation ===
+    with span("evaluation") as sp:
+        acc = evaluate(model, data, test_idx, batch_size=eval_batch_size, num_workers=num_workers)
+        sp.count("cells", len(test_idx))
+
+    print(f"\n✅ Test Accuracy: {acc:.3f}")
+
+    # === Save Checkpoint (weights + scaler + marker order of the graph it was trained on) ===
+    path = None
+    if save and not GraphState.exists(state_dir):
+        print(f"⚠️ No graph state in {state_dir}; rebuild the graph with build_graph.py to save a checkpoint.")
+    elif save:
+        state, manifest = GraphState.load_meta(state_dir)
+        training = {"mode": mode, "epochs": n_epochs,
+                    "lr": lr, "batch_size": batch_size, "fanouts": list(fanouts)}
+        path = save_checkpoint(ckpt_dir, model, {**hparams, "training": training}, state.marker_cols,
+                               state.mean, state.scale,
+                               graph={"version": state.version, "k": state.k, "backend": state.backend,
+                                      "n_nodes": manifest.get("n_nodes")},
+                               metrics={"test_accuracy": acc})
+        print(f"💾 Checkpoint saved to: {path}")
+    return model, acc, path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the CD4/CD8 GraphSAGE classifier on cell_graph.pt.")
+    parser.add_argument("--mode", choices=["full", "minibatch"], default="full",
+                        help="full-batch, or neighbor-sampled mini-batches for large graphs")
+    parser.add_argument("--epochs", type=int, default=None, help="default: 100 (full) / 10 (minibatch)")
+    parser.add_argument("--batch-size", type=int, default=1024, help="seed cells per mini-batch")
+    parser.add_argument("--fanouts", type=int, nargs="+", default=[15, 10],
+                        help="neighbors sampled per layer (-1 = all)")
+    parser.add_argument("--num-workers", type=int, default=0, help="sampling worker processes")
+    parser.add_argument("--lr", type=float, default=0.01)
+    parser.add_argument("--hidden", type=int, default=32)
+    parser.add_argument("--dropout", type=float, default=0.2)
+    args = parser.parse_args()
+
+    if args.mode == "minibatch" and len(args.fanouts) != 2:
+        parser.error("--fanouts needs one value per SAGEConv layer (2)")
+    train(mode=args.mode, epochs=args.epochs, batch_size=args.batch_size, fanouts=args.fanouts,
+          num_workers=args.num_workers, lr=args.lr, hidden=args.hidden, dropout=args.dropout)
@@ -0,0 +1,196 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+import argparse
+import copy
+import itertools
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+import torch
+import torch.multiprocessing as mp
+from torch_geometric.data import Data
+from sklearn.model_selection import train_test_split
+import torch.serialization
+from src.modeling.gnn_model import GNN, load_graph, split_nodes
+from src.preprocessing.parallel import resolve_workers
+
+# Hyperparameter sweep for the CD4/CD8 GNN.
+#
+#   python src/modeling/gnn_sweep.py --hidden 16 32 64 --lr 0.003 0.01 0.03 --dropout 0 0.2 0.5 --workers 4
+#
+# Every trial trains on 80% of the usual training split and is scored on the other
+# 20% (validation); the 30% test split is only used once, after the sweep, to report
+# the best trial's weights.
+#   early stopping  a trial stops once validation accuracy hasn't improved for --patience epochs
+#   pruning         every --eval-every epochs (after --prune-after), a trial whose best validation
+#                   accuracy is below the median of what other trials had reached at the same
+#                   epoch is stopped (median rule). Trials running in other processes see each
+#                   other's progress through a Manager dict.
+
+torch.serialization.add_safe_globals([Data])
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+results_path = os.path.join(script_dir, "gnn_sweep_results.csv")
+
+# Set per process by _init_worker
+_graph = None
+_splits = None
+_history = None  # {epoch: [best val accuracy of each trial that reached it]}
+_lock = None
+
+
+def _init_worker(x, edge_index, y, splits, history, lock, threads):
+    global _graph, _splits, _history, _lock
+    _graph = Data(x=x, edge_index=edge_index, y=y)
+    _splits, _history, _lock = splits, history, lock
+    if threads:
+        torch.set_num_threads(threads)
+
+
+def _should_prune(epoch, best_val, min_trials):
+    with _lock:
+        others = list(_history.get(epoch, []))
+        _history[epoch] = others + [best_val]  # reassign so Manager proxies see the update
+    return len(others) >= min_trials and best_val < statistics.median(others)
+
+
+@torch.no_grad()
+def _accuracy(model, idx):
+    model.eval()
+    preds = model(_graph.x, _graph.edge_index).argmax(dim=1)
+    return (preds[idx] == _graph.y[idx]).float().mean().item()
+
+
+def run_trial(trial, params, max_epochs=200, patience=10, eval_every=5, prune_after=20, min_trials=3):
+    """
+    Train one configuration with early stopping and median pruning; returns a result row
+    whose "state" holds the best weights (never scored on the test split here).
+    """
+    start = time.perf_counter()
+    train_idx, val_idx, _ = _splits
+    torch.manual_seed(42 + trial)
+    model = GNN(_graph.num_node_features, params["hidden"], 2, dropout=params["dropout"])
+    optimizer = torch.optim.Adam(model.parameters(), lr=params["lr"])
+    criterion = torch.nn.CrossEntropyLoss()
+
+    best_val, best_epoch, best_state = -1.0, 0, None
+    status = "completed"
+    for epoch in range(1, max_epochs + 1):
+        model.train()
+        optimizer.zero_grad()
+        out = model(_graph.x, _graph.edge_index)
+        loss = criterion(out[train_idx], _graph.y[train_idx])
+        loss.backward()
+        optimizer.step()
+
+        val_acc = _accuracy(model, val_idx)
+        if val_acc > best_val:
+            best_val, best_epoch = val_acc, epoch
+            best_state = copy.deepcopy(model.state_dict())
+        elif epoch - best_epoch >= patience:
+            status = "early_stopped"
+            break
+
+        if epoch % eval_every == 0 and epoch >= prune_after and _should_prune(epoch, best_val, min_trials):
+            status = "pruned"
+            break
+
+    return {"trial": trial, **params, "status": status, "epochs_run": epoch, "best_epoch": best_epoch,
+            "val_accuracy": best_val, "seconds": time.perf_counter() - start, "state": best_state}
+
+
+def grid(hidden, lr, dropout, n_trials=0, seed=42):
+    """Every combination, or a random subset of n_trials of them."""
+    configs = [{"hidden": h, "lr": l, "dropout": d} for h, l, d in itertools.product(hidden, lr, dropout)]
+    if 0 < n_trials < len(configs):
+        configs = random.Random(seed).sample(configs, n_trials)
+    return configs
+
+
+def sweep_splits(data):
+    """(train, validation, test) node indices: the model's usual test split, validation carved from train."""
+    train_idx, test_idx = split_nodes(data)
+    train_idx, val_idx = train_test_split(train_idx, test_size=0.2, random_state=42, stratify=data.y[train_idx])
+    return train_idx, val_idx, test_idx
+
+
+@torch.no_grad()
+def test_accuracy(data, params, state):
+    """Test-split accuracy of one trial's weights; meant for the chosen configuration only."""
+    model = GNN(data.num_node_features, params["hidden"], 2, dropout=params["dropout"])
+    model.load_state_dict(state)
+    model.eval()
+    test_idx = sweep_splits(data)[2]
+    preds = model(data.x, data.edge_index).argmax(dim=1)
+    return (preds[test_idx] == data.y[test_idx]).float().mean().item()
+
+
+def run_sweep(data, configs, workers=1, **kwargs):
+    """Yield one result row per configuration, in completion order."""
+    splits = sweep_splits(data)
+
+    workers = min(resolve_workers(workers), len(configs))
+    if workers == 1:
+        _init_worker(data.x, data.edge_index, data.y, splits, {}, threading.Lock(), None)
+        for trial, params in enumerate(configs):
+            yield run_trial(trial, params, **kwargs)
+        return
+
+    ctx = mp.get_context("spawn")
+    with ctx.Manager() as manager:
+        tensors = [t.share_memory_() for t in (data.x, data.edge_index, data.y)]
+        threads = max(1, torch.get_num_threads() // workers)
+        initargs = (*tensors, splits, manager.dict(), manager.Lock(), threads)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                                 initializer=_init_worker, initargs=initargs) as pool:
+            futures = [pool.submit(run_trial, trial, params, **kwargs) for trial, params in enumerate(configs)]
+            for future in as_completed(futures):
+                yield future.result()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hyperparameter sweep for the CD4/CD8 GNN.")
+    parser.add_argument("--hidden", type=int, nargs="+", default=[16, 32, 64])
+    parser.add_argument("--lr", type=float, nargs="+", default=[0.003, 0.01, 0.03])
+    parser.add_argument("--dropout", type=float, nargs="+", default=[0.0, 0.2, 0.5])
+    parser.add_argument("--trials", type=int, default=0, help="random subset of the grid (0 = full grid)")
+    parser.add_argument("--max-epochs", type=int, default=200)
+    parser.add_argument("--patience", type=int, default=10, help="epochs without validation improvement")
+    parser.add_argument("--eval-every", type=int, default=5, help="epochs between pruning checks")
+    parser.add_argument("--prune-after", type=int, default=20, help="first epoch a trial may be pruned")
+    parser.add_argument("--min-trials", type=int, default=3,
+                        help="trials that must have reached an epoch before the median rule applies")
+    parser.add_argument("--workers", type=int, default=1, help="trials run concurrently (0 = one per core)")
+    parser.add_argument("--output", default=results_path)
+    args = parser.parse_args()
+
+    data = load_graph()
+    configs = grid(args.hidden, args.lr, args.dropout, args.trials)
+    print(f"🧪 Sweeping {len(configs)} configurations ({resolve_workers(args.workers)} worker(s))...")
+
+    start = time.perf_counter()
+    rows, states = [], {}
+    for row in run_sweep(data, configs, workers=args.workers, max_epochs=args.max_epochs,
+                         patience=args.patience, eval_every=args.eval_every,
+                         prune_after=args.prune_after, min_trials=args.min_trials):
+        states[row["trial"]] = row.pop("state")
+        rows.append(row)
+        print(f"Trial {row['trial']}: hidden={row['hidden']} lr={row['lr']} dropout={row['dropout']} → "
+              f"val {row['val_accuracy']:.3f} ({row['status']} at epoch {row['epochs_run']}, {row['seconds']:.1f}s)")
+
+    results = pd.DataFrame(rows).sort_values(["val_accuracy", "seconds"], ascending=[False, True])
+    results.to_csv(args.output, index=False)
+    print(f"\n⏱️ Sweep finished in {time.perf_counter() - start:.1f}s "
+          f"({(results['status'] == 'pruned').sum()} pruned, {(results['status'] == 'early_stopped').sum()} early stopped)")
+    print(results.head(5).to_string(index=False))
+    # Chosen on validation alone; the test split is scored once, for this configuration
+    best = results.iloc[0]
+    params = {"hidden": int(best["hidden"]), "lr": best["lr"], "dropout": best["dropout"]}
+    test_acc = test_accuracy(data, params, states[best["trial"]])
+    print(f"\n✅ Best: hidden={params['hidden']} lr={params['lr']} dropout={params['dropout']} "
+          f"(val {best['val_accuracy']:.3f}, test {test_acc:.3f})")
+    print(f"💾 Results saved to: {args.output}")
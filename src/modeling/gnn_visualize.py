@@ -2,64 +2,77 @@ import os
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
 
-import os
-import torch
-import torch.nn.functional as F
-import matplotlib.pyplot as plt
-import umap
-from torch_geometric.nn import SAGEConv
-import torch.serialization
-from torch_geometric.data import Data
-
-# === PyTorch 2.6+ fix ===
-torch.serialization.add_safe_globals([Data])
+import argparse
+from src.modeling.checkpoint import latest_checkpoint, load_checkpoint
+from src.analysis.embedding import load_or_fit
+from src.analysis.render import draw_raster, raster_aggregate
 
-# === Load Graph ===
+# === Paths ===
 script_dir = os.path.dirname(os.path.abspath(__file__))
 graph_path = os.path.join(script_dir, "cell_graph.pt")
-data = torch.load(graph_path, weights_only=False)
+ckpt_dir = os.path.join(script_dir, "checkpoints")
+plots_dir = os.path.join(script_dir, "..", "plots")
+
+
+def load_model(ckpt_path=None):
+    """(model, checkpoint) of ckpt_path, or of the latest checkpoint."""
+    ckpt_path = ckpt_path or latest_checkpoint(ckpt_dir)
+    if ckpt_path is None:
+        raise FileNotFoundError("❌ No trained GNN checkpoint found. Run gnn_model.py first.")
+    model, ckpt = load_checkpoint(ckpt_path)
+    print(f"📦 Using GNN checkpoint v{ckpt['version']} (test accuracy {ckpt['metrics'].get('test_accuracy', float('nan')):.3f})")
+    return model, ckpt
+
+
+def plot_embedding(embedding, labels, title, path, show=False):
+    # Rasterized CD4 (blue) / CD8 (red) density instead of one marker per cell
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots(figsize=(10, 6))
+    draw_raster(ax, raster_aggregate(embedding[:, 0], embedding[:, 1], labels, levels=[0, 1]), colors=["#3b4cc0", "#b40426"])
+    plt.title(title)
+    plt.xlabel("UMAP 1")
+    plt.ylabel("UMAP 2")
+    plt.tight_layout()
+    plt.savefig(path, dpi=300)
+    if show:
+        plt.show()
+    plt.close()
+    return path
+
 
-# === Load same model structure ===
-class GNN(torch.nn.Module):
-    def __init__(self, in_channels, hidden_channels, out_channels):
-        super().__init__()
-        self.conv1 = SAGEConv(in_channels, hidden_channels)
-        self.conv2 = SAGEConv(hidden_channels, out_channels)
+def visualize(data=None, model=None, ckpt=None, refit_umap=False, show=False):
+    """
+    UMAP of the GNN's outputs colored by true and predicted labels; returns the two
+    png paths. `data` defaults to cell_graph.pt and `model`/`ckpt` to the latest checkpoint.
+    """
+    import torch
+    if data is None:
+        data = torch.load(graph_path, weights_only=False)
+    if model is None or ckpt is None:
+        model, ckpt = load_model()
 
-    def forward(self, x, edge_index):
-        x = F.relu(self.conv1(x, edge_index))
-        x = self.conv2(x, edge_index)
-        return x
+    # === Forward Pass ===
+    model.eval()
+    with torch.no_grad():
+        logits = model(data.x, data.edge_index)
+        preds = logits.argmax(dim=1)
 
-# === Initialize & Load Trained Model ===
-model = GNN(data.num_node_features, 32, 2)
-model.eval()
+    # === UMAP on Embeddings ===
+    # One reference UMAP per checkpoint version, stored next to the checkpoint
+    umap_path = os.path.join(ckpt_dir, f"umap_gnn.v{ckpt['version']}.joblib")
+    _, embedding, fitted = load_or_fit(umap_path, logits.numpy(), refit=refit_umap, scale=False)
+    print(f"{'✅ Fitted and saved' if fitted else '📦 Projected with'} reference UMAP: {umap_path}")
 
-# === Forward Pass ===
-with torch.no_grad():
-    logits = model(data.x, data.edge_index)
-    preds = logits.argmax(dim=1)
+    # === Plot 1: True Labels, Plot 2: Predicted Labels ===
+    return (plot_embedding(embedding, data.y.numpy(), "UMAP of GNN Embedding — Colored by TRUE Labels (CD4/CD8)",
+                           os.path.join(plots_dir, "GNN_UMAP_true.png"), show),
+            plot_embedding(embedding, preds.numpy(), "UMAP of GNN Embedding — Colored by PREDICTED Labels",
+                           os.path.join(plots_dir, "GNN_UMAP_predicted.png"), show))
 
-# === UMAP on Embeddings ===
-reducer = umap.UMAP(random_state=42)
-embedding = reducer.fit_transform(logits.numpy())
 
-# === Plot 1: True Labels ===
-plt.figure(figsize=(10, 6))
-plt.scatter(embedding[:, 0], embedding[:, 1], c=data.y.numpy(), cmap="coolwarm", s=10, alpha=0.7)
-plt.title("UMAP of GNN Embedding — Colored by TRUE Labels (CD4/CD8)")
-plt.xlabel("UMAP 1")
-plt.ylabel("UMAP 2")
-plt.tight_layout()
-plt.savefig(os.path.join(script_dir, "..", "plots", "GNN_UMAP_true.png"), dpi=300)
-plt.show()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="UMAP of the trained GNN's outputs.")
+    parser.add_argument("--refit-umap", action="store_true", help="refit the reference UMAP instead of reusing it")
+    args = parser.parse_args()
 
-# === Plot 2: Predicted Labels ===
-plt.figure(figsize=(10, 6))
-plt.scatter(embedding[:, 0], embedding[:, 1], c=preds.numpy(), cmap="coolwarm", s=10, alpha=0.7)
-plt.title("UMAP of GNN Embedding — Colored by PREDICTED Labels")
-plt.xlabel("UMAP 1")
-plt.ylabel("UMAP 2")
-plt.tight_layout()
-plt.savefig(os.path.join(script_dir, "..", "plots", "GNN_UMAP_predicted.png"), dpi=300)
-plt.show()
+    visualize(refit_umap=args.refit_umap, show=True)
@@ -0,0 +1,218 @@
+import os
+import json
+import pickle
+import numpy as np
+from src.modeling.neighbors import knn, edge_index_from_knn
+
+# Persistent state behind cell_graph.pt, so new samples can be inserted without a rebuild.
+#
+#   <state_dir>/manifest.json        version, k, backend, marker columns, samples (and the
+#                                    signature of each one's gated partition), segments
+#   <state_dir>/scaler.npz           StandardScaler mean/scale from the reference build
+#   <state_dir>/{x,y,neighbors,distances}.npy
+#   <state_dir>/event_id.npy         event id of every node (-1 where unknown)
+#   <state_dir>/segment_NNN.pkl      one neighbor index per inserted batch of cells
+#
+# Each insert fits an index over the new cells only (a new "segment") and queries
+# the existing segments, so its cost grows with the new tube, not the cohort.
+# Existing nodes whose k-th neighbor is farther than a new cell get their lists
+# updated from the new cells' candidate lists (reverse-neighbor update). Samples
+# with fewer than two CD4/CD8 cells are recorded without adding nodes, so later
+# inserts don't retry them.
+
+MANIFEST = "manifest.json"
+# Existing segments are queried for REVERSE_FACTOR * k candidates per new cell; the
+# extra candidates only feed the reverse update and raise recall on existing nodes.
+REVERSE_FACTOR = 3
+ARRAYS = ("x", "y", "neighbors", "distances", "event_id")
+
+
+def _event_ids(event_ids, n):
+    if event_ids is None:
+        return np.full(n, -1, dtype=np.int64)
+    return np.asarray(event_ids, dtype=np.int64)
+
+
+class GraphState:
+    def __init__(self, state_dir):
+        self.state_dir = state_dir
+        self.version = 0
+        self.k = None
+        self.backend = None
+        self.marker_cols = []
+        self.samples = []
+        self.signatures = {}  # sample -> partition signature when it was added
+        self.mean = None
+        self.scale = None
+        self.x = self.y = self.neighbors = self.distances = self.event_id = None
+        self.segments = []  # [(offset, n_cells, index)]
+        self._dirty_segments = []
+
+    @staticmethod
+    def exists(state_dir):
+        return os.path.exists(os.path.join(state_dir, MANIFEST))
+
+    @classmethod
+    def create(cls, state_dir, marker_cols, scaler, x, y, neighbors, distances, index, samples, k, backend,
+               event_ids=None, signatures=None, version=1):
+        state = cls(state_dir)
+        state.k, state.backend = k, backend
+        state.marker_cols = list(marker_cols)
+        state.samples = list(samples)
+        state.signatures = dict(signatures or {})
+        state.mean = np.asarray(scaler.mean_, dtype=np.float32)
+        state.scale = np.asarray(scaler.scale_, dtype=np.float32)
+        state.x, state.y = np.ascontiguousarray(x, dtype=np.float32), np.asarray(y, dtype=np.int64)
+        state.neighbors, state.distances = neighbors, distances
+        state.event_id = _event_ids(event_ids, len(x))
+        state.segments = [(0, len(x), index)]
+        state._dirty_segments = [0]
+        state.version = version
+        return state
+
+    @classmethod
+    def load_meta(cls, state_dir):
+        """Manifest and scaler only (no arrays or indices), e.g. to checkpoint a model against this graph."""
+        state = cls(state_dir)
+        with open(os.path.join(state_dir, MANIFEST), "r") as f:
+            manifest = json.load(f)
+        state.version = manifest["version"]
+        state.k = manifest["k"]
+        state.backend = manifest["backend"]
+        state.marker_cols = manifest["marker_cols"]
+        state.samples = manifest["samples"]
+        state.signatures = manifest.get("signatures", {})
+        scaler = np.load(os.path.join(state_dir, "scaler.npz"))
+        state.mean, state.scale = scaler["mean"], scaler["scale"]
+        return state, manifest
+
+    @classmethod
+    def load(cls, state_dir):
+        state, manifest = cls.load_meta(state_dir)
+        for name in ARRAYS:
+            path = os.path.join(state_dir, f"{name}.npy")
+            # States saved before event ids existed have no event_id.npy
+            setattr(state, name, np.load(path) if os.path.exists(path) else _event_ids(None, len(state.x)))
+        for i, seg in enumerate(manifest["segments"]):
+            with open(os.path.join(state_dir, seg["file"]), "rb") as f:
+                state.segments.append((seg["offset"], seg["n_cells"], pickle.load(f)))
+        return state
+
+    def save(self):
+        os.makedirs(self.state_dir, exist_ok=True)
+        np.savez(os.path.join(self.state_dir, "scaler.npz"), mean=self.mean, scale=self.scale)
+        for name in ARRAYS:
+            np.save(os.path.join(self.state_dir, f"{name}.npy"), getattr(self, name))
+        # Only segments created since the last save are written; older ones never change
+        for i in self._dirty_segments:
+            with open(os.path.join(self.state_dir, f"segment_{i:03d}.pkl"), "wb") as f:
+                pickle.dump(self.segments[i][2], f, protocol=pickle.HIGHEST_PROTOCOL)
+        self._dirty_segments = []
+
+        manifest = {
+            "version": self.version, "k": self.k, "backend": self.backend,
+            "marker_cols": self.marker_cols, "samples": self.samples, "signatures": self.signatures,
+            "n_nodes": int(len(self.x)),
+            "segments": [{"offset": int(off), "n_cells": int(n), "file": f"segment_{i:03d}.pkl"}
+                         for i, (off, n, _) in enumerate(self.segments)],
+        }
+        tmp = os.path.join(self.state_dir, MANIFEST + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp, os.path.join(self.state_dir, MANIFEST))
+
+    def transform(self, X):
+        """Scale raw marker values with the persisted reference statistics."""
+        return ((np.asarray(X, dtype=np.float32) - self.mean) / self.scale).astype(np.float32)
+
+    def _query_segments(self, X_new, k):
+        cand_idx, cand_dist = [], []
+        for offset, n_cells, index in self.segments:
+            idx, dist = index.query(X_new, min(k, n_cells))
+            cand_idx.append(idx + offset)
+            cand_dist.append(dist)
+        return np.hstack(cand_idx), np.hstack(cand_dist)
+
+    def query(self, X, k=None):
+        """k nearest graph nodes (global ids, distances) for scaled cells X, without inserting them."""
+        k = k or self.k
+        idx, dist = self._query_segments(np.ascontiguousarray(X, dtype=np.float32), k)
+        best = np.argsort(dist, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(idx, best, axis=1), np.take_along_axis(dist, best, axis=1)
+
+    def _update_reverse(self, q, u, d, n_old):
+        """Insert new cell q into old node u's list wherever d(u, q) beats u's current k-th neighbor."""
+        k = self.k
+        better = d < self.distances[u, -1]
+        q, u, d = q[better], u[better], d[better]
+        if len(u) == 0:
+            return 0
+
+        # Group candidates by old node, nearest first, and keep at most k per node
+        order = np.lexsort((d, u))
+        q, u, d = q[order], u[order], d[order]
+        starts = np.r_[0, np.flatnonzero(np.diff(u)) + 1]
+        rank = np.arange(len(u)) - np.repeat(starts, np.diff(np.r_[starts, len(u)]))
+        keep = rank < k
+        nodes, slot = np.unique(u[keep], return_inverse=True)
+
+        cand = np.full((len(nodes), k), -1, dtype=np.int64)
+        cand_d = np.full((len(nodes), k), np.inf, dtype=np.float32)
+        cand[slot, rank[keep]] = q[keep] + n_old
+        cand_d[slot, rank[keep]] = d[keep]
+
+        merged = np.hstack([self.neighbors[nodes], cand])
+        merged_d = np.hstack([self.distances[nodes], cand_d])
+        best = np.argsort(merged_d, axis=1, kind="stable")[:, :k]
+        self.neighbors[nodes] = np.take_along_axis(merged, best, axis=1)
+        self.distances[nodes] = np.take_along_axis(merged_d, best, axis=1)
+        return len(nodes)
+
+    def insert(self, X_new, y_new, samples, n_jobs=-1, event_ids=None, signatures=None):
+        """Add scaled cells X_new as a new segment; returns the number of existing nodes whose lists changed."""
+        k = self.k
+        n_old, n_new = len(self.x), len(X_new)
+        if n_new < 2:
+            # Nothing to build a segment from: record the samples so they aren't retried
+            print(f"⚠️ {n_new} new cell(s) from {', '.join(samples)}; recorded without adding nodes.")
+            self.samples.extend(samples)
+            self.signatures.update(signatures or {})
+            self.version += 1
+            return 0
+        if n_old + n_new - 1 < k:
+            raise ValueError(f"❌ Too few cells to insert ({n_new} new, {n_old} existing) for k={k}")
+        X_new = np.ascontiguousarray(X_new, dtype=np.float32)
+
+        # New → existing candidates from every segment
+        old_idx, old_dist = self._query_segments(X_new, REVERSE_FACTOR * k)
+
+        # New → new candidates from an index over the new cells only (becomes the new segment)
+        index, new_idx, new_dist = knn(X_new, k=min(k, n_new - 1), backend=self.backend, n_jobs=n_jobs)
+
+        idx = np.hstack([old_idx, new_idx + n_old])
+        dist = np.hstack([old_dist, new_dist])
+        best = np.argsort(dist, axis=1, kind="stable")[:, :k]
+        nbrs_new = np.take_along_axis(idx, best, axis=1)
+        dist_new = np.take_along_axis(dist, best, axis=1)
+
+        # Existing nodes that gain a new cell among their k nearest
+        q = np.repeat(np.arange(n_new), old_idx.shape[1])
+        updated = self._update_reverse(q, old_idx.ravel(), old_dist.ravel(), n_old)
+
+        self.x = np.vstack([self.x, X_new])
+        self.y = np.concatenate([self.y, np.asarray(y_new, dtype=np.int64)])
+        self.event_id = np.concatenate([self.event_id, _event_ids(event_ids, n_new)])
+        self.neighbors = np.vstack([self.neighbors, nbrs_new])
+        self.distances = np.vstack([self.distances, dist_new])
+        self.segments.append((n_old, n_new, index))
+        self._dirty_segments.append(len(self.segments) - 1)
+        self.samples.extend(samples)
+        self.signatures.update(signatures or {})
+        self.version += 1
+        return updated
+
+    def to_data(self):
+        import torch
+        from torch_geometric.data import Data
+        return Data(x=torch.from_numpy(self.x), edge_index=edge_index_from_knn(self.neighbors),
+                    y=torch.from_numpy(self.y), event_id=torch.from_numpy(self.event_id))
@@ -0,0 +1,103 @@
+import numpy as np
+
+# Pluggable kNN backends for the cell graph.
+#
+#   exact      sklearn NearestNeighbors (tree/brute search), multi-threaded queries
+#   nndescent  approximate NN-descent via pynndescent (ships with umap-learn), numba-parallel
+#
+# Both return neighbor indices as an (n, k) int64 array, which edge_index_from_knn
+# turns into a contiguous [2, n*k] tensor without going through Python lists.
+
+
+def _drop_self(indices, distances):
+    """Remove each point from its own k+1 neighbor list (or the farthest one if self is missing)."""
+    n, k1 = indices.shape
+    is_self = indices == np.arange(n)[:, None]
+    no_self = ~is_self.any(axis=1)
+    is_self[no_self, k1 - 1] = True
+    # Only the first self-match per row is dropped, so duplicates keep their own slot
+    first = is_self.argmax(axis=1)
+    keep = np.ones_like(is_self)
+    keep[np.arange(n), first] = False
+    return indices[keep].reshape(n, k1 - 1), distances[keep].reshape(n, k1 - 1)
+
+
+class ExactIndex:
+    name = "exact"
+
+    def __init__(self, n_jobs=-1, **kwargs):
+        self.n_jobs = n_jobs
+        self.kwargs = kwargs
+        self._nn = None
+
+    def fit(self, X):
+        from sklearn.neighbors import NearestNeighbors
+        self._nn = NearestNeighbors(n_jobs=self.n_jobs, **self.kwargs).fit(X)
+        return self
+
+    def query(self, Q, k):
+        distances, indices = self._nn.kneighbors(Q, n_neighbors=k)
+        return indices.astype(np.int64, copy=False), distances.astype(np.float32, copy=False)
+
+    def kneighbors(self, k):
+        """k nearest neighbors of every fitted point, excluding itself."""
+        distances, indices = self._nn.kneighbors(n_neighbors=k)
+        return indices.astype(np.int64, copy=False), distances.astype(np.float32, copy=False)
+
+
+class NNDescentIndex:
+    name = "nndescent"
+
+    def __init__(self, n_jobs=-1, random_state=42, **kwargs):
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+        self.kwargs = kwargs
+        self._index = None
+        self._k = None
+
+    def fit(self, X, k=15):
+        from pynndescent import NNDescent
+        # The graph built during fit is the kNN graph itself (k + 1 because it includes self)
+        self._k = k
+        self._index = NNDescent(X, n_neighbors=k + 1, n_jobs=self.n_jobs,
+                                random_state=self.random_state, **self.kwargs)
+        return self
+
+    def query(self, Q, k):
+        indices, distances = self._index.query(Q, k=k)
+        return indices.astype(np.int64, copy=False), distances.astype(np.float32, copy=False)
+
+    def kneighbors(self, k):
+        indices, distances = self._index.neighbor_graph
+        if indices.shape[1] < k + 1:
+            raise ValueError(f"❌ Index was built for k={self._k}, cannot return k={k}")
+        return _drop_self(indices[:, :k + 1].astype(np.int64), distances[:, :k + 1].astype(np.float32))
+
+
+BACKENDS = {"exact": ExactIndex, "nndescent": NNDescentIndex}
+
+
+def build_index(X, backend="exact", k=15, n_jobs=-1, **kwargs):
+    if backend not in BACKENDS:
+        raise ValueError(f"❌ Unknown kNN backend {backend!r}; choose from {sorted(BACKENDS)}")
+    index = BACKENDS[backend](n_jobs=n_jobs, **kwargs)
+    if backend == "nndescent":
+        return index.fit(X, k=k)
+    return index.fit(X)
+
+
+def knn(X, k=15, backend="exact", n_jobs=-1, **kwargs):
+    """(index, neighbor indices (n, k), distances (n, k)) for every row of X, self excluded."""
+    index = build_index(X, backend=backend, k=k, n_jobs=n_jobs, **kwargs)
+    indices, distances = index.kneighbors(k)
+    return index, indices, distances
+
+
+def edge_index_from_knn(indices):
+    """[2, n*k] int64 edge_index with edges node → neighbor, matching kneighbors_graph(...).nonzero()."""
+    n, k = indices.shape
+    edges = np.empty((2, n * k), dtype=np.int64)
+    edges[0] = np.repeat(np.arange(n, dtype=np.int64), k)
+    edges[1] = indices.reshape(-1)
+    import torch
+    return torch.from_numpy(edges)
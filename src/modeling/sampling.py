@@ -0,0 +1,93 @@
+import torch
+
+# Layer-wise neighbor sampling for mini-batch GNN training (GraphSAGE-style).
+#
+# Implemented in plain torch so it runs without the optional pyg-lib/torch-sparse
+# extensions that torch_geometric's NeighborLoader needs. Messages flow along
+# edge_index[0] → edge_index[1] (as in SAGEConv), so sampling walks *incoming*
+# edges: for every node in the frontier at most `fanout` sources are drawn
+# without replacement (fanout -1 keeps all of them, which makes the batch output
+# identical to a full-graph forward pass for the seed nodes).
+
+
+class SubgraphBatch:
+    def __init__(self, n_id, edge_index, seeds, seed_pos):
+        self.n_id = n_id            # global ids of every node in the subgraph
+        self.edge_index = edge_index  # local ids
+        self.seeds = seeds          # global ids of the nodes the loss/prediction is for
+        self.seed_pos = seed_pos    # local positions of the seeds in n_id
+
+    def __len__(self):
+        return len(self.seeds)
+
+
+class NeighborSampler:
+    def __init__(self, edge_index, num_nodes, fanouts):
+        src, dst = edge_index[0], edge_index[1]
+        # CSR over incoming edges: sources of node v are col[rowptr[v]:rowptr[v + 1]]
+        order = torch.argsort(dst, stable=True)
+        self.col = src[order].contiguous()
+        self.rowptr = torch.zeros(num_nodes + 1, dtype=torch.long)
+        self.rowptr[1:] = torch.cumsum(torch.bincount(dst, minlength=num_nodes), dim=0)
+        self.fanouts = list(fanouts)
+        self.generator = None
+
+    def _sample_hop(self, frontier, fanout):
+        start = self.rowptr[frontier]
+        deg = self.rowptr[frontier + 1] - start
+        total = int(deg.sum())
+        row = torch.repeat_interleave(torch.arange(len(frontier)), deg)
+        # Position of every incoming edge inside its row
+        offset = torch.arange(total) - torch.repeat_interleave(torch.cumsum(deg, 0) - deg, deg)
+        rank = offset
+
+        if fanout >= 0 and bool((deg > fanout).any()):
+            # Random order within each row, then keep the first `fanout`
+            key = torch.rand(total, generator=self.generator) + row.to(torch.float64)
+            perm = torch.argsort(key)
+            # Rows stay grouped (the key's integer part is the row), so `rank` still
+            # numbers positions within each row, now in random order
+            row, offset = row[perm], offset[perm]
+            keep = rank < fanout
+            row, offset = row[keep], offset[keep]
+
+        src = self.col[start[row] + offset]
+        dst = frontier[row]
+        return src, dst
+
+    def sample(self, seeds):
+        seeds = torch.as_tensor(seeds, dtype=torch.long)
+        frontier = torch.unique(seeds)
+        expanded = frontier
+        srcs, dsts = [], []
+        for fanout in self.fanouts:
+            src, dst = self._sample_hop(frontier, fanout)
+            srcs.append(src)
+            dsts.append(dst)
+            # Expand each node at most once so no edge is sampled twice
+            nxt = torch.unique(src)
+            frontier = nxt[~torch.isin(nxt, expanded)]
+            expanded = torch.cat([expanded, frontier])
+            if len(frontier) == 0:
+                break
+
+        src, dst = torch.cat(srcs), torch.cat(dsts)
+        n_id = torch.unique(torch.cat([seeds, src, dst]))
+        edge_index = torch.stack([torch.searchsorted(n_id, src), torch.searchsorted(n_id, dst)])
+        return SubgraphBatch(n_id, edge_index, seeds, torch.searchsorted(n_id, seeds))
+
+    def __call__(self, seeds):
+        # DataLoader collate_fn: one batch of seed ids → one sampled subgraph
+        return self.sample(seeds)
+
+
+def neighbor_loader(data, input_nodes, fanouts, batch_size=1024, shuffle=True, num_workers=0, sampler=None):
+    """DataLoader yielding SubgraphBatch objects; sampling runs in `num_workers` worker processes."""
+    sampler = sampler or NeighborSampler(data.edge_index, data.num_nodes, fanouts)
+    nodes = torch.as_tensor(input_nodes, dtype=torch.long)
+    # Whole batches of seed ids are drawn at once (no per-node Python objects)
+    order = torch.utils.data.RandomSampler(nodes) if shuffle else torch.utils.data.SequentialSampler(nodes)
+    batches = torch.utils.data.BatchSampler(order, batch_size=batch_size, drop_last=False)
+    return torch.utils.data.DataLoader(
+        nodes, sampler=batches, batch_size=None, collate_fn=sampler,
+        num_workers=num_workers, persistent_workers=num_workers > 0)
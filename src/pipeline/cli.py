@@ -0,0 +1,263 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+import argparse
+import json
+import platform
+import shutil
+import time
+import traceback
+from src.modeling.neighbors import BACKENDS
+from src.pipeline.profiling import Profiler, peak_rss_mb, profiling
+from src.pipeline.runner import STAGES, PipelineRunner, Stage
+
+# Headless batch processing of a whole run, for schedulers and nightly jobs.
+#
+#   python -m src.pipeline.cli --fcs-dir runs/2026-10-17 --fluor-map fluor_map.json \
+#       --gates gates.json --out results/2026-10-17 --workers 8
+#
+# Runs gate → graph → gnn → anomalies → summary with the in-process pipeline
+# runner; nothing is interactive. Every stage module keeps its paths as module
+# globals, so use_workspace() points them all at the output directory first and
+# a run never reads or writes the project's data/processed.
+#
+#   <out>/processed/...        gated event store, graph state, models, anomaly table
+#   <out>/samples/<fcs>.json   per-sample counts: events, every gate, graph cells,
+#                              predicted CD4/CD8, anomalies
+#   <out>/samples/<fcs>.csv    per-cell results: event_id, label, prediction, anomaly
+#   <out>/samples.csv          the per-sample counts, one row per .fcs file
+#   <out>/manifest.json        inputs, parameters, per-stage timings, peak memory,
+#                              status (and the error if the run failed), and the
+#                              profile summary (time, memory, throughput per span)
+#   <out>/trace.json           Chrome trace of every span (chrome://tracing, Perfetto)
+#   <out>/profile/<stage>.prof cProfile stats per stage, with --cprofile
+#
+# The stage cache defaults to <out>/cache; point --cache-dir at a shared directory
+# so reruns over unchanged files restore gating, the graph and the anomaly scores.
+# Exit status is 0 on success and 1 on failure, with the manifest written either way.
+
+CLASS_NAMES = ["CD4", "CD8"]
+DEFAULT_TARGETS = ["summary"]
+PLOT_TARGETS = {"gnn_plots", "marker_plots"}
+
+
+def use_workspace(out_dir, fcs_dir, cache_dir=None):
+    """Point every stage module's input/output paths at out_dir (FCS files are read from fcs_dir)."""
+    import src.preprocessing.apply_gates as apply_gates
+    import src.modeling.build_graph as build_graph
+    import src.modeling.gnn_model as gnn_model
+    import src.modeling.gnn_visualize as gnn_visualize
+    import src.analysis.detect_anomalies as detect_anomalies
+    import src.analysis.analyze_gnn_markers as analyze_gnn_markers
+    from src.analysis.anomaly import MODEL_FILE
+
+    processed = os.path.join(out_dir, "processed")
+    modeling = os.path.join(processed, "modeling")
+    plots = os.path.join(out_dir, "plots")
+    cache_dir = cache_dir or os.path.join(out_dir, "cache")
+    graph_path = os.path.join(modeling, "cell_graph.pt")
+    paths = {
+        "processed": processed, "plots": plots, "cache": cache_dir,
+        "fluor_map": os.path.join(processed, "fluor_map.json"), "gates": os.path.join(processed, "gates.json"),
+        "gated": os.path.join(processed, "gated"), "graph": graph_path,
+        "graph_state": os.path.join(modeling, "graph_state"), "checkpoints": os.path.join(modeling, "checkpoints"),
+        "anomalies": os.path.join(processed, "Flow_Tcell_anomalies.csv"),
+    }
+    for path in (processed, modeling, plots, cache_dir):
+        os.makedirs(path, exist_ok=True)
+
+    settings = {
+        apply_gates: {"data_dir": fcs_dir, "processed_dir": processed, "map_path": paths["fluor_map"],
+                      "gates_path": paths["gates"], "counts_path": os.path.join(processed, "gate_counts.csv"),
+                      "gated_dir": paths["gated"], "output_path": os.path.join(processed, "gated_data.csv"),
+                      "parts_dir": os.path.join(processed, "gated_parts"),
+                      "registry_path": os.path.join(processed, "sample_ids.json"), "cache_dir": cache_dir},
+        build_graph: {"processed_dir": processed, "gated_dir": paths["gated"], "output_path": graph_path,
+                      "state_dir": paths["graph_state"], "cache_dir": cache_dir},
+        gnn_model: {"graph_path": graph_path, "state_dir": paths["graph_state"], "ckpt_dir": paths["checkpoints"]},
+        detect_anomalies: {"graph_path": graph_path, "state_dir": paths["graph_state"], "processed_dir": processed,
+                           "gated_dir": paths["gated"], "model_path": os.path.join(processed, "models", MODEL_FILE),
+                           "umap_path": os.path.join(processed, "models", "umap_graph_features.joblib"),
+                           "samples_dir": os.path.join(processed, "anomalies"), "out_csv": paths["anomalies"],
+                           "out_umap_csv": os.path.join(processed, "Flow_Tcell_anomalies_umap.csv"),
+                           "cache_dir": cache_dir, "out_umap": os.path.join(plots, "Flow_Tcell_anomalies_umap.png")},
+        gnn_visualize: {"graph_path": graph_path, "ckpt_dir": paths["checkpoints"], "plots_dir": plots},
+        analyze_gnn_markers: {"processed_dir": processed, "plots_dir": plots, "anomaly_csv": paths["anomalies"]},
+    }
+    for module, values in settings.items():
+        for name, value in values.items():
+            setattr(module, name, value)
+    return paths
+
+
+# === Summary stage ===
+def summary_stage(inputs, progress=None, out_dir="results"):
+    """Per-sample counts and per-cell results of the run, written under out_dir/samples."""
+    import numpy as np
+    import pandas as pd
+    from src.modeling.gnn_model import predict
+    from src.preprocessing.event_store import ID_COLUMN, split_event_ids
+
+    gate, data, gnn, anomalies = inputs["gate"], inputs["graph"], inputs["gnn"], inputs["anomalies"]
+    samples_dir = os.path.join(out_dir, "samples")
+    os.makedirs(samples_dir, exist_ok=True)
+    names = {sample_id: name for name, sample_id in gate["sample_ids"].items()}
+
+    # === Per-cell results: graph nodes, keyed by event id ===
+    event_ids = getattr(data, ID_COLUMN).numpy()
+    cells = pd.DataFrame({ID_COLUMN: event_ids, "label": np.array(CLASS_NAMES)[data.y.numpy()],
+                          "predicted": np.array(CLASS_NAMES)[predict(gnn["model"], data).numpy()]})
+    table = anomalies["table"].set_index(ID_COLUMN)
+    cells["anomaly"] = table["anomaly"].reindex(event_ids).to_numpy()
+    cells["anomaly_score"] = table["anomaly_score"].reindex(event_ids).to_numpy()
+    cells["source_file"] = pd.Series(split_event_ids(event_ids)[0]).map(names).to_numpy()
+
+    # === Per-sample counts ===
+    gate_counts = pd.read_csv(gate["counts_path"], index_col="source_file")
+    by_sample = dict(tuple(cells.groupby("source_file", sort=False)))
+    rows = []
+    for i, name in enumerate(gate["fcs_files"]):
+        sample = by_sample.get(name, cells.iloc[:0])
+        # Counts of a file that produced no gate columns read back as NaN
+        counts = (gate_counts.loc[name] if name in gate_counts.index else pd.Series(dtype=np.int64)).fillna(0)
+        row = {"source_file": name, "sample_id": gate["sample_ids"][name],
+               "events": int(counts.get("total", 0)),
+               **{f"gate_{g}": int(v) for g, v in counts.items() if g != "total"},
+               "cells": len(sample),
+               **{f"predicted_{c}": int((sample["predicted"] == c).sum()) for c in CLASS_NAMES},
+               "label_agreement": float((sample["predicted"] == sample["label"]).mean()) if len(sample) else None,
+               "anomalies": int(sample["anomaly"].sum()),
+               "anomaly_fraction": float(sample["anomaly"].mean()) if len(sample) else None}
+        rows.append(row)
+        with open(os.path.join(samples_dir, f"{name}.json"), "w") as f:
+            json.dump(row, f, indent=2)
+        sample.drop(columns="source_file").to_csv(os.path.join(samples_dir, f"{name}.csv"), index=False)
+        if progress is not None:
+            progress((i + 1) / len(gate["fcs_files"]), f"{i + 1}/{len(gate['fcs_files'])} samples summarized")
+
+    summary = pd.DataFrame(rows)
+    summary_path = os.path.join(out_dir, "samples.csv")
+    summary.to_csv(summary_path, index=False)
+    print(f"✅ Per-sample results saved to: {samples_dir} (summary: {summary_path})")
+    return {"samples": rows, "samples_dir": samples_dir, "summary_path": summary_path}
+
+
+def batch_stages():
+    return STAGES + [Stage("summary", summary_stage, ("gate", "graph", "gnn", "anomalies"),
+                           "per-sample counts and per-cell results")]
+
+
+# === Manifest ===
+def write_manifest(path, manifest):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2, default=str)
+    os.replace(tmp, path)
+
+
+def run_batch(fcs_dir, fluor_map, gates, out_dir, workers=1, n_jobs=-1, targets=DEFAULT_TARGETS,
+              stage_params=None, cache_dir=None, use_cache=True, cprofile=False):
+    """
+    Run the pipeline over every .fcs file in fcs_dir; returns the manifest (also written to out_dir).
+    The anomaly UMAP is only computed when a plot stage is among the targets.
+    """
+    out_dir = os.path.abspath(out_dir)
+    fcs_dir = os.path.abspath(fcs_dir)
+    if not os.path.isdir(fcs_dir):
+        raise FileNotFoundError(f"❌ FCS directory not found: {fcs_dir}")
+    paths = use_workspace(out_dir, fcs_dir, cache_dir)
+
+    # Inputs are copied into the workspace, so the run is self-describing
+    shutil.copyfile(fluor_map, paths["fluor_map"])
+    gates_copy = None
+    # A spec copied by an earlier run in this workspace must not apply to a run without --gates
+    for name in os.listdir(paths["processed"]):
+        if os.path.splitext(name)[0] == "gates":
+            os.remove(os.path.join(paths["processed"], name))
+    if gates is not None:
+        # Keep the extension: load_spec parses .yaml/.yml specs as YAML
+        gates_copy = os.path.splitext(paths["gates"])[0] + os.path.splitext(gates)[1]
+        shutil.copyfile(gates, gates_copy)
+
+    stage_params = stage_params or {}
+    params = {
+        "gate": {"workers": workers, "gates": gates_copy, "use_cache": use_cache, **stage_params.get("gate", {})},
+        "graph": {"n_jobs": n_jobs, "use_cache": use_cache, **stage_params.get("graph", {})},
+        "gnn": dict(stage_params.get("gnn", {})),
+        "anomalies": {"n_jobs": n_jobs, "use_cache": use_cache, "embed_umap": bool(set(targets) & PLOT_TARGETS),
+                      **stage_params.get("anomalies", {})},
+        "summary": {"out_dir": out_dir},
+    }
+    manifest_path = os.path.join(out_dir, "manifest.json")
+    manifest = {"status": "running", "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "inputs": {"fcs_dir": fcs_dir, "fluor_map": os.path.abspath(fluor_map),
+                           "gates": os.path.abspath(gates) if gates else None},
+                "fcs_files": sorted(f for f in os.listdir(fcs_dir) if f.endswith(".fcs")),
+                "targets": list(targets), "params": params, "workspace": paths,
+                "host": {"python": platform.python_version(), "platform": platform.platform(),
+                         "cpus": os.cpu_count()}}
+    write_manifest(manifest_path, manifest)
+
+    runner = PipelineRunner(params=params, stages=batch_stages())
+    profiler = Profiler(cprofile_dir=os.path.join(out_dir, "profile") if cprofile else None)
+    start = time.perf_counter()
+    try:
+        with profiling(profiler):
+            results = runner.run(targets)
+        manifest["status"] = "done"
+    except Exception as e:
+        results = {}
+        manifest["status"] = "failed"
+        manifest["error"] = f"{type(e).__name__}: {e}"
+        traceback.print_exc()
+
+    # === Record what ran ===
+    manifest["finished"] = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+    manifest["seconds"] = time.perf_counter() - start
+    manifest["stages"] = {name: {"seconds": seconds} for name, seconds in runner.timings.items()}
+    if "gate" in runner.results:
+        manifest["stages"]["gate"]["cached"] = runner.results["gate"]["cached"]
+    if "gnn" in runner.results:
+        gnn = runner.results["gnn"]
+        manifest["stages"]["gnn"].update(accuracy=gnn["accuracy"], checkpoint=gnn["checkpoint_path"])
+    if "summary" in results:
+        manifest["samples"] = results["summary"]["summary_path"]
+    manifest["peak_rss_mb"] = peak_rss_mb()
+    manifest["profile"] = profiler.summary()
+    manifest["trace"] = profiler.save_trace(os.path.join(out_dir, "trace.json"))
+    write_manifest(manifest_path, manifest)
+    print(f"{'✅' if manifest['status'] == 'done' else '❌'} Run {manifest['status']} in {manifest['seconds']:.2f}s; "
+          f"manifest: {manifest_path}")
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process a directory of .fcs files without the UI.")
+    parser.add_argument("--fcs-dir", required=True, help="directory of .fcs files (one sample per file)")
+    parser.add_argument("--fluor-map", required=True, help="fluorochrome → marker JSON (as saved by the apps)")
+    parser.add_argument("--gates", default=None,
+                        help="gate spec (JSON/YAML); defaults to the legacy lymphocyte + singlet gates")
+    parser.add_argument("--out", required=True, help="output directory for results and the run manifest")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="gating worker processes (1 = serial, 0 = one per core)")
+    parser.add_argument("--n-jobs", type=int, default=-1, help="threads for kNN search and anomaly scoring")
+    parser.add_argument("--targets", nargs="+", default=DEFAULT_TARGETS,
+                        choices=[stage.name for stage in batch_stages()],
+                        help="stages to run (dependencies included)")
+    parser.add_argument("--plots", action="store_true", help="also draw the UMAP and marker figures")
+    parser.add_argument("--k", type=int, default=15, help="graph neighbors per cell")
+    parser.add_argument("--knn-backend", choices=sorted(BACKENDS), default="exact",
+                        help="exact search, or approximate NN-descent for millions of cells")
+    parser.add_argument("--gnn-mode", choices=["full", "minibatch"], default="full")
+    parser.add_argument("--epochs", type=int, default=None, help="default: 100 (full) / 10 (minibatch)")
+    parser.add_argument("--cache-dir", default=None, help="stage cache (default: <out>/cache)")
+    parser.add_argument("--no-cache", action="store_true", help="recompute every stage")
+    parser.add_argument("--cprofile", action="store_true", help="also write cProfile stats per stage to <out>/profile")
+    args = parser.parse_args()
+
+    manifest = run_batch(args.fcs_dir, args.fluor_map, args.gates, args.out, workers=args.workers,
+                         n_jobs=args.n_jobs, targets=args.targets + sorted(PLOT_TARGETS) * args.plots,
+                         cache_dir=args.cache_dir, use_cache=not args.no_cache, cprofile=args.cprofile,
+                         stage_params={"graph": {"k": args.k, "knn_backend": args.knn_backend},
+                                       "gnn": {"mode": args.gnn_mode, "epochs": args.epochs}})
+    sys.exit(0 if manifest["status"] == "done" else 1)
@@ -0,0 +1,245 @@
+import json
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict, deque
+from src.pipeline.profiling import Profiler, profiling
+from src.pipeline.runner import PipelineRunner
+
+# Background pipeline jobs for the Streamlit front ends.
+#
+# A JobManager owns a small pool of worker threads. Submitting a job only queues
+# it and returns immediately, so the Streamlit script thread never blocks; the UI
+# polls job.status()/job.fraction and renders job.result once the job is done.
+#
+#   manager = JobManager(workers=1)
+#   job = manager.submit(user, ["anomalies", "marker_plots"])
+#   manager.get(job.id).status()   # {"state", "stage", "fraction", "message", ...}
+#
+#   fairness    each user has a FIFO queue and at most one running job; free
+#               workers take the next job round-robin across users, so one user
+#               queueing many runs doesn't starve the others
+#   reuse       submitting the same targets and parameters again returns the
+#               existing queued/running/finished job instead of starting new work,
+#               so widget interactions and reruns are served from the job's output
+#   memory      a user's PipelineRunner is kept between jobs, so consecutive jobs
+#               share loaded graphs and models; only the max_runners users with
+#               the most recent jobs keep theirs, and a user's runner is dropped
+#               with their inputs (invalidate) or once all their jobs are
+#               forgotten. Finished jobs beyond max_finished are forgotten
+#               oldest first
+#   cancel      queued jobs are dropped; running jobs stop at their next progress
+#               report
+#   profile     every job runs under its own profiler; job.profile holds the
+#               per-span summary (time, memory, throughput) and job.trace the
+#               Chrome trace of the stages it actually ran
+#
+# Stages write to fixed paths under data/processed, so concurrent jobs of
+# different users only make sense with workers=1 unless those paths are separated.
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, user, targets, params=None, stages=()):
+        self.id = uuid.uuid4().hex[:12]
+        self.user = user
+        self.targets = list(targets)
+        self.params = params or {}
+        self.stages = list(stages)
+        self.state = QUEUED
+        self.stage = None
+        self.stage_fraction = 0.0
+        self.message = ""
+        self.completed = []
+        self.result = None
+        self.error = None
+        self.timings = {}
+        self.profile = []
+        self.trace = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_requested = False
+        self._lock = threading.Lock()
+
+    @property
+    def key(self):
+        return self.user, tuple(self.targets), json.dumps(self.params, sort_keys=True, default=str)
+
+    @property
+    def done(self):
+        return self.state in (DONE, FAILED, CANCELLED)
+
+    @property
+    def fraction(self):
+        """Overall progress: finished stages plus the running stage's own fraction."""
+        if self.state == DONE:
+            return 1.0
+        if not self.stages:
+            return 0.0
+        return min((len(self.completed) + self.stage_fraction) / len(self.stages), 1.0)
+
+    def update(self, stage, fraction, message):
+        with self._lock:
+            if stage != self.stage and self.stage is not None and self.stage not in self.completed:
+                self.completed.append(self.stage)
+            self.stage = stage
+            self.stage_fraction = max(0.0, min(float(fraction), 1.0))
+            self.message = message
+            if self.stage_fraction >= 1.0 and stage not in self.completed:
+                self.completed.append(stage)
+                self.stage_fraction = 0.0
+        if self.cancel_requested:
+            raise JobCancelled(f"Job {self.id} cancelled")
+
+    def status(self):
+        with self._lock:
+            end = self.finished or time.time()
+            return {"id": self.id, "user": self.user, "state": self.state, "stage": self.stage,
+                    "fraction": self.fraction, "message": self.message, "completed": list(self.completed),
+                    "stages": list(self.stages), "error": self.error,
+                    "elapsed": end - self.started if self.started else 0.0}
+
+
+class JobManager:
+    def __init__(self, workers=1, runner_factory=PipelineRunner, max_finished=50, max_runners=4):
+        self.runner_factory = runner_factory
+        self.max_finished = max_finished
+        self.max_runners = max_runners
+        self._cond = threading.Condition()
+        self._queues = OrderedDict()   # user -> deque of queued jobs, in round-robin order
+        self._running_users = set()
+        self._jobs = OrderedDict()     # job id -> job, in submission order
+        self._runners = OrderedDict()  # user -> PipelineRunner, least recently used first
+        self._threads = [threading.Thread(target=self._work, name=f"flowsense-job-{i}", daemon=True)
+                         for i in range(max(1, workers))]
+        for thread in self._threads:
+            thread.start()
+
+    # === Submitting and inspecting ===
+    def submit(self, user, targets, params=None):
+        """Queue a pipeline run for user; an identical job that hasn't failed is returned instead."""
+        targets = [targets] if isinstance(targets, str) else list(targets)
+        stages = self.runner_factory().order(targets)
+        job = Job(user, targets, params, stages)
+        with self._cond:
+            for existing in reversed(self._jobs.values()):
+                if existing.key == job.key and existing.state not in (FAILED, CANCELLED):
+                    return existing
+            self._jobs[job.id] = job
+            self._queues.setdefault(user, deque()).append(job)
+            self._cond.notify()
+        return job
+
+    def get(self, job_id):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def jobs(self, user=None):
+        with self._cond:
+            return [job for job in self._jobs.values() if user is None or job.user == user]
+
+    def queue_position(self, job):
+        """Jobs that will start before this one (0 if it is next or already running)."""
+        if job.state != QUEUED:
+            return 0
+        with self._cond:
+            own = list(self._queues.get(job.user, ()))
+            ahead = own.index(job) if job in own else 0
+            # Round-robin: every other user with queued work gets up to as many turns first
+            others = sum(min(len(q), ahead + 1) for u, q in self._queues.items() if u != job.user)
+            return ahead + others
+
+    def cancel(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.done:
+                return False
+            if job.state == QUEUED:
+                self._queues[job.user].remove(job)
+                job.state, job.finished = CANCELLED, time.time()
+            else:
+                job.cancel_requested = True
+            return True
+
+    def invalidate(self, user):
+        """New inputs for user: forget their finished jobs and their runner's in-memory stage results."""
+        with self._cond:
+            for job_id in [j.id for j in self._jobs.values() if j.user == user and j.done]:
+                del self._jobs[job_id]
+            # A running job keeps its own reference; the user's next job starts from a fresh runner
+            self._runners.pop(user, None)
+
+    # === Workers ===
+    def _next_job(self):
+        for user in list(self._queues):
+            queue = self._queues[user]
+            if queue and user not in self._running_users:
+                # Served users go to the back of the rotation
+                self._queues.move_to_end(user)
+                return queue.popleft()
+        return None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None:
+                    self._cond.wait()
+                    job = self._next_job()
+                self._running_users.add(job.user)
+                job.state, job.started = RUNNING, time.time()
+                runner = self._runner(job.user)
+            try:
+                self._run(job, runner)
+            finally:
+                with self._cond:
+                    self._running_users.discard(job.user)
+                    self._prune()
+                    self._cond.notify_all()
+
+    def _runner(self, user):
+        """user's runner (created if needed), marked most recently used; evicts the least recent idle ones."""
+        runner = self._runners.pop(user, None) or self.runner_factory()
+        self._runners[user] = runner
+        idle = [u for u in self._runners if u != user and u not in self._running_users]
+        for u in idle[:max(0, len(self._runners) - self.max_runners)]:
+            del self._runners[u]
+        return runner
+
+    def _run(self, job, runner):
+        for name, params in job.params.items():
+            runner.set_params(name, **params)
+        runner.progress = job.update
+        profiler = Profiler()
+        try:
+            with profiling(profiler):
+                job.result = runner.run(job.targets)
+            job.timings = dict(runner.timings)
+            job.state = DONE
+        except JobCancelled:
+            job.state = CANCELLED
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+            job.state = FAILED
+            traceback.print_exc()
+        finally:
+            runner.progress = None
+            job.profile = profiler.summary()
+            job.trace = profiler.trace()
+            job.finished = time.time()
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+        # Users with no jobs left have nothing that could reuse their runner
+        users = {job.user for job in self._jobs.values()} | self._running_users
+        for user in [u for u in self._runners if u not in users]:
+            del self._runners[user]
@@ -0,0 +1,269 @@
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Timing spans, memory and throughput for the pipeline's stages and hot paths.
+#
+# Code marks its expensive sections with span(); throughput is counted on the span:
+#
+#   with span("knn", backend=knn_backend) as sp:
+#       ...
+#       sp.count("edges", len(X) * k)       # summarized as edges/s
+#
+# Outside an active profiler span() is a no-op, so instrumented code costs nothing
+# in the apps' and scripts' normal runs. A profiler is active for the thread that
+# enters profiling():
+#
+#   profiler = Profiler()
+#   with profiling(profiler):
+#       runner.run(["summary"])
+#   profiler.summary()                      # rows per span path: calls, seconds, memory, rates
+#   profiler.save_trace("trace.json")       # chrome://tracing / https://ui.perfetto.dev
+#
+# Every span records wall time, resident memory at start and end plus its peak
+# (sampled every sample_interval seconds by a background thread), CUDA tensor
+# memory when torch is in use on a GPU, and its counters. Spans nest per thread;
+# summary rows are keyed by the span path ("graph/knn").
+#
+# With cprofile_dir set, every outermost span is also run under cProfile and its
+# stats are written to <cprofile_dir>/<name>.prof (pstats, snakeviz). Sampling
+# profilers such as py-spy attach from outside and need no hook:
+#   py-spy record -o profile.svg -- python -m src.pipeline.cli ...
+
+DEFAULT_SAMPLE_INTERVAL = 0.05
+_local = threading.local()
+
+
+# === Process memory ===
+def peak_rss_mb():
+    """Peak resident memory of the calling process in MB (ru_maxrss is KB on Linux, bytes on macOS)."""
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def current_rss_mb():
+    """Resident memory of the calling process right now in MB (None if it can't be read)."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
+
+def _cuda_mb():
+    """(allocated, peak allocated) CUDA tensor memory in MB, or None without a GPU in use."""
+    torch = sys.modules.get("torch")
+    if torch is None or not torch.cuda.is_available():
+        return None
+    return torch.cuda.memory_allocated() / 1024 ** 2, torch.cuda.max_memory_allocated() / 1024 ** 2
+
+
+class Span:
+    def __init__(self, name, path, attrs, thread):
+        self.name = name
+        self.path = path
+        self.attrs = attrs
+        self.thread = thread
+        self.counters = {}
+        self.start = time.perf_counter()
+        self.end = None
+        self.rss_start = self.rss_end = self.rss_peak = None
+        self.cuda_start = self.cuda_end = None
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    @property
+    def seconds(self):
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def rates(self):
+        seconds = self.seconds
+        return {f"{name}/s": n / seconds for name, n in self.counters.items()} if seconds > 0 else {}
+
+
+class _NullSpan:
+    def count(self, name, n=1):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Profiler:
+    def __init__(self, sample_interval=DEFAULT_SAMPLE_INTERVAL, cprofile_dir=None):
+        self.sample_interval = sample_interval
+        self.cprofile_dir = cprofile_dir
+        self.spans = []       # finished spans, in completion order
+        self.samples = []     # (seconds since origin, rss mb) for the trace's memory track
+        self.origin = time.perf_counter()
+        self._open = []
+        self._lock = threading.Lock()
+        self._sampler = None
+        self._stop = threading.Event()
+
+    # === Memory sampling ===
+    def _rss(self):
+        rss = current_rss_mb()
+        return rss if rss is not None else peak_rss_mb()
+
+    def _sample(self):
+        rss = self._rss()
+        with self._lock:
+            self.samples.append((time.perf_counter() - self.origin, rss))
+            for sp in self._open:
+                sp.rss_peak = max(sp.rss_peak, rss)
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.sample_interval):
+            self._sample()
+
+    def start(self):
+        if self._sampler is None and self.sample_interval:
+            self._stop.clear()
+            self._sampler = threading.Thread(target=self._sample_loop, name="flowsense-profiler", daemon=True)
+            self._sampler.start()
+        return self
+
+    def stop(self):
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+            self._sampler = None
+        return self
+
+    # === Spans ===
+    @contextmanager
+    def span(self, name, **attrs):
+        stack = _local.__dict__.setdefault("stack", [])
+        path = f"{stack[-1].path}/{name}" if stack else name
+        sp = Span(name, path, attrs, threading.current_thread().name)
+        sp.rss_start = sp.rss_peak = self._rss()
+        sp.cuda_start = _cuda_mb()
+        profile = None
+        if self.cprofile_dir and not stack:
+            profile = cProfile.Profile()
+        stack.append(sp)
+        with self._lock:
+            self._open.append(sp)
+        if profile is not None:
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler (e.g. python -m cProfile) is already running
+                profile = None
+        try:
+            yield sp
+        finally:
+            if profile is not None:
+                profile.disable()
+            sp.end = time.perf_counter()
+            sp.rss_end = self._rss()
+            sp.cuda_end = _cuda_mb()
+            stack.pop()
+            with self._lock:
+                self._open.remove(sp)
+                sp.rss_peak = max(sp.rss_peak, sp.rss_end)
+                self.spans.append(sp)
+            if profile is not None:
+                os.makedirs(self.cprofile_dir, exist_ok=True)
+                profile.dump_stats(os.path.join(self.cprofile_dir, f"{name}.prof"))
+
+    # === Reports ===
+    def summary(self):
+        """One row per span path (first-started first): calls, seconds, memory, counters and rates."""
+        rows = {}
+        with self._lock:
+            spans = sorted(self.spans, key=lambda sp: sp.start)
+        for sp in spans:
+            row = rows.setdefault(sp.path, {"path": sp.path, "calls": 0, "seconds": 0.0, "peak_rss_mb": 0.0,
+                                            "rss_delta_mb": 0.0, "counters": {}})
+            row["calls"] += 1
+            row["seconds"] += sp.seconds
+            row["peak_rss_mb"] = max(row["peak_rss_mb"], sp.rss_peak)
+            row["rss_delta_mb"] += sp.rss_end - sp.rss_start
+            for name, n in sp.counters.items():
+                row["counters"][name] = row["counters"].get(name, 0) + n
+            if sp.cuda_end is not None:
+                row["cuda_peak_mb"] = max(row.get("cuda_peak_mb", 0.0), sp.cuda_end[1])
+        for row in rows.values():
+            row["rates"] = {f"{name}/s": n / row["seconds"] for name, n in row["counters"].items()
+                            if row["seconds"] > 0}
+        return list(rows.values())
+
+    def trace(self):
+        """Chrome trace event format: a complete event per span plus an RSS counter track."""
+        pid = os.getpid()
+        with self._lock:
+            spans, samples = list(self.spans), list(self.samples)
+        tids = {}
+        events = []
+        for sp in sorted(spans, key=lambda sp: sp.start):
+            tid = tids.setdefault(sp.thread, len(tids) + 1)
+            events.append({"name": sp.name, "cat": sp.path.split("/")[0], "ph": "X", "pid": pid, "tid": tid,
+                           "ts": (sp.start - self.origin) * 1e6, "dur": sp.seconds * 1e6,
+                           "args": {**sp.attrs, **sp.counters, **{k: round(v, 1) for k, v in sp.rates().items()},
+                                    "rss_peak_mb": round(sp.rss_peak, 1)}})
+        for t, rss in samples:
+            events.append({"name": "rss_mb", "ph": "C", "pid": pid, "ts": t * 1e6, "args": {"rss_mb": round(rss, 1)}})
+        for thread, tid in tids.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": thread}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save_trace(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        trace = self.trace()
+        trace["otherData"] = {"summary": self.summary()}
+        with open(path, "w") as f:
+            json.dump(trace, f, default=str)
+        return path
+
+
+# === Thread-local active profiler ===
+def active_profiler():
+    return getattr(_local, "profiler", None)
+
+
+@contextmanager
+def profiling(profiler):
+    """Make profiler active for spans entered on this thread (and sample memory meanwhile)."""
+    previous = active_profiler()
+    _local.profiler = profiler
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        _local.profiler = previous
+
+
+@contextmanager
+def span(name, **attrs):
+    """A timing span on the active profiler; a no-op (with a no-op count()) when none is active."""
+    profiler = active_profiler()
+    if profiler is None:
+        yield NULL_SPAN
+        return
+    with profiler.span(name, **attrs) as sp:
+        yield sp
+
+
+def format_rates(rates):
+    """'1.2M events/s, 350k edges/s' for a summary row's rates."""
+    parts = []
+    for name, rate in rates.items():
+        for scale, suffix in ((1e6, "M"), (1e3, "k"), (1, "")):
+            if rate >= scale or scale == 1:
+                parts.append(f"{rate / scale:.3g}{suffix} {name}")
+                break
+    return ", ".join(parts)
@@ -0,0 +1,167 @@
+import time
+from src.pipeline.profiling import span
+
+# The FlowSense pipeline as a DAG of in-process stages.
+#
+#   gate → graph → gnn → gnn_plots
+#               ↘ anomalies → marker_plots
+#
+# Each stage is a function of its dependencies' results (kept in memory, so the
+# graph is loaded once and the trained model is handed straight to the plots)
+# plus its own parameters. Running a target runs whatever it depends on first;
+# results are memoized on the runner, so a later target reuses earlier stages
+# instead of re-importing torch/umap/sklearn and re-reading every file in a new
+# interpreter. The gate, graph and anomaly stages also go through the on-disk
+# stage cache (src/pipeline/stage_cache.py), so a fresh runner over unchanged
+# inputs restores them instead of recomputing.
+#
+#   runner = PipelineRunner(params={"gnn": {"epochs": 50}})
+#   results = runner.run(["gnn_plots", "marker_plots"])
+#   runner.invalidate("gate")   # new inputs: drop gate and everything downstream
+#
+# A progress(stage, fraction, message) callback on the runner receives stage
+# starts/ends plus whatever the stage reports in between (files gated, graph
+# edges built, training epochs, anomaly scoring chunks). Every stage runs in a
+# profiling span (src/pipeline/profiling.py), so an active profiler sees the
+# stages and the spans their hot paths open inside them.
+
+
+class Stage:
+    def __init__(self, name, fn, deps=(), description=""):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.description = description
+
+
+# === Stage functions: fn(inputs, progress, **params), inputs = {dependency: result} ===
+def gate_stage(inputs, progress=None, **params):
+    from src.preprocessing import apply_gates
+    # Paths are read from the module when the stage runs, so a redirected workspace applies
+    params = dict(params, gates=params.get("gates") or apply_gates.gates_path)
+    return apply_gates.run_gating(progress=progress, **params)
+
+
+def graph_stage(inputs, progress=None, **params):
+    from src.modeling.build_graph import build
+    return build(progress=progress, **params)
+
+
+def gnn_stage(inputs, progress=None, **params):
+    from src.modeling.gnn_model import train
+    from src.modeling.checkpoint import load_checkpoint
+    model, acc, path = train(data=inputs["graph"], progress=progress, **params)
+    ckpt = load_checkpoint(path)[1] if path else None
+    return {"model": model, "accuracy": acc, "checkpoint": ckpt, "checkpoint_path": path}
+
+
+def anomaly_stage(inputs, progress=None, **params):
+    from src.analysis.detect_anomalies import detect, out_umap
+    table, embedding = detect(data=inputs["graph"], progress=progress, **params)
+    return {"table": table, "embedding": embedding, "plot": out_umap if embedding is not None else None}
+
+
+def gnn_plot_stage(inputs, progress=None, **params):
+    from src.modeling.gnn_visualize import visualize
+    gnn = inputs["gnn"]
+    model = gnn["model"] if gnn["checkpoint"] is not None else None
+    return visualize(data=inputs["graph"], model=model, ckpt=gnn["checkpoint"], **params)
+
+
+def marker_plot_stage(inputs, progress=None, **params):
+    from src.analysis.analyze_gnn_markers import plot_violins
+    return plot_violins(inputs["anomalies"]["table"], **params)
+
+
+STAGES = [
+    Stage("gate", gate_stage, (), "gate every .fcs file into the event store"),
+    Stage("graph", graph_stage, ("gate",), "kNN cell graph over the gated CD4/CD8 cells"),
+    Stage("gnn", gnn_stage, ("graph",), "train and checkpoint the CD4/CD8 GraphSAGE classifier"),
+    Stage("anomalies", anomaly_stage, ("graph",), "isolation-forest anomaly scores and UMAP"),
+    Stage("gnn_plots", gnn_plot_stage, ("graph", "gnn"), "UMAP of GNN outputs, true vs predicted"),
+    Stage("marker_plots", marker_plot_stage, ("anomalies",), "marker violins by anomaly flag"),
+]
+
+
+class PipelineRunner:
+    def __init__(self, params=None, stages=STAGES, log=print, progress=None):
+        self.stages = {stage.name: stage for stage in stages}
+        self.params = {name: dict(p) for name, p in (params or {}).items()}
+        self.log = log
+        self.progress = progress
+        self.results = {}
+        self.timings = {}
+        unknown = set(self.params) - set(self.stages)
+        if unknown:
+            raise ValueError(f"❌ Parameters for unknown stage(s): {sorted(unknown)}")
+
+    def order(self, targets):
+        """Stages needed for targets, dependencies first."""
+        ordered, visiting = [], set()
+
+        def visit(name):
+            if name in ordered:
+                return
+            if name not in self.stages:
+                raise ValueError(f"❌ Unknown stage {name!r}; choose from {list(self.stages)}")
+            if name in visiting:
+                raise ValueError(f"❌ Dependency cycle through stage {name!r}")
+            visiting.add(name)
+            for dep in self.stages[name].deps:
+                visit(dep)
+            visiting.discard(name)
+            ordered.append(name)
+
+        for name in targets:
+            visit(name)
+        return ordered
+
+    def dependents(self, name):
+        """name and every stage downstream of it."""
+        out = {name}
+        changed = True
+        while changed:
+            changed = False
+            for stage in self.stages.values():
+                if stage.name not in out and out.intersection(stage.deps):
+                    out.add(stage.name)
+                    changed = True
+        return out
+
+    def invalidate(self, name=None):
+        """Forget the in-memory result of name and everything downstream (all stages if None)."""
+        names = set(self.stages) if name is None else self.dependents(name)
+        for n in names:
+            self.results.pop(n, None)
+            self.timings.pop(n, None)
+
+    def set_params(self, name, **params):
+        """Change a stage's parameters; its memoized result (and downstream ones) are dropped."""
+        if self.params.get(name, {}) != params:
+            self.params[name] = params
+            self.invalidate(name)
+
+    def _report(self, name, fraction, message):
+        if self.progress is not None:
+            self.progress(name, fraction, message)
+
+    def run(self, targets, force=()):
+        """Run targets (and their dependencies); returns {target: result}. Stages in force rerun."""
+        targets = [targets] if isinstance(targets, str) else list(targets)
+        for name in force:
+            self.invalidate(name)
+        for name in self.order(targets):
+            if name in self.results:
+                continue
+            stage = self.stages[name]
+            self.log(f"▶️ {name}: {stage.description}")
+            self._report(name, 0.0, stage.description)
+            start = time.perf_counter()
+            inputs = {dep: self.results[dep] for dep in stage.deps}
+            report = lambda fraction, message, name=name: self._report(name, fraction, message)
+            with span(name):
+                self.results[name] = stage.fn(inputs, progress=report, **self.params.get(name, {}))
+            self.timings[name] = time.perf_counter() - start
+            self.log(f"⏱️ {name} finished in {self.timings[name]:.2f}s")
+            self._report(name, 1.0, f"finished in {self.timings[name]:.2f}s")
+        return {name: self.results[name] for name in targets}
@@ -0,0 +1,221 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+
+# Content-addressed cache of stage outputs.
+#
+# A stage's key hashes everything its outputs depend on:
+#   - the contents of its input files/directories (file hashes are memoized by
+#     path + size + mtime, so unchanged multi-GB FCS files are not re-read),
+#   - its parameters (JSON),
+#   - the source of the code that produces it (code version).
+#
+#   <cache_dir>/<key>/entry.json     stage, outputs, size, created, last_used, signatures
+#   <cache_dir>/<key>/out_<i>        copy of the i-th output file or directory
+#   <cache_dir>/file_hashes.json     memoized input hashes
+#
+# On a hit the outputs are copied back into place and the stage is skipped; outputs
+# still in place since they were stored or restored (same sizes and mtimes) are left alone.
+# After every store, least-recently-used entries are evicted until the cache fits
+# in max_bytes (default FLOWSENSE_CACHE_GB, 10 GB).
+
+ENTRY_FILE = "entry.json"
+HASHES_FILE = "file_hashes.json"
+DEFAULT_BUDGET_GB = float(os.environ.get("FLOWSENSE_CACHE_GB", 10))
+_BLOCK = 1 << 20
+
+
+def _file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_BLOCK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _walk(path):
+    """Sorted file paths under path (or [path] for a file)."""
+    if os.path.isfile(path):
+        return [path]
+    files = []
+    for root, dirs, names in os.walk(path):
+        dirs.sort()
+        files.extend(os.path.join(root, name) for name in sorted(names))
+    return files
+
+
+def _tree_size(path):
+    return sum(os.path.getsize(p) for p in _walk(path)) if os.path.exists(path) else 0
+
+
+def _signature(path):
+    """Cheap fingerprint of a file or directory tree: relative paths, sizes and mtimes."""
+    if not os.path.exists(path):
+        return None
+    root = path if os.path.isdir(path) else os.path.dirname(path)
+    h = hashlib.sha256()
+    for file in _walk(path):
+        st = os.stat(file)
+        h.update(f"{os.path.relpath(file, root)}:{st.st_size}:{st.st_mtime_ns}".encode())
+    return h.hexdigest()
+
+
+def _copy(src, dst):
+    if os.path.isdir(dst):
+        shutil.rmtree(dst)
+    elif os.path.exists(dst):
+        os.remove(dst)
+    os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok=True)
+    if os.path.isdir(src):
+        shutil.copytree(src, dst)
+    else:
+        shutil.copy2(src, dst)
+
+
+def code_version(*objects):
+    """Hash of the source files defining the given modules, classes or functions (or file paths)."""
+    import inspect
+    h = hashlib.sha256()
+    for obj in objects:
+        path = obj if isinstance(obj, str) else inspect.getsourcefile(obj)
+        with open(path, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+class StageCache:
+    def __init__(self, cache_dir, max_bytes=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_bytes if max_bytes is not None else DEFAULT_BUDGET_GB * 1024 ** 3)
+        os.makedirs(cache_dir, exist_ok=True)
+        self._hashes_path = os.path.join(cache_dir, HASHES_FILE)
+        self._hashes = {}
+        if os.path.exists(self._hashes_path):
+            with open(self._hashes_path, "r") as f:
+                self._hashes = json.load(f)
+
+    # === Keys ===
+    def file_hash(self, path):
+        st = os.stat(path)
+        path = os.path.abspath(path)
+        memo = self._hashes.get(path)
+        if memo and memo["size"] == st.st_size and memo["mtime_ns"] == st.st_mtime_ns:
+            return memo["sha256"]
+        digest = _file_sha256(path)
+        self._hashes[path] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest}
+        return digest
+
+    def _save_hashes(self):
+        tmp = self._hashes_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self._hashes, f)
+        os.replace(tmp, self._hashes_path)
+
+    def key(self, stage, inputs=(), params=None, code=""):
+        """Hex key for a stage run; inputs are files or directories (missing ones hash as absent)."""
+        h = hashlib.sha256()
+        h.update(stage.encode())
+        h.update(json.dumps(params or {}, sort_keys=True, default=str).encode())
+        h.update(str(code).encode())
+        for path in inputs:
+            h.update(b"\0" + os.path.basename(os.path.normpath(path)).encode())
+            if not os.path.exists(path):
+                h.update(b"<missing>")
+                continue
+            root = path if os.path.isdir(path) else os.path.dirname(path)
+            for file in _walk(path):
+                h.update(os.path.relpath(file, root).encode())
+                h.update(self.file_hash(file).encode())
+        self._save_hashes()
+        return h.hexdigest()[:32]
+
+    # === Entries ===
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def _read_entry(self, key):
+        path = os.path.join(self._entry_dir(key), ENTRY_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def _write_entry(self, entry_dir, entry):
+        tmp = os.path.join(entry_dir, ENTRY_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(entry, f, indent=2)
+        os.replace(tmp, os.path.join(entry_dir, ENTRY_FILE))
+
+    def restore(self, key, outputs):
+        """Copy a cached entry's outputs into place; False if there is no such entry."""
+        entry = self._read_entry(key)
+        if entry is None or len(entry["outputs"]) != len(outputs):
+            return False
+        entry_dir = self._entry_dir(key)
+        signatures = entry.get("signatures", [None] * len(outputs))
+        for i, dst in enumerate(outputs):
+            src = os.path.join(entry_dir, f"out_{i}")
+            if os.path.exists(src) and (signatures[i] is None or _signature(dst) != signatures[i]):
+                _copy(src, dst)
+                signatures[i] = _signature(dst)
+        entry["signatures"] = signatures
+        entry["last_used"] = time.time()
+        self._write_entry(entry_dir, entry)
+        return True
+
+    def store(self, key, stage, outputs):
+        """Copy the stage's outputs into the cache under key, then evict down to the budget."""
+        entry_dir = self._entry_dir(key)
+        tmp_dir = entry_dir + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        for i, src in enumerate(outputs):
+            if os.path.exists(src):
+                _copy(src, os.path.join(tmp_dir, f"out_{i}"))
+        now = time.time()
+        size = _tree_size(tmp_dir)
+        self._write_entry(tmp_dir, {"stage": stage, "outputs": [os.path.abspath(p) for p in outputs],
+                                    "size": size, "created": now, "last_used": now,
+                                    "signatures": [_signature(p) for p in outputs]})
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.replace(tmp_dir, entry_dir)
+        self.evict(keep=key)
+        return size
+
+    def entries(self):
+        out = []
+        for name in os.listdir(self.cache_dir):
+            entry = self._read_entry(name) if not name.endswith(".tmp") else None
+            if entry is not None:
+                out.append((name, entry))
+        return out
+
+    def evict(self, keep=None):
+        """Remove least-recently-used entries until the total size fits max_bytes."""
+        entries = sorted(self.entries(), key=lambda e: e[1]["last_used"])
+        total = sum(e["size"] for _, e in entries)
+        removed = []
+        for name, entry in entries:
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(self._entry_dir(name), ignore_errors=True)
+            total -= entry["size"]
+            removed.append(name)
+        return removed
+
+    # === Running stages ===
+    def run(self, stage, fn, inputs=(), params=None, code="", outputs=()):
+        """
+        Run fn() unless an entry for (inputs, params, code) exists, in which case its
+        outputs are restored instead. Returns (hit, key).
+        """
+        key = self.key(stage, inputs, params, code)
+        if self.restore(key, outputs):
+            return True, key
+        fn()
+        self.store(key, stage, outputs)
+        return False, key
@@ -1,79 +1,82 @@
 import os
-import pandas as pd
-import FlowCal # type: ignore
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
 import matplotlib.pyplot as plt
-from sklearn.preprocessing import StandardScaler
-from sklearn.utils import resample
-import umap
 import time
+import argparse
+from src.preprocessing.event_store import ingest_fcs, read_events, register_samples, ID_COLUMN
+from src.preprocessing import apply_gates
+from src.preprocessing.parallel import map_files, resolve_workers
+from src.analysis.embedding import load_or_fit
+from src.preprocessing.downsample import METHODS, downsample_events
 
 # ========== SETUP PATHS ==========
 script_dir = os.path.dirname(os.path.abspath(__file__))
 data_dir = os.path.join(script_dir, "..", "data")
 processed_dir = os.path.join(script_dir, "..", "data", "processed")
+events_dir = os.path.join(processed_dir, "events")
 plots_dir = os.path.join(script_dir, "..", "plots")
+umap_path = os.path.join(processed_dir, "models", "umap_events.joblib")
+selection_path = os.path.join(processed_dir, "selections", "umap_events.npz")
 os.makedirs(processed_dir, exist_ok=True)
 os.makedirs(plots_dir, exist_ok=True)
 
-# ========== STEP 1: FCS → CSV ==========
-for fname in os.listdir(data_dir):
-    if fname.endswith(".fcs"):
-        fcs_path = os.path.join(data_dir, fname)
-        try:
-            data = FlowCal.io.FCSData(fcs_path)
-            df = pd.DataFrame(data, columns=data.channels)
-            outname = fname.replace(".fcs", ".csv")
-            outpath = os.path.join(processed_dir, outname)
-            df.to_csv(outpath, index=False)
-            print(f"✅ Converted: {fname} → {outname}")
-        except Exception as e:
-            print(f"❌ Failed to convert {fname}: {e}")
+# ========== STEP 1: FCS → Event Store ==========
+def ingest_all(workers):
+    fcs_files = sorted(f for f in os.listdir(data_dir) if f.endswith(".fcs"))
+    paths = [os.path.join(data_dir, fname) for fname in fcs_files]
+    # Ids are assigned here, before the workers start, so every run maps a file to the same id.
+    # The registry is the one gating uses, so a file's events have the same ids in both stores.
+    sample_ids = register_samples(apply_gates.registry_path, fcs_files)
+    for path, n_events, seconds in map_files(ingest_fcs, paths, workers=workers, return_exceptions=True,
+                                             store_dir=events_dir, sample_ids=sample_ids):
+        fname = os.path.basename(path)
+        if isinstance(n_events, Exception):
+            print(f"❌ Failed to convert {fname}: {n_events}")
+        elif n_events == 0:
+            print(f"⚠️ Skipping empty file: {fname}")
+        else:
+            print(f"✅ Stored: {fname} ({n_events} events) in {seconds:.2f}s")
 
-# ========== STEP 2: Combine CSVs ==========
-df_list = []
-for fname in os.listdir(processed_dir):
-    if fname.endswith(".csv"):
-        path = os.path.join(processed_dir, fname)
-        try:
-            df = pd.read_csv(path)
-            if df.empty:
-                print(f"⚠️ Skipping empty file: {fname}")
-                continue
-            df["source_file"] = fname
-            df_list.append(df)
-        except Exception as e:
-            print(f"❌ Error reading {fname}: {e}")
 
-if not df_list:
-    raise ValueError("❌ No valid CSVs to combine.")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest .fcs files into the event store and plot a UMAP overview.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="parallel ingest processes (1 = serial, 0 = one per core)")
+    parser.add_argument("--refit-umap", action="store_true", help="refit the reference UMAP instead of reusing it")
+    parser.add_argument("--downsample", choices=METHODS, default="density",
+                        help="per-sample caps, optionally favoring cells in sparse regions")
+    args = parser.parse_args()
 
-combined_df = pd.concat(df_list, ignore_index=True)
-print(f"✅ Combined shape: {combined_df.shape}")
+    ingest_all(resolve_workers(args.workers))
 
-# ========== STEP 3: UMAP on 50K Subsample ==========
-X = combined_df.select_dtypes(include="number").dropna(axis=1)
+    # ========== STEP 2: Load Combined Events ==========
+    combined_df = read_events(events_dir)
+    print(f"✅ Combined shape: {combined_df.shape}")
 
-# Subsample to 50,000 cells
-X_small = resample(X, n_samples=50000, random_state=42)
-scaler = StandardScaler()
-X_scaled = scaler.fit_transform(X_small)
+    # ========== STEP 3: UMAP on 50K Subsample ==========
+    X = combined_df.drop(columns=[ID_COLUMN], errors="ignore").select_dtypes(include="number").dropna(axis=1)
 
-print("🔄 Running UMAP on 50,000 cells...")
-start = time.time()
-reducer = umap.UMAP(n_neighbors=15, min_dist=0.1, random_state=42)
-embedding = reducer.fit_transform(X_scaled)
-print(f"✅ UMAP completed in {time.time() - start:.2f} seconds")
+    # Subsample to 50,000 cells (no duplicates, equal share per file, selection recorded)
+    X_small = downsample_events(combined_df, X, 50000, method=args.downsample, record_path=selection_path)
 
-# ========== STEP 4: Plot ==========
-plt.figure(figsize=(10, 7))
-plt.scatter(embedding[:, 0], embedding[:, 1], s=1, alpha=0.5)
-plt.title("UMAP of Flow Cytometry Data")
-plt.xlabel("UMAP 1")
-plt.ylabel("UMAP 2")
-plt.tight_layout()
+    # Fit the reference UMAP (+ scaler) once; later runs project with transform only
+    print("🔄 Running UMAP on 50,000 cells...")
+    start = time.time()
+    _, embedding, fitted = load_or_fit(umap_path, X_small, feature_cols=list(X.columns), refit=args.refit_umap,
+                                       n_neighbors=15, min_dist=0.1)
+    print(f"✅ UMAP {'fitted' if fitted else 'projected with saved reference'} in {time.time() - start:.2f} seconds")
 
-plot_path = os.path.join(plots_dir, "Flow_Tcell_umap.png")
-plt.savefig(plot_path, dpi=300)
-plt.show()
-print(f"✅ UMAP plot saved to: {plot_path}")
+    # ========== STEP 4: Plot ==========
+    plt.figure(figsize=(10, 7))
+    plt.scatter(embedding[:, 0], embedding[:, 1], s=1, alpha=0.5)
+    plt.title("UMAP of Flow Cytometry Data")
+    plt.xlabel("UMAP 1")
+    plt.ylabel("UMAP 2")
+    plt.tight_layout()
+
+    plot_path = os.path.join(plots_dir, "Flow_Tcell_umap.png")
+    plt.savefig(plot_path, dpi=300)
+    plt.show()
+    print(f"✅ UMAP plot saved to: {plot_path}")
 
@@ -1,62 +1,147 @@
 import os
-import FlowCal
-import numpy as np
-import pandas as pd
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+import argparse
+import shutil
+import time
 import json
+import pandas as pd
+from src.preprocessing.fcs_reader import FCSFile
+from src.preprocessing.gates import load_spec
+from src.preprocessing.event_store import ID_COLUMN, register_samples
+from src.preprocessing.gating import gate_file, output_columns, DEFAULT_CHUNK_SIZE
+from src.preprocessing.parallel import map_files, resolve_workers
+from src.pipeline.profiling import span
+from src.pipeline.stage_cache import StageCache, code_version
 
 # === Setup Paths ===
 script_dir = os.path.dirname(os.path.abspath(__file__))
 data_dir = "/Users/nididev/Documents/FlowTcell-MM/data"
 processed_dir = os.path.join(data_dir, "processed")
 map_path = os.path.join(processed_dir, "fluor_map.json")
+gates_path = os.path.join(processed_dir, "gates.json")
+counts_path = os.path.join(processed_dir, "gate_counts.csv")
+gated_dir = os.path.join(processed_dir, "gated")
+output_path = os.path.join(processed_dir, "gated_data.csv")
+parts_dir = os.path.join(processed_dir, "gated_parts")
+registry_path = os.path.join(processed_dir, "sample_ids.json")
+cache_dir = os.path.join(processed_dir, "cache")
+
+
+def run_gating(workers=1, gates=None, chunk_size=DEFAULT_CHUNK_SIZE, use_cache=True, progress=None):
+    """
+    Gate every .fcs file in data_dir into the gated event store and gated_data.csv;
+    progress(fraction, message) is called as files finish. gates defaults to gates_path.
+    """
+    gates = gates_path if gates is None else gates
+    # === Load Mapping ===
+    if not os.path.exists(map_path):
+        raise FileNotFoundError("❌ fluor_map.json not found. Run gating_ui.py first.")
+
+    with open(map_path, "r") as f:
+        fluor_map = json.load(f)
+
+    # === Load Gate Hierarchy ===
+    spec = load_spec(gates)
+    print(f"🧭 Gates: {' → '.join(g['name'] for g in spec['gates'])} (output: {spec.get('output')})")
+
+    # === Process all FCS files ===
+    fcs_files = sorted(f for f in os.listdir(data_dir) if f.endswith(".fcs"))
+    if not fcs_files:
+        raise FileNotFoundError(f"❌ No .fcs files found in {data_dir}")
+
+    workers = resolve_workers(workers)
+    print(f"📂 Gating {len(fcs_files)} files with {workers} worker(s)")
+    start = time.perf_counter()
+
+    # Stable sample ids, so every gated event keeps an event_id (sample id + index in its file)
+    sample_ids = register_samples(registry_path, fcs_files)
+
+    def gate_all():
+        # Merged CSV layout: event_id + union of every file's gated columns (first-seen order) + source_file
+        csv_columns = [ID_COLUMN]
+        for fname in fcs_files:
+            for col in output_columns(FCSFile(os.path.join(data_dir, fname)), fluor_map):
+                if col not in csv_columns:
+                    csv_columns.append(col)
+        csv_columns.append("source_file")
+
+        # Each file streams its survivors into its own CSV part; nothing is held in memory.
+        # The parts directory is removed however the run ends.
+        os.makedirs(parts_dir, exist_ok=True)
+        try:
+            total = 0
+            gate_counts = {}
+            # Worker processes' memory isn't seen by the span; its throughput counts every file
+            with span("gating", workers=workers, files=len(fcs_files)) as sp:
+                for path, result, seconds in map_files(gate_file, paths, workers=workers, fluor_map=fluor_map,
+                                                       gated_dir=gated_dir, spec=spec, csv_dir=parts_dir,
+                                                       csv_columns=csv_columns, chunk_size=chunk_size,
+                                                       sample_ids=sample_ids):
+                    fname = os.path.basename(path)
+                    total += result["gated"]
+                    gate_counts[fname] = dict(result["gates"], total=result["events"])
+                    sp.count("events", result["events"])
+                    sp.count("gated", result["gated"])
+                    print(f"⏱️ {fname}: {result['gated']}/{result['events']} events gated in {seconds:.2f}s")
+                    if progress is not None:
+                        progress(len(gate_counts) / len(fcs_files), f"{total} events gated ({len(gate_counts)}/{len(fcs_files)} files)")
+
+            # === Per-gate event counts (files × gates) ===
+            counts_df = pd.DataFrame.from_dict(gate_counts, orient="index").loc[fcs_files]
+            counts_df = counts_df[["total"] + [g["name"] for g in spec["gates"]]]
+            counts_df.index.name = "source_file"
+            counts_df.to_csv(counts_path)
+            print(f"\n📊 Events per gate:\n{counts_df}")
+
+            # === Save merged gated output ===
+            # Parts are concatenated in file-name order so parallel and serial runs write identical output.
+            # With no survivors the file is still rewritten (header only) so a previous run's cells don't linger.
+            with open(output_path, "w", newline="") as out:
+                pd.DataFrame(columns=csv_columns).to_csv(out, index=False)
+                for fname in fcs_files if total else []:
+                    with open(os.path.join(parts_dir, fname + ".csv"), "r", newline="") as part:
+                        shutil.copyfileobj(part, out)
+        finally:
+            shutil.rmtree(parts_dir, ignore_errors=True)
+        if total:
+            print(f"\n✅ Merged gated data saved: {output_path}")
+            print(f"✅ Gated event store: {gated_dir}")
+            print(f"✅ Gate counts saved: {counts_path}")
+            print(f"🔢 Total cells: {total} from {len(fcs_files)} files, {len(csv_columns)} features.")
+            print(f"⏱️ Gating finished in {time.perf_counter() - start:.2f}s")
+        else:
+            print(f"⚠️ No valid gated data found; {output_path} holds only its header.")
+
+    # === Run (or restore from the stage cache) ===
+    # Keyed by the FCS contents, fluor map, gate spec and gating code; worker count
+    # doesn't change the output so it isn't part of the key
+    paths = [os.path.join(data_dir, fname) for fname in fcs_files]
+    hit = False
+    if not use_cache:
+        gate_all()
+    else:
+        cache = StageCache(cache_dir)
+        code = code_version(__file__, gate_file, load_spec, FCSFile, register_samples)
+        hit, key = cache.run("gate", gate_all, inputs=paths + [map_path],
+                             params={"spec": spec, "chunk_size": chunk_size, "sample_ids": sample_ids},
+                             code=code, outputs=[gated_dir, output_path, counts_path])
+        if hit:
+            print(f"💾 Restored gated events from stage cache ({key[:12]}) in {time.perf_counter() - start:.2f}s")
+    return {"fcs_files": fcs_files, "sample_ids": sample_ids, "gated_dir": gated_dir,
+            "output_path": output_path, "counts_path": counts_path, "cached": hit}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply the gating hierarchy to every .fcs file.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="parallel worker processes (1 = serial, 0 = one per core)")
+    parser.add_argument("--gates", default=gates_path,
+                        help="gate spec (JSON/YAML); defaults to the legacy lymphocyte + singlet gates if missing")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="events per gating chunk; bounds memory per worker")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always re-gate instead of restoring unchanged inputs from the stage cache")
+    args = parser.parse_args()
 
-# === Load Mapping ===
-if not os.path.exists(map_path):
-    raise FileNotFoundError("❌ fluor_map.json not found. Run gating_ui.py first.")
-
-with open(map_path, "r") as f:
-    fluor_map = json.load(f)
-
-# === Process all FCS files ===
-gated_all = []
-
-fcs_files = [f for f in os.listdir(data_dir) if f.endswith(".fcs")]
-if not fcs_files:
-    raise FileNotFoundError("❌ No .fcs files found in /data")
-
-for fname in fcs_files:
-    fcs_path = os.path.join(data_dir, fname)
-    print(f"📂 Loading: {fname}")
-    data = FlowCal.io.FCSData(fcs_path)
-    df_np = np.asarray(data).byteswap().newbyteorder()
-    df = pd.DataFrame(df_np, columns=data.channels)
-
-    # Rename using fluor_map
-    df = df.rename(columns={fluor: marker for fluor, marker in fluor_map.items()})
-
-    # Gating: FSC/SSC lymphocyte region
-    if 'FSC-A' in df.columns and 'SSC-A' in df.columns:
-        df = df[(df['FSC-A'] > 10000) & (df['FSC-A'] < 80000)]
-        df = df[(df['SSC-A'] > 1000) & (df['SSC-A'] < 60000)]
-
-    # Gating: Singlets
-    if 'FSC-H' in df.columns and 'FSC-A' in df.columns:
-        ratio = df['FSC-A'] / (df['FSC-H'] + 1e-6)
-        df = df[(ratio > 0.85) & (ratio < 1.15)]
-
-    # Drop unnamed or unmapped columns
-    df = df[[col for col in df.columns if not col.startswith('Unnamed')]]
-
-    # Track source file
-    df["source_file"] = fname
-    gated_all.append(df)
-
-# === Save merged gated output ===
-if gated_all:
-    gated_df = pd.concat(gated_all, ignore_index=True)
-    output_path = os.path.join(processed_dir, "gated_data.csv")
-    gated_df.to_csv(output_path, index=False)
-    print(f"\n✅ Merged gated data saved: {output_path}")
-    print(f"🔢 Total cells: {gated_df.shape[0]} from {len(fcs_files)} files, {gated_df.shape[1]} features.")
-else:
-    print("⚠️ No valid gated data found.")
+    run_gating(workers=args.workers, gates=args.gates, chunk_size=args.chunk_size, use_cache=not args.no_cache)
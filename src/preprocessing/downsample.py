@@ -0,0 +1,128 @@
+import os
+import json
+import numpy as np
+
+# Event downsampling without replacement.
+#
+#   stratified  every sample (source_file) gets an equal share of the budget;
+#               samples with fewer events give their unused share to the others
+#   density     within each sample's share, cells are drawn with probability
+#               inversely proportional to their local density, so rare
+#               populations survive and dense ones are thinned (as in SPADE)
+#
+# Local density is approximated by binning cells on a grid over the first few
+# principal components and counting cells per bin (np.bincount), so the whole
+# selection is a handful of vectorized passes: a few seconds for 10M events.
+#
+# Selections are recorded as event ids (see event_store.make_event_ids) with the
+# parameters used, so any downsampled result can be traced back to its events.
+
+METHODS = ("stratified", "density")
+
+
+def stratified_caps(counts, n_total):
+    """Per-group sample sizes summing to min(n_total, sum(counts)), as equal as the group sizes allow."""
+    counts = np.asarray(counts, dtype=np.int64)
+    caps = np.zeros(len(counts), dtype=np.int64)
+    budget = min(int(n_total), int(counts.sum()))
+    # Water-filling: give every unfilled group an equal share until the budget is spent
+    while budget > 0:
+        open_groups = np.flatnonzero(caps < counts)
+        share = max(budget // len(open_groups), 1)
+        add = np.minimum(counts[open_groups] - caps[open_groups], share)
+        add[np.cumsum(add) > budget] = 0
+        if add.sum() == 0:
+            add[0] = 1
+        caps[open_groups] += add
+        budget -= int(add.sum())
+    return caps
+
+
+def grid_density(X, bins=32, n_components=4, random_state=42):
+    """Approximate local density of every row: cells sharing its bin on a PCA grid."""
+    X = np.asarray(X, dtype=np.float32)
+    n, d = X.shape
+    n_components = min(n_components, d)
+    # Principal axes from a subsample; projecting is one matmul
+    rng = np.random.default_rng(random_state)
+    sample = X[rng.choice(n, size=min(n, 200_000), replace=False)] if n > 200_000 else X
+    mean = sample.mean(axis=0)
+    std = sample.std(axis=0)
+    std[std == 0] = 1
+    _, vecs = np.linalg.eigh(np.cov(((sample - mean) / std).T))
+    axes = vecs[:, ::-1][:, :n_components].astype(np.float32)
+    Z = ((X - mean) / std) @ axes
+
+    # Robust bin edges (1st-99th percentile) so outliers don't squeeze the grid
+    lo, hi = np.percentile(((sample - mean) / std) @ axes, [1, 99], axis=0)
+    width = np.where(hi > lo, (hi - lo) / bins, 1)
+    idx = np.clip(((Z - lo) / width).astype(np.int64), 0, bins - 1)
+    codes = idx @ (bins ** np.arange(n_components, dtype=np.int64))
+    counts = np.bincount(codes, minlength=bins ** n_components)
+    return counts[codes]
+
+
+def weighted_choice(weights, k, rng):
+    """k indices drawn without replacement with probability ∝ weights (Efraimidis–Spirakis keys)."""
+    weights = np.asarray(weights, dtype=np.float64)
+    if k >= len(weights):
+        return np.arange(len(weights))
+    keys = np.log(rng.random(len(weights))) / weights
+    return np.argpartition(keys, len(keys) - k)[len(keys) - k:]
+
+
+def select_rows(X, n, groups=None, method="density", random_state=42, bins=32):
+    """
+    Sorted row positions of a downsample of X to (at most) n rows, without replacement.
+    `groups` (e.g. source_file codes) gets per-group stratified caps.
+    """
+    if method not in METHODS:
+        raise ValueError(f"❌ Unknown downsampling method {method!r}; choose from {METHODS}")
+    rng = np.random.default_rng(random_state)
+    n_rows = len(X)
+    groups = np.zeros(n_rows, dtype=np.int64) if groups is None else np.asarray(groups)
+    codes, group_idx = np.unique(groups, return_inverse=True)
+    order = np.argsort(group_idx, kind="stable")
+    counts = np.bincount(group_idx, minlength=len(codes))
+    caps = stratified_caps(counts, n)
+
+    density = grid_density(X, bins=bins, random_state=random_state) if method == "density" else None
+    selected = []
+    start = 0
+    for count, cap in zip(counts, caps):
+        rows = order[start:start + count]
+        start += count
+        if cap == 0:
+            continue
+        if density is None:
+            picked = rng.choice(count, size=cap, replace=False)
+        else:
+            picked = weighted_choice(1.0 / density[rows], cap, rng)
+        selected.append(rows[picked])
+    return np.sort(np.concatenate(selected)) if selected else np.empty(0, dtype=np.int64)
+
+
+def downsample_events(events, X, n, method="density", record_path=None, random_state=42):
+    """
+    Rows of feature frame X (aligned with the read_events frame `events`), stratified
+    by source_file. With record_path, the selected event ids are saved there.
+    """
+    groups = events["source_file"].cat.codes.to_numpy() if "source_file" in events else None
+    rows = select_rows(X.to_numpy(dtype=np.float32), n, groups, method, random_state)
+    if record_path and "event_id" in events:
+        record_selection(record_path, events["event_id"].to_numpy()[rows], method=method, n=int(n),
+                         random_state=random_state, features=list(X.columns))
+    return X.iloc[rows]
+
+
+def record_selection(path, event_ids, **params):
+    """Save the selected event ids and the parameters that produced them (.npz)."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.savez(path, event_id=np.asarray(event_ids, dtype=np.int64), params=json.dumps(params))
+    return path
+
+
+def load_selection(path):
+    """(event ids, params) saved by record_selection."""
+    with np.load(path) as f:
+        return f["event_id"], json.loads(str(f["params"]))
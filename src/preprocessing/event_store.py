@@ -0,0 +1,290 @@
+import os
+import hashlib
+import json
+import shutil
+from urllib.parse import quote, unquote
+import numpy as np
+import pandas as pd
+
+# Binary columnar event store.
+#
+# Layout (one partition per sample, keyed by source_file):
+#   <store_dir>/source_file=<name>/meta.json
+#   <store_dir>/source_file=<name>/c000.bin, c001.bin, ...   (one raw column per channel)
+#
+# Columns are stored as little-endian float32, so reading a subset of channels
+# only touches those files and each file can be memory-mapped directly. The one
+# exception is event_id (little-endian int64), a stable per-event key:
+#
+#   event_id = sample_id << 32 | index of the event in its original .fcs file
+#
+# Sample ids come from one registry (sample_ids.json at apply_gates.registry_path,
+# shared by ingest and gating) and never change once assigned, so any stage's
+# per-cell output can be joined back onto events by id.
+
+PARTITION_PREFIX = "source_file="
+META_FILE = "meta.json"
+EVENT_DTYPE = np.dtype("<f4")
+ID_COLUMN = "event_id"
+ID_DTYPE = np.dtype("<i8")
+MISSING_ID = -1
+EPHEMERAL_SAMPLE_ID = 0   # registered ids start at 1; 0 marks files gated on the fly, never stored
+
+
+def _partition_dir(store_dir, source_file):
+    return os.path.join(store_dir, PARTITION_PREFIX + quote(source_file, safe=" -_.()+,"))
+
+
+def _read_meta(part_dir):
+    with open(os.path.join(part_dir, META_FILE), "r") as f:
+        return json.load(f)
+
+
+def column_dtype(name):
+    return ID_DTYPE if name == ID_COLUMN else EVENT_DTYPE
+
+
+def make_event_ids(sample_id, index):
+    """event_id for events `index` (positions in the original file) of sample `sample_id`."""
+    return (np.int64(sample_id) << 32) | np.asarray(index, dtype=np.int64)
+
+
+def split_event_ids(event_ids):
+    """(sample_id, event index) arrays for an array of event ids."""
+    event_ids = np.asarray(event_ids, dtype=np.int64)
+    return event_ids >> 32, event_ids & 0xFFFFFFFF
+
+
+def registered_sample_ids(registry_path):
+    """{source_file: sample_id} of every registered file (empty without a registry)."""
+    if not os.path.exists(registry_path):
+        return {}
+    with open(registry_path, "r") as f:
+        return json.load(f)
+
+
+def register_samples(registry_path, names):
+    """Return {source_file: sample_id} for `names`, assigning new ids (and saving) for unseen files."""
+    registry = registered_sample_ids(registry_path)
+    new = [name for name in names if name not in registry]
+    if new:
+        next_id = max(registry.values(), default=0) + 1
+        for i, name in enumerate(new):
+            registry[name] = next_id + i
+        tmp = registry_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(registry, f, indent=2)
+        os.replace(tmp, registry_path)
+    return {name: registry[name] for name in names}
+
+
+def event_positions(event_ids, lookup_ids):
+    """
+    Position in `event_ids` of every id in `lookup_ids` (-1 where absent).
+
+    A single hash join over unique ids, O(len(event_ids) + len(lookup_ids)), so
+    per-cell results (graph nodes, predictions, scores) can be attached to event
+    rows without sorting or merging whole tables.
+    """
+    return pd.Index(np.asarray(event_ids, dtype=np.int64)).get_indexer(np.asarray(lookup_ids, dtype=np.int64))
+
+
+class PartitionWriter:
+    """
+    Append events to one partition chunk by chunk; the partition becomes visible on close().
+
+    The column set is fixed by `columns` (or by the first appended frame). Later
+    chunks are aligned to it, with missing columns written as NaN. Each column is
+    hashed as it is written, and meta.json records the partition's content digest.
+    """
+
+    def __init__(self, store_dir, source_file, columns=None):
+        self.source_file = source_file
+        self.part_dir = _partition_dir(store_dir, source_file)
+        self.tmp_dir = self.part_dir + ".tmp"
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        os.makedirs(self.tmp_dir)
+        self.columns = None
+        self.n_events = 0
+        self._files = []
+        self._hashes = []
+        if columns is not None:
+            self._open(columns)
+
+    def _open(self, columns):
+        self.columns = [str(c) for c in columns]
+        self._files = [open(os.path.join(self.tmp_dir, f"c{i:03d}.bin"), "wb") for i in range(len(self.columns))]
+        self._hashes = [hashlib.sha256(col.encode("utf-8")) for col in self.columns]
+
+    def append(self, df):
+        if self.columns is None:
+            self._open(df.select_dtypes(include="number").columns)
+        n = len(df)
+        for col, f, h in zip(self.columns, self._files, self._hashes):
+            dtype = column_dtype(col)
+            if col in df.columns:
+                values = np.ascontiguousarray(df[col].to_numpy(), dtype=dtype)
+            elif col == ID_COLUMN:
+                values = np.full(n, MISSING_ID, dtype=dtype)
+            else:
+                values = np.full(n, np.nan, dtype=dtype)
+            values.tofile(f)
+            h.update(values.data)
+        self.n_events += n
+
+    def close(self):
+        for f in self._files:
+            f.close()
+        columns = [{"name": col, "file": f"c{i:03d}.bin", "dtype": column_dtype(col).str}
+                   for i, col in enumerate(self.columns or [])]
+        # Per-column hashes don't depend on how events were chunked
+        digest = hashlib.sha256(b"".join(h.digest() for h in self._hashes)).hexdigest()
+        meta = {"source_file": self.source_file, "n_events": int(self.n_events), "columns": columns,
+                "digest": digest}
+        with open(os.path.join(self.tmp_dir, META_FILE), "w") as f:
+            json.dump(meta, f, indent=2)
+
+        # Directories can't be swapped atomically: the old partition is renamed aside,
+        # the new one renamed into place, then the old one deleted. Readers never see a
+        # half-written partition; between the two renames it is briefly missing, and a
+        # crash there leaves the previous version intact under the .old name.
+        old_dir = self.part_dir + ".old"
+        shutil.rmtree(old_dir, ignore_errors=True)
+        if os.path.exists(self.part_dir):
+            os.replace(self.part_dir, old_dir)
+        os.replace(self.tmp_dir, self.part_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+        return self.part_dir
+
+    def abort(self):
+        for f in self._files:
+            f.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_partition(store_dir, source_file, df):
+    """Write one sample's events (numeric columns only) as a partition, replacing any previous one."""
+    with PartitionWriter(store_dir, source_file, columns=df.select_dtypes(include="number").columns) as writer:
+        writer.append(df)
+    return writer.part_dir
+
+
+def list_partitions(store_dir):
+    """Sorted source_file names of all complete partitions in the store."""
+    if not os.path.isdir(store_dir):
+        return []
+    names = []
+    for entry in os.listdir(store_dir):
+        if entry.startswith(PARTITION_PREFIX) and not entry.endswith((".tmp", ".old")):
+            if os.path.exists(os.path.join(store_dir, entry, META_FILE)):
+                names.append(unquote(entry[len(PARTITION_PREFIX):]))
+    return sorted(names)
+
+
+def partition_info(store_dir, source_file):
+    return _read_meta(_partition_dir(store_dir, source_file))
+
+
+def partition_signature(store_dir, source_file):
+    """
+    Content digest of a partition, computed when it was written (only meta.json is read).
+    Re-gating a file to the same events gives the same signature. Partitions written
+    before digests were recorded fall back to their event count and file sizes/mtimes.
+    """
+    part_dir = _partition_dir(store_dir, source_file)
+    meta = _read_meta(part_dir)
+    if "digest" in meta:
+        return meta["digest"]
+    files = [(c["file"], os.stat(os.path.join(part_dir, c["file"]))) for c in meta["columns"]]
+    return [meta["n_events"]] + [[name, info.st_size, info.st_mtime_ns] for name, info in files]
+
+
+def list_columns(store_dir, source_files=None):
+    """Union of column names across partitions, in first-seen order."""
+    seen = {}
+    for name in source_files if source_files is not None else list_partitions(store_dir):
+        for col in partition_info(store_dir, name)["columns"]:
+            seen.setdefault(col["name"], None)
+    return list(seen)
+
+
+def read_partition(store_dir, source_file, columns=None, mmap=True):
+    """Return {column: array} for one partition. With mmap=True the arrays are read-only memory maps."""
+    part_dir = _partition_dir(store_dir, source_file)
+    meta = _read_meta(part_dir)
+    by_name = {c["name"]: c for c in meta["columns"]}
+    n = meta["n_events"]
+
+    out = {}
+    for col in (columns if columns is not None else list(by_name)):
+        if col not in by_name:
+            continue
+        info = by_name[col]
+        path = os.path.join(part_dir, info["file"])
+        if n == 0:
+            out[col] = np.empty(0, dtype=info["dtype"])
+        elif mmap:
+            out[col] = np.memmap(path, dtype=info["dtype"], mode="r", shape=(n,))
+        else:
+            out[col] = np.fromfile(path, dtype=info["dtype"], count=n)
+    return out
+
+
+def read_events(store_dir, columns=None, source_files=None, with_source=True):
+    """
+    Load events from the store into one DataFrame.
+
+    Only the requested columns are read from disk. Output columns are allocated
+    once and filled partition by partition, so there is no per-file DataFrame
+    and no pd.concat copy. Channels missing from a partition are filled with NaN
+    (event_id with -1).
+    """
+    names = source_files if source_files is not None else list_partitions(store_dir)
+    if not names:
+        raise ValueError(f"❌ No partitions found in event store: {store_dir}")
+
+    metas = [partition_info(store_dir, name) for name in names]
+    if columns is None:
+        columns = list_columns(store_dir, names)
+    sizes = [m["n_events"] for m in metas]
+    total = int(sum(sizes))
+
+    arrays = {col: np.full(total, MISSING_ID, dtype=np.int64) if col == ID_COLUMN
+              else np.full(total, np.nan, dtype=np.float32) for col in columns}
+    offset = 0
+    for name, n in zip(names, sizes):
+        part = read_partition(store_dir, name, columns=columns, mmap=True)
+        for col, values in part.items():
+            arrays[col][offset:offset + n] = values
+        offset += n
+
+    df = pd.DataFrame(arrays, copy=False)
+    if with_source:
+        codes = np.repeat(np.arange(len(names), dtype=np.int32), sizes)
+        df["source_file"] = pd.Categorical.from_codes(codes, categories=names)
+    return df
+
+
+def ingest_fcs(fcs_path, store_dir, sample_ids=None):
+    """
+    Convert one .fcs file into a store partition; returns the number of events written.
+    With sample_ids ({source_file: id}) every event also gets its event_id.
+    """
+    from src.preprocessing.fcs_reader import FCSFile
+
+    df = FCSFile(fcs_path).to_frame()
+    if df.empty:
+        return 0
+    if sample_ids is not None:
+        df.insert(0, ID_COLUMN, make_event_ids(sample_ids[os.path.basename(fcs_path)], np.arange(len(df))))
+    write_partition(store_dir, os.path.basename(fcs_path), df)
+    return len(df)
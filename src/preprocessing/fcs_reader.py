@@ -0,0 +1,218 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Native FCS 3.0/3.1 reader.
+#
+# Parses the HEADER and TEXT segments directly and exposes the DATA segment as a
+# numpy.memmap with the file's dtype and byte order, so events are never copied
+# until a caller asks for a (projected, masked) native-endian frame.
+
+HEADER_SIZE = 58
+
+
+def _parse_header(raw):
+    version = raw[:6].decode("ascii", errors="replace")
+    if not version.startswith("FCS"):
+        raise ValueError(f"❌ Not an FCS file (header starts with {version!r})")
+
+    def offset(start):
+        field = raw[start:start + 8].strip()
+        return int(field) if field else 0
+
+    return {
+        "version": version,
+        "text": (offset(10), offset(18)),
+        "data": (offset(26), offset(34)),
+        "analysis": (offset(42), offset(50)),
+    }
+
+
+def _parse_text(raw):
+    # First byte is the delimiter; a doubled delimiter inside a value is an escaped literal
+    text = raw.decode("utf-8", errors="replace")
+    delim = text[0]
+    placeholder = "\x00"
+    body = text[1:].replace(delim * 2, placeholder)
+    parts = [p.replace(placeholder, delim) for p in body.split(delim)]
+    if parts and parts[-1] == "":
+        parts = parts[:-1]
+    return {parts[i].strip().upper(): parts[i + 1].strip() for i in range(0, len(parts) - 1, 2)}
+
+
+def _read_segments(path):
+    with open(path, "rb") as f:
+        header = _parse_header(f.read(HEADER_SIZE))
+        text_start, text_end = header["text"]
+        f.seek(text_start)
+        text = _parse_text(f.read(text_end - text_start + 1))
+    return header, text
+
+
+def read_text(path):
+    """Read only the HEADER and TEXT segments of an FCS file (no event data is touched)."""
+    return _read_segments(path)[1]
+
+
+def channel_labels(text):
+    """One display name per parameter: $PnS when present, else $PnN."""
+    labels = []
+    for i in range(1, int(text["$PAR"]) + 1):
+        label = text.get(f"$P{i}S") or text.get(f"$P{i}N")
+        if label:
+            labels.append(label)
+    return labels
+
+
+def _event_dtype(text):
+    datatype = text.get("$DATATYPE", "").upper()
+    byteord = text.get("$BYTEORD", "1,2,3,4").replace(" ", "")
+    order = "<" if byteord.startswith("1") else ">"
+    n_par = int(text["$PAR"])
+    bits = [int(text.get(f"$P{i}B", "0") or 0) for i in range(1, n_par + 1)]
+
+    if text.get("$MODE", "L").upper() != "L":
+        raise ValueError(f"❌ Unsupported FCS $MODE: {text.get('$MODE')} (only list mode is supported)")
+
+    if datatype == "F":
+        return np.dtype(order + "f4"), None
+    if datatype == "D":
+        return np.dtype(order + "f8"), None
+    if datatype == "I":
+        if any(b not in (8, 16, 32, 64) for b in bits):
+            raise ValueError(f"❌ Unsupported integer widths in $PnB: {sorted(set(bits))}")
+        if len(set(bits)) == 1:
+            return np.dtype(f"{order}u{bits[0] // 8}"), None
+        # Mixed widths: one record per event, one field per parameter
+        fields = [(f"p{i}", f"{order}u{b // 8}") for i, b in enumerate(bits)]
+        return None, np.dtype(fields)
+    raise ValueError(f"❌ Unsupported FCS $DATATYPE: {datatype!r}")
+
+
+def _bit_masks(text):
+    """
+    Per-parameter mask for integer data: values only use the bits their range $PnR
+    needs, and any higher stored bits must be ignored. None where nothing is masked.
+    """
+    if text.get("$DATATYPE", "").upper() != "I":
+        return [None] * int(text["$PAR"])
+    masks = []
+    for i in range(1, int(text["$PAR"]) + 1):
+        bits = int(text.get(f"$P{i}B", "0") or 0)
+        value_range = int(float(text.get(f"$P{i}R", "0") or 0))
+        used = (value_range - 1).bit_length() if value_range > 0 else bits
+        masks.append((1 << used) - 1 if used < bits else None)
+    return masks
+
+
+class FCSFile:
+    """
+    Memory-mapped view of a list-mode FCS file.
+
+    `channels` are the $PnN names and `labels` the $PnS names (or None). Event
+    values are only read from disk when `data`/`column()` are indexed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        header, self.text = _read_segments(path)
+        self.version = header["version"]
+        self.n_params = int(self.text["$PAR"])
+        self.n_events = int(self.text["$TOT"])
+        self.channels = [self.text.get(f"$P{i}N", f"P{i}") for i in range(1, self.n_params + 1)]
+        self.labels = [self.text.get(f"$P{i}S") or None for i in range(1, self.n_params + 1)]
+        self.dtype, self._record_dtype = _event_dtype(self.text)
+        self._masks = _bit_masks(self.text)
+
+        # Offsets above 99,999,999 bytes don't fit the header and live in TEXT instead
+        data_start, data_end = header["data"]
+        if data_start == 0 and data_end == 0:
+            data_start = int(self.text.get("$BEGINDATA", 0))
+            data_end = int(self.text.get("$ENDDATA", 0))
+        self.data_offset = data_start
+        self.data_end = data_end
+        self._data = None
+
+    @property
+    def data(self):
+        """Event matrix as a read-only memmap: (n_events, n_params), or a record array for mixed int widths."""
+        if self._data is None:
+            if self.n_events == 0:
+                self._data = np.empty((0, self.n_params), dtype=self.dtype or np.float32)
+            elif self._record_dtype is not None:
+                self._data = np.memmap(self.path, dtype=self._record_dtype, mode="r",
+                                       offset=self.data_offset, shape=(self.n_events,))
+            else:
+                self._data = np.memmap(self.path, dtype=self.dtype, mode="r",
+                                       offset=self.data_offset, shape=(self.n_events, self.n_params))
+        return self._data
+
+    def channel_index(self, name):
+        """Index of a channel by $PnN or $PnS name."""
+        if name in self.channels:
+            return self.channels.index(name)
+        if name in self.labels:
+            return self.labels.index(name)
+        raise KeyError(name)
+
+    def _raw_column(self, i):
+        if self._record_dtype is not None:
+            return self.data[f"p{i}"]
+        return self.data[:, i]
+
+    def _apply_mask(self, i, values):
+        mask = self._masks[i]
+        return values if mask is None else values & values.dtype.type(mask)
+
+    def column(self, key, events=None):
+        """
+        One channel (by index, $PnN or $PnS), optionally restricted to an `events` slice.
+        A zero-copy strided view, except for integer channels whose $PnR leaves stored
+        bits unused: those are masked to their range (a copy).
+        """
+        i = key if isinstance(key, int) else self.channel_index(key)
+        values = self._raw_column(i)
+        if events is not None:
+            values = values[events]
+        return self._apply_mask(i, values)
+
+    def rename_map(self, fluor_map):
+        """Map each $PnN channel to its marker from fluor_map (whose keys may be $PnN or $PnS names)."""
+        out = {}
+        for name, label in zip(self.channels, self.labels):
+            if name in fluor_map:
+                out[name] = fluor_map[name]
+            elif label and label in fluor_map:
+                out[name] = fluor_map[label]
+        return out
+
+    def iter_slices(self, chunk_size):
+        """Consecutive event ranges of at most chunk_size events, for streaming over the file."""
+        for start in range(0, self.n_events, chunk_size):
+            yield slice(start, min(start + chunk_size, self.n_events))
+
+    def to_frame(self, columns=None, rows=None, rename=None, events=None):
+        """
+        Native-endian DataFrame of the selected channels.
+
+        `events` (a slice) restricts the view to one chunk, and `rows` (boolean mask
+        or index array, relative to that chunk) is applied before conversion, so only
+        surviving events are copied. `rename` maps $PnN/$PnS names to output names.
+        """
+        columns = columns if columns is not None else self.channels
+        rename = rename or {}
+        out = {}
+        for col in columns:
+            i = col if isinstance(col, int) else self.channel_index(col)
+            values = self._raw_column(i)
+            if events is not None:
+                values = values[events]
+            if rows is not None:
+                values = values[rows]
+            values = self._apply_mask(i, values)
+            out[rename.get(col, col)] = np.asarray(values, dtype=values.dtype.newbyteorder("="))
+        return pd.DataFrame(out, copy=False)
+
+    def __repr__(self):
+        return (f"FCSFile({os.path.basename(self.path)!r}, version={self.version}, "
+                f"events={self.n_events}, params={self.n_params}, dtype={self.dtype or self._record_dtype})")
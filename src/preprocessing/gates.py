@@ -0,0 +1,238 @@
+import os
+import json
+import numpy as np
+
+# Declarative gating hierarchy.
+#
+# A gate spec (JSON, or YAML if PyYAML is installed) lives next to fluor_map.json:
+#
+#   {
+#     "output": "singlets",
+#     "gates": [
+#       {"name": "lymphocytes", "type": "rectangle", "bounds": {"FSC-A": [10000, 80000], "SSC-A": [1000, 60000]}},
+#       {"name": "singlets", "parent": "lymphocytes", "type": "ratio",
+#        "numerator": "FSC-A", "denominator": "FSC-H", "range": [0.85, 1.15]},
+#       {"name": "CD4+", "parent": "singlets", "type": "quadrant", "x": "CD4", "y": "CD8",
+#        "threshold": [500, 500], "quadrant": "+-"},
+#       {"name": "blasts", "parent": "singlets", "type": "polygon", "x": "FSC-A", "y": "SSC-A",
+#        "vertices": [[20000, 1000], [60000, 1000], [60000, 30000], [20000, 30000]]}
+#     ]
+#   }
+#
+# Channels may be marker names (after fluor_map renaming) or $PnN/$PnS names.
+# Bounds are exclusive and null means unbounded. A gate whose channels are
+# missing from a file passes every event of its parent, as the old hard-coded
+# gates did. `output` names the population that gets exported.
+
+# Equivalent of the thresholds apply_gates.py used to hard-code
+DEFAULT_SPEC = {
+    "output": "singlets",
+    "gates": [
+        {"name": "lymphocytes", "type": "rectangle",
+         "bounds": {"FSC-A": [10000, 80000], "SSC-A": [1000, 60000]}},
+        {"name": "singlets", "parent": "lymphocytes", "type": "ratio",
+         "numerator": "FSC-A", "denominator": "FSC-H", "range": [0.85, 1.15]},
+    ],
+}
+
+QUADRANTS = ("++", "+-", "-+", "--")
+
+
+def load_spec(path=None):
+    """Load a gate spec from JSON/YAML; falls back to DEFAULT_SPEC when path is None or missing."""
+    if path is None or not os.path.exists(path):
+        return DEFAULT_SPEC
+    with open(path, "r") as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError("❌ PyYAML is required for YAML gate specs (pip install pyyaml), or use JSON.")
+            spec = yaml.safe_load(f)
+        else:
+            spec = json.load(f)
+    validate_spec(spec)
+    return spec
+
+
+def _channels(gate):
+    kind = gate["type"]
+    if kind == "rectangle":
+        return list(gate["bounds"])
+    if kind == "ratio":
+        return [gate["numerator"], gate["denominator"]]
+    if kind in ("polygon", "quadrant"):
+        return [gate["x"], gate["y"]]
+    raise ValueError(f"❌ Unknown gate type {kind!r} in gate {gate.get('name')!r}")
+
+
+def validate_spec(spec):
+    names = [g["name"] for g in spec.get("gates", [])]
+    if len(set(names)) != len(names):
+        raise ValueError("❌ Gate names must be unique.")
+    for gate in spec.get("gates", []):
+        _channels(gate)
+        parent = gate.get("parent")
+        if parent is not None and parent not in names:
+            raise ValueError(f"❌ Gate {gate['name']!r} has unknown parent {parent!r}")
+        if gate["type"] == "quadrant" and gate.get("quadrant") not in QUADRANTS:
+            raise ValueError(f"❌ Quadrant gate {gate['name']!r} needs quadrant in {QUADRANTS}")
+        if gate["type"] == "polygon" and len(gate.get("vertices", [])) < 3:
+            raise ValueError(f"❌ Polygon gate {gate['name']!r} needs at least 3 vertices")
+    output = spec.get("output")
+    if output is not None and output not in names:
+        raise ValueError(f"❌ Output gate {output!r} is not defined")
+
+
+def _ordered(gates):
+    """Parents before children, otherwise in spec order."""
+    by_name = {g["name"]: g for g in gates}
+    done, order = set(), []
+
+    def visit(gate, path=()):
+        if gate["name"] in done:
+            return
+        if gate["name"] in path:
+            raise ValueError(f"❌ Gate hierarchy has a cycle through {gate['name']!r}")
+        parent = gate.get("parent")
+        if parent is not None:
+            visit(by_name[parent], path + (gate["name"],))
+        done.add(gate["name"])
+        order.append(gate)
+
+    for gate in gates:
+        visit(gate)
+    return order
+
+
+def points_in_polygon(x, y, vertices):
+    """Vectorized even-odd ray casting: one pass over the polygon edges, each over all events."""
+    vx = np.asarray([v[0] for v in vertices], dtype=np.float64)
+    vy = np.asarray([v[1] for v in vertices], dtype=np.float64)
+    inside = np.zeros(len(x), dtype=bool)
+    for i in range(len(vx)):
+        x1, y1 = vx[i], vy[i]
+        x2, y2 = vx[i - 1], vy[i - 1]
+        if y1 == y2:
+            continue
+        crosses = (y1 > y) != (y2 > y)
+        x_cross = x1 + (y - y1) * ((x2 - x1) / (y2 - y1))
+        inside ^= crosses & (x < x_cross)
+    return inside
+
+
+def _rectangle(gate):
+    bounds = [(ch, lo, hi) for ch, (lo, hi) in gate["bounds"].items()]
+
+    def evaluate(col, mask):
+        for ch, lo, hi in bounds:
+            values = col(ch)
+            if lo is not None:
+                np.logical_and(mask, values > lo, out=mask)
+            if hi is not None:
+                np.logical_and(mask, values < hi, out=mask)
+    return evaluate
+
+
+def _ratio(gate):
+    num, den = gate["numerator"], gate["denominator"]
+    lo, hi = gate["range"]
+    eps = gate.get("epsilon", 1e-6)
+
+    def evaluate(col, mask):
+        ratio = col(num) / (col(den) + eps)
+        if lo is not None:
+            np.logical_and(mask, ratio > lo, out=mask)
+        if hi is not None:
+            np.logical_and(mask, ratio < hi, out=mask)
+    return evaluate
+
+
+def _quadrant(gate):
+    tx, ty = gate["threshold"]
+    sx, sy = gate["quadrant"]
+
+    def evaluate(col, mask):
+        x, y = col(gate["x"]), col(gate["y"])
+        np.logical_and(mask, (x > tx) if sx == "+" else (x <= tx), out=mask)
+        np.logical_and(mask, (y > ty) if sy == "+" else (y <= ty), out=mask)
+    return evaluate
+
+
+def _polygon(gate):
+    vertices = gate["vertices"]
+
+    def evaluate(col, mask):
+        # Only test events that survived the parent gate
+        idx = np.flatnonzero(mask)
+        mask[idx] = points_in_polygon(col(gate["x"])[idx], col(gate["y"])[idx], vertices)
+    return evaluate
+
+
+BUILDERS = {"rectangle": _rectangle, "ratio": _ratio, "quadrant": _quadrant, "polygon": _polygon}
+
+
+class CompiledGates:
+    """
+    A gate hierarchy bound to one file's channel layout.
+
+    Every gate is pre-resolved to a closure over its constants, and evaluate()
+    walks the hierarchy once per chunk: each channel is converted to a native
+    array at most once, each gate's mask starts from its parent's, and all
+    updates are in-place boolean ANDs (no DataFrame copies).
+    """
+
+    def __init__(self, spec, resolve):
+        self.spec = spec
+        self.output = spec.get("output")
+        self.gates = []
+        self.skipped = []
+        for gate in _ordered(spec.get("gates", [])):
+            channels = [resolve(ch) for ch in _channels(gate)]
+            if any(ch is None for ch in channels):
+                # Missing channels: pass the parent population through unchanged
+                self.skipped.append(gate["name"])
+                fn = None
+            else:
+                fn = BUILDERS[gate["type"]](gate)
+            self.gates.append((gate["name"], gate.get("parent"), fn))
+        self.resolve = resolve
+
+    def evaluate(self, column, n):
+        """Masks for every gate on one chunk; column(source_channel) returns that chunk's values."""
+        cache = {}
+
+        def col(name):
+            source = self.resolve(name)
+            if source not in cache:
+                values = column(source)
+                cache[source] = np.asarray(values, dtype=values.dtype.newbyteorder("="))
+            return cache[source]
+
+        masks = {}
+        for name, parent, fn in self.gates:
+            mask = masks[parent].copy() if parent is not None else np.ones(n, dtype=bool)
+            if fn is not None:
+                fn(col, mask)
+            masks[name] = mask
+        return masks
+
+    def output_mask(self, masks, n):
+        if self.output is None:
+            return np.ones(n, dtype=bool)
+        return masks[self.output]
+
+
+def compile_gates(spec, fcs, rename):
+    """Bind a spec to an FCSFile: channel names resolve via fluor_map renaming, then $PnN/$PnS."""
+    by_output = {rename.get(ch, ch): ch for ch in fcs.channels}
+
+    def resolve(name):
+        if name in by_output:
+            return by_output[name]
+        try:
+            return fcs.channels[fcs.channel_index(name)]
+        except KeyError:
+            return None
+
+    return CompiledGates(spec, resolve)
@@ -0,0 +1,87 @@
+import os
+import numpy as np
+from src.preprocessing.event_store import ID_COLUMN, PartitionWriter, make_event_ids
+from src.preprocessing.fcs_reader import FCSFile
+from src.preprocessing.gates import DEFAULT_SPEC, compile_gates
+
+# Events per chunk when streaming a file through the gates. Peak memory is
+# bounded by one chunk (plus its mask), regardless of how many events a file has.
+DEFAULT_CHUNK_SIZE = 500_000
+
+
+def output_columns(fcs, fluor_map, with_ids=False):
+    """Gated column names for a file: channels renamed by fluor_map, minus unnamed ones (event_id first if with_ids)."""
+    rename = fcs.rename_map(fluor_map)
+    names = [rename.get(ch, ch) for ch in fcs.channels]
+    return [ID_COLUMN] * with_ids + [name for name in names if not name.startswith('Unnamed')]
+
+
+def iter_gated_chunks(fcs, fluor_map, spec=None, chunk_size=DEFAULT_CHUNK_SIZE, counts=None, sample_id=None,
+                      gates=None):
+    """
+    Yield the events of each chunk that fall in the spec's output gate, as a
+    DataFrame with marker-renamed columns. Per-gate event counts are added to
+    `counts` (a dict, with every gate present even for an empty file) when given.
+    With a sample_id, survivors keep their event_id (position in the original
+    file) as the first column. `gates` are the spec already compiled for fcs.
+    """
+    # Rename using fluor_map (keys may be $PnN or $PnS names)
+    rename = fcs.rename_map(fluor_map)
+    keep = [ch for ch in fcs.channels if not rename.get(ch, ch).startswith('Unnamed')]
+    if gates is None:
+        gates = compile_gates(spec or DEFAULT_SPEC, fcs, rename)
+    if counts is not None:
+        for name, _, _ in gates.gates:
+            counts.setdefault(name, 0)
+
+    for events in fcs.iter_slices(chunk_size):
+        n = events.stop - events.start
+        # Gates are evaluated as masks directly on the memory-mapped event matrix
+        masks = gates.evaluate(lambda ch: fcs.column(ch, events), n)
+        if counts is not None:
+            for name, mask in masks.items():
+                counts[name] = counts.get(name, 0) + int(np.count_nonzero(mask))
+        # Only surviving events are copied out of the file
+        rows = gates.output_mask(masks, n)
+        df = fcs.to_frame(columns=keep, rows=rows, rename=rename, events=events)
+        if sample_id is not None:
+            df.insert(0, ID_COLUMN, make_event_ids(sample_id, events.start + np.flatnonzero(rows)))
+        yield df
+
+
+def gate_file(fcs_path, fluor_map, gated_dir, spec=None, csv_dir=None, csv_columns=None,
+              chunk_size=DEFAULT_CHUNK_SIZE, sample_ids=None):
+    """
+    Stream one FCS file through the gate hierarchy chunk by chunk.
+
+    Survivors are appended to the file's partition in the gated event store and,
+    if csv_dir is given, to a header-less <csv_dir>/<file>.csv laid out as
+    csv_columns. With sample_ids ({file name: sample id}) survivors carry their
+    event_id. Returns {"events", "gated", "gates": {gate name: event count}}.
+    """
+    fname = os.path.basename(fcs_path)
+    fcs = FCSFile(fcs_path)
+    sample_id = sample_ids[fname] if sample_ids is not None else None
+    n_gated = 0
+    counts = {}
+
+    gates = compile_gates(spec or DEFAULT_SPEC, fcs, fcs.rename_map(fluor_map))
+    if gates.skipped:
+        print(f"⚠️ {fname}: missing channels, passing through gates: {', '.join(gates.skipped)}")
+
+    csv_file = open(os.path.join(csv_dir, fname + ".csv"), "w", newline="") if csv_dir else None
+    try:
+        with PartitionWriter(gated_dir, fname, columns=output_columns(fcs, fluor_map, sample_id is not None)) as writer:
+            for df in iter_gated_chunks(fcs, fluor_map, spec, chunk_size, counts, sample_id, gates):
+                # Store gated events as a columnar partition for downstream stages
+                writer.append(df)
+                n_gated += len(df)
+
+                if csv_file is not None and len(df):
+                    # Track source file
+                    df["source_file"] = fname
+                    df.reindex(columns=csv_columns or list(df.columns)).to_csv(csv_file, header=False, index=False)
+    finally:
+        if csv_file is not None:
+            csv_file.close()
+    return {"events": fcs.n_events, "gated": n_gated, "gates": counts}
@@ -1,6 +1,8 @@
 import os
-import FlowCal
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
 import json
+from src.preprocessing.fcs_reader import read_text, channel_labels
 
 # === Setup Paths ===
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -16,17 +18,10 @@ fcs_path = os.path.join(data_dir, fcs_files[0])
 
 # === Load only FCS header (fast) ===
 print(f"📂 Loading: {fcs_path}")
-fcsfile = FlowCal.io.FCSFile(fcs_path)
-param_count = int(fcsfile.text['$PAR'])
+text = read_text(fcs_path)
 
 # === Extract one name per parameter: prefer $PnS, fallback to $PnN ===
-fluor_channels = []
-for i in range(1, param_count + 1):
-    label_key = f"$P{i}S"
-    name_key = f"$P{i}N"
-    channel_name = fcsfile.text.get(label_key) or fcsfile.text.get(name_key)
-    if channel_name:
-        fluor_channels.append(channel_name)
+fluor_channels = channel_labels(text)
 
 # === Deduplicate channel names ===
 fluor_channels = sorted(set(fluor_channels))
@@ -0,0 +1,50 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Per-file process pool shared by ingest (Flow_Tcell.py) and gating (apply_gates.py).
+# Every file is independent, so each one is handled by its own worker and results
+# stream back in completion order. Callers that need deterministic output re-order
+# by file name before merging.
+
+
+def resolve_workers(workers):
+    """0 or negative means one worker per core."""
+    if workers is None or workers <= 0:
+        return os.cpu_count() or 1
+    return workers
+
+
+def _timed_call(fn, path, kwargs, return_exceptions):
+    start = time.perf_counter()
+    try:
+        result = fn(path, **kwargs)
+    except Exception as e:
+        if not return_exceptions:
+            raise
+        result = e
+    return result, time.perf_counter() - start
+
+
+def map_files(fn, paths, workers=1, return_exceptions=False, **kwargs):
+    """
+    Run fn(path, **kwargs) for every path and yield (path, result, seconds).
+
+    With workers == 1 everything runs in-process in the given order; otherwise a
+    process pool is used and results are yielded as soon as each file finishes.
+    `fn` must be importable (module-level) so it can be sent to worker processes.
+    With return_exceptions=True a failing file yields its exception as the result
+    instead of aborting the whole run.
+    """
+    workers = min(resolve_workers(workers), max(len(paths), 1))
+    if workers == 1:
+        for path in paths:
+            result, seconds = _timed_call(fn, path, kwargs, return_exceptions)
+            yield path, result, seconds
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_timed_call, fn, path, kwargs, return_exceptions): path for path in paths}
+        for future in as_completed(futures):
+            result, seconds = future.result()
+            yield futures[future], result, seconds
@@ -0,0 +1,78 @@
+import json
+import uuid
+import streamlit as st
+from src.pipeline.jobs import JobManager, DONE, FAILED, CANCELLED
+from src.pipeline.profiling import format_rates
+
+# Streamlit side of the background job manager: one JobManager per server
+# process (shared by every session), a per-session user id, and a status panel
+# that polls the running job without blocking or rerunning the rest of the page.
+
+POLL_SECONDS = 1.0
+
+
+@st.cache_resource
+def job_manager():
+    return JobManager(workers=1)
+
+
+def session_user():
+    if "user_id" not in st.session_state:
+        st.session_state.user_id = uuid.uuid4().hex[:12]
+    return st.session_state.user_id
+
+
+def current_job(key="job_id"):
+    job_id = st.session_state.get(key)
+    return job_manager().get(job_id) if job_id else None
+
+
+@st.fragment(run_every=POLL_SECONDS)
+def _poll(job_id):
+    manager = job_manager()
+    job = manager.get(job_id)
+    if job is None or job.done:
+        # Finished: rerun the whole page once so it renders the job's results
+        st.rerun()
+    status = job.status()
+    if status["state"] == "queued":
+        st.info(f"⏳ Queued ({manager.queue_position(job)} job(s) ahead)")
+    else:
+        stage = status["stage"] or "starting"
+        step = f"{len(status['completed']) + 1}/{len(status['stages'])}"
+        st.progress(status["fraction"], text=f"{stage} ({step}): {status['message']}")
+        st.caption(f"⏱️ {status['elapsed']:.0f}s elapsed")
+    if st.button("Cancel", key=f"cancel_{job_id}"):
+        manager.cancel(job_id)
+
+
+def show_profile(job):
+    """Per-span time, memory and throughput of a finished job, plus its Chrome trace."""
+    if not job.profile:
+        return
+    import pandas as pd
+    with st.expander("⏱️ Profile"):
+        st.dataframe(pd.DataFrame([{"span": row["path"], "calls": row["calls"], "seconds": row["seconds"],
+                                    "peak RSS (MB)": row["peak_rss_mb"], "Δ RSS (MB)": row["rss_delta_mb"],
+                                    "throughput": format_rates(row["rates"])} for row in job.profile]),
+                     hide_index=True)
+        st.download_button("Download trace (chrome://tracing)", json.dumps(job.trace),
+                           file_name=f"flowsense_trace_{job.id}.json", mime="application/json",
+                           key=f"trace_{job.id}")
+
+
+def show_job(job):
+    """Progress panel while the job runs; True once it finished successfully."""
+    if job is None:
+        return False
+    if not job.done:
+        _poll(job.id)
+        return False
+    if job.state == FAILED:
+        st.error(f"❌ Task failed: {job.error}")
+    elif job.state == CANCELLED:
+        st.warning("⚠️ Task cancelled.")
+    elif job.state == DONE:
+        st.caption(" · ".join(f"{name} {sec:.1f}s" for name, sec in job.timings.items()))
+    show_profile(job)
+    return job.state == DONE
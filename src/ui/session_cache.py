@@ -0,0 +1,126 @@
+import os
+import sys
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+import streamlit as st
+
+# Memory-bounded cache for the Streamlit front end, so widget reruns don't touch disk.
+#
+# Every Streamlit interaction reruns the script top to bottom; the loaders below
+# return cached objects keyed by content (uploads, by SHA-256 of their bytes) or
+# by file signature (path + size + mtime for FCS headers, result tables and
+# downloads), so a stale entry is never served after the file changes. One
+# LRUCache per server process holds them, and least-recently-used entries are
+# evicted once their estimated size exceeds FLOWSENSE_MEMORY_MB (default 1024).
+
+DEFAULT_BUDGET_MB = float(os.environ.get("FLOWSENSE_MEMORY_MB", 1024))
+
+
+def sizeof(obj):
+    """Approximate in-memory size of a cached value, in bytes."""
+    import pandas as pd
+    if isinstance(obj, (bytes, bytearray)):
+        return len(obj)
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(index=True).sum())
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(index=True))
+    if isinstance(obj, dict):
+        return sum(sizeof(v) for v in obj.values()) + sys.getsizeof(obj)
+    if isinstance(obj, (list, tuple)):
+        return sum(sizeof(v) for v in obj) + sys.getsizeof(obj)
+    return sys.getsizeof(obj)
+
+
+def file_signature(path):
+    info = os.stat(path)
+    return os.path.abspath(path), info.st_size, info.st_mtime_ns
+
+
+class LRUCache:
+    def __init__(self, max_bytes=None):
+        self.max_bytes = int(max_bytes if max_bytes is not None else DEFAULT_BUDGET_MB * 1024 ** 2)
+        self._entries = OrderedDict()   # key -> (value, size)
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_load(self, key, loader):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+        value = loader()
+        size = sizeof(value)
+        with self._lock:
+            self.misses += 1
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            # Values larger than the whole budget are returned but not kept
+            if size <= self.max_bytes:
+                self._entries[key] = (value, size)
+                self.size += size
+                while self.size > self.max_bytes:
+                    _, (_, evicted) = self._entries.popitem(last=False)
+                    self.size -= evicted
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "mb": self.size / 1024 ** 2,
+                    "budget_mb": self.max_bytes / 1024 ** 2, "hits": self.hits, "misses": self.misses}
+
+
+@st.cache_resource
+def session_cache():
+    return LRUCache()
+
+
+# === Loaders ===
+def save_upload(uploaded, data_dir="data"):
+    """
+    (path, sha256) of an uploaded file written under data_dir. The digest is memoized
+    per upload (file_id) and the file is only rewritten when its content changed.
+    """
+    digests = st.session_state.setdefault("_upload_digests", {})
+    file_id = getattr(uploaded, "file_id", None) or uploaded.name
+    path = os.path.join(data_dir, uploaded.name)
+    if file_id not in digests:
+        digests[file_id] = hashlib.sha256(uploaded.getbuffer()).hexdigest()
+    digest = digests[file_id]
+    written = st.session_state.setdefault("_upload_written", {})
+    on_disk = (digest, *file_signature(path)[1:]) if os.path.exists(path) else None
+    if on_disk is None or written.get(path) != on_disk:
+        os.makedirs(data_dir, exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(uploaded.getbuffer())
+        written[path] = (digest, *file_signature(path)[1:])
+    return path, digest
+
+
+def fcs_channels(path, digest=None):
+    """Channel display names of an FCS file (HEADER/TEXT only), keyed by content hash."""
+    from src.preprocessing.fcs_reader import channel_labels, read_text
+    key = ("fcs_channels", digest or file_signature(path))
+    return session_cache().get_or_load(key, lambda: channel_labels(read_text(path)))
+
+
+def result_table(path, columns=None):
+    """A CSV result table (optionally only some columns)."""
+    import pandas as pd
+    key = ("table", file_signature(path), tuple(columns) if columns else None)
+    return session_cache().get_or_load(key, lambda: pd.read_csv(path, usecols=columns))
+
+
+def file_bytes(path):
+    """Raw file contents, e.g. for st.download_button."""
+    def load():
+        with open(path, "rb") as f:
+            return f.read()
+    return session_cache().get_or_load(("bytes", file_signature(path)), load)
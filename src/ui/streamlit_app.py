@@ -1,8 +1,11 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
 import streamlit as st
 import pandas as pd
-import os
-import matplotlib.pyplot as plt
-import seaborn as sns
+from src.analysis.render import draw_violins, violin_aggregates
+from src.ui.job_status import current_job, job_manager, session_user, show_job
+from src.ui.session_cache import result_table
 
 st.set_page_config(page_title="FlowSense", layout="wide")
 
@@ -41,8 +44,28 @@ task = st.radio("Choose a task:", [
     "Marker Expression Visualization"
 ])
 
+# Pipeline stages each task needs; they run as a background job polled below
+TASK_TARGETS = {
+    "CD4/CD8 Classification": ["gnn", "gnn_plots"],
+    "Anomaly Detection": ["anomalies", "marker_plots"],
+    "Marker Expression Visualization": ["marker_plots"],
+}
 if st.button("Run Task"):
-    st.info(f"🔧 Running: {task}...")
+    st.session_state.job_id = job_manager().submit(session_user(), TASK_TARGETS[task]).id
+
+job = current_job()
+if show_job(job):
+    for name, result in job.result.items():
+        if name == "gnn":
+            st.metric("Test accuracy", f"{result['accuracy']:.3f}")
+        elif name == "gnn_plots":
+            for path in result:
+                st.image(path)
+        elif name == "anomalies":
+            st.image(result["plot"])
+        elif name == "marker_plots":
+            for path in result.values():
+                st.image(path)
 
 # === Download Links ===
 st.markdown("### 4. Download Results")
@@ -52,18 +75,30 @@ st.download_button("Download Anomaly Table", data="example", file_name="anomalie
 # === Marker Analysis (Post-Anomaly)
 st.markdown("### 5. Marker Expression in Anomalies")
 
+
+@st.cache_data(max_entries=8)
+def marker_aggregates(path, mtime_ns, marker_cols):
+    """Binned violin aggregates per marker; cached on the table's mtime, so reruns skip the CSV."""
+    header = pd.read_csv(path, nrows=0).columns
+    present = [m for m in marker_cols if m in header]
+    df = result_table(path, ["anomaly"] + present)
+    return {m: violin_aggregates(df[m], df["anomaly"], levels=[0, 1]) for m in present}
+
+
 anomaly_csv_path = "data/processed/Flow_Tcell_anomalies.csv"
 if os.path.exists(anomaly_csv_path):
-    df_anom = pd.read_csv(anomaly_csv_path)
-    marker_cols = ["CD3", "CD4", "CD8", "CD25", "IL2"]  # Can customize this
+    marker_cols = ("CD3", "CD4", "CD8", "CD25", "IL2")  # Can customize this
+    aggregates = marker_aggregates(anomaly_csv_path, os.stat(anomaly_csv_path).st_mtime_ns, marker_cols)
 
+    import matplotlib.pyplot as plt
     for marker in marker_cols:
-        if marker not in df_anom.columns:
+        if marker not in aggregates:
             st.warning(f"⚠️ {marker} not found in data.")
             continue
         fig, ax = plt.subplots(figsize=(6, 4))
-        sns.violinplot(data=df_anom, x="anomaly", y=marker, palette=["gray", "red"])
+        draw_violins(ax, aggregates[marker], colors=["gray", "red"])
         ax.set_title(f"{marker} Expression by Anomaly")
         st.pyplot(fig)
+        plt.close(fig)
 else:
     st.info("ℹ️ Run anomaly detection first to view marker shifts.")
@@ -0,0 +1,30 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import numpy as np
+import pandas as pd
+from src.preprocessing.event_store import PartitionWriter, list_partitions, partition_signature, read_events
+
+# Partition digests: recorded when a partition is written, independent of chunking.
+
+
+def write(store, name, df, chunk_size):
+    with PartitionWriter(store, name, columns=df.columns) as writer:
+        for start in range(0, len(df), chunk_size):
+            writer.append(df.iloc[start:start + chunk_size])
+
+
+def test_signature_ignores_chunking_and_tracks_content(tmp_path):
+    store = str(tmp_path)
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({"event_id": np.arange(1000), "CD4": rng.normal(size=1000), "CD8": rng.normal(size=1000)})
+    write(store, "a.fcs", df, 1000)
+    first = partition_signature(store, "a.fcs")
+    write(store, "a.fcs", df, 130)
+    assert partition_signature(store, "a.fcs") == first
+    changed = df.copy()
+    changed.loc[5, "CD8"] += 1
+    write(store, "a.fcs", changed, 1000)
+    assert partition_signature(store, "a.fcs") != first
+    assert list_partitions(store) == ["a.fcs"]
+    assert len(read_events(store)) == 1000
@@ -0,0 +1,93 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import numpy as np
+import pytest
+from benchmarks.bench_fcs_reader import write_synthetic_fcs
+from src.preprocessing.fcs_reader import FCSFile, read_text
+
+# Round trips through the native FCS reader: files written by the benchmark's
+# writer in every supported layout must read back to the values written.
+
+
+def roundtrip(tmp_path, values, **layout):
+    path = str(tmp_path / "sample.fcs")
+    write_synthetic_fcs(path, len(values), values=values, **layout)
+    return FCSFile(path)
+
+
+def int_values(rng, n_events, bits):
+    return np.stack([rng.integers(0, 2 ** min(b, 31), n_events) for b in bits], axis=1)
+
+
+@pytest.mark.parametrize("byteorder", ["<", ">"])
+@pytest.mark.parametrize("datatype", ["F", "D"])
+def test_float_roundtrip(tmp_path, byteorder, datatype):
+    values = np.random.default_rng(0).normal(1000, 300, size=(500, 4))
+    fcs = roundtrip(tmp_path, values, datatype=datatype, byteorder=byteorder)
+    expected = values.astype(np.float32 if datatype == "F" else np.float64)
+    assert fcs.n_events == 500 and fcs.n_params == 4
+    np.testing.assert_array_equal(fcs.to_frame().to_numpy(), expected)
+    np.testing.assert_array_equal(fcs.column("P2"), expected[:, 1])
+
+
+@pytest.mark.parametrize("byteorder", ["<", ">"])
+@pytest.mark.parametrize("bits", [[16, 16, 16], [32, 32, 32], [8, 16, 32], [16, 32, 64]])
+def test_integer_roundtrip(tmp_path, byteorder, bits):
+    values = int_values(np.random.default_rng(1), 300, bits)
+    fcs = roundtrip(tmp_path, values, datatype="I", byteorder=byteorder, bits=bits,
+                    ranges=[2 ** b for b in bits])
+    for i in range(len(bits)):
+        np.testing.assert_array_equal(fcs.column(i), values[:, i])
+    frame = fcs.to_frame()
+    assert all(dtype.byteorder in "=|" for dtype in frame.dtypes)
+    np.testing.assert_array_equal(frame.to_numpy(), values)
+
+
+@pytest.mark.parametrize("byteorder", ["<", ">"])
+def test_integer_values_masked_to_range(tmp_path, byteorder):
+    # 16-bit storage for 10-bit ($PnR 1024) values; the upper 6 bits carry junk
+    rng = np.random.default_rng(2)
+    values = rng.integers(0, 1024, size=(200, 2))
+    junk = rng.integers(0, 64, size=values.shape) << 10
+    fcs = roundtrip(tmp_path, values | junk, datatype="I", byteorder=byteorder, bits=16, ranges=[1024, 65536])
+    np.testing.assert_array_equal(fcs.column(0), values[:, 0])
+    np.testing.assert_array_equal(fcs.column(1), (values | junk)[:, 1])
+    np.testing.assert_array_equal(fcs.column("P1", slice(10, 20)), values[10:20, 0])
+    rows = values[:, 0] > 500
+    frame = fcs.to_frame(rows=rows)
+    np.testing.assert_array_equal(frame["P1"].to_numpy(), values[rows, 0])
+
+
+def test_chunked_frames_match_whole_file(tmp_path):
+    values = np.random.default_rng(3).normal(size=(1000, 3))
+    fcs = roundtrip(tmp_path, values, byteorder="<")
+    chunks = [fcs.to_frame(events=events) for events in fcs.iter_slices(300)]
+    assert [len(c) for c in chunks] == [300, 300, 300, 100]
+    np.testing.assert_array_equal(np.concatenate([c.to_numpy() for c in chunks]), fcs.to_frame().to_numpy())
+
+
+def test_data_offsets_from_text(tmp_path):
+    values = np.random.default_rng(4).normal(size=(100, 3))
+    in_header = roundtrip(tmp_path, values)
+    path = str(tmp_path / "offsets_in_text.fcs")
+    write_synthetic_fcs(path, len(values), values=values, offsets_in_text=True)
+    with open(path, "rb") as f:
+        assert f.read(58)[26:42].split() == [b"0", b"0"]
+    in_text = FCSFile(path)
+    assert in_text.data_offset == in_header.data_offset == int(read_text(path)["$BEGINDATA"])
+    np.testing.assert_array_equal(in_text.to_frame().to_numpy(), values.astype(np.float32))
+
+
+def test_default_synthetic_file(tmp_path):
+    path = str(tmp_path / "synthetic.fcs")
+    write_synthetic_fcs(path, 250)
+    fcs = FCSFile(path)
+    assert fcs.channels[:3] == ["FSC-A", "FSC-H", "SSC-A"]
+    assert fcs.n_events == 250 and fcs.dtype == np.dtype(">f4")
+
+
+def test_empty_file(tmp_path):
+    fcs = roundtrip(tmp_path, np.zeros((0, 3)))
+    assert fcs.n_events == 0
+    assert len(fcs.to_frame()) == 0
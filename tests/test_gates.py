@@ -0,0 +1,125 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import numpy as np
+import pytest
+from matplotlib.path import Path
+from benchmarks.bench_fcs_reader import write_synthetic_fcs
+from src.preprocessing.gates import CompiledGates, DEFAULT_SPEC, points_in_polygon, validate_spec
+from src.preprocessing.gating import gate_file
+
+# Gate types against direct numpy expressions (and matplotlib for polygons), the
+# parent → child hierarchy, and per-gate counts from gate_file.
+
+
+def random_events(n=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    return {"x": rng.uniform(0, 100, n), "y": rng.uniform(0, 100, n), "z": rng.uniform(1, 2, n)}
+
+
+def evaluate(spec, events):
+    # Channels are resolved by name; ones not in events count as missing
+    gates = CompiledGates(spec, lambda name: name if name in events else None)
+    n = len(next(iter(events.values())))
+    return gates, gates.evaluate(lambda ch: events[ch], n)
+
+
+def test_rectangle_bounds_are_exclusive_and_optional():
+    events = random_events()
+    events["x"][:3] = [10, 50, 90]
+    spec = {"gates": [{"name": "r", "type": "rectangle", "bounds": {"x": [10, 90], "y": [None, 40]}}]}
+    mask = evaluate(spec, events)[1]["r"]
+    np.testing.assert_array_equal(mask, (events["x"] > 10) & (events["x"] < 90) & (events["y"] < 40))
+
+
+def test_ratio():
+    events = random_events()
+    spec = {"gates": [{"name": "q", "type": "ratio", "numerator": "x", "denominator": "y", "range": [0.5, 2]}]}
+    ratio = events["x"] / (events["y"] + 1e-6)
+    np.testing.assert_array_equal(evaluate(spec, events)[1]["q"], (ratio > 0.5) & (ratio < 2))
+
+
+@pytest.mark.parametrize("quadrant", ["++", "+-", "-+", "--"])
+def test_quadrants_partition_events(quadrant):
+    events = random_events()
+    spec = {"gates": [{"name": "q", "type": "quadrant", "x": "x", "y": "y", "threshold": [30, 60],
+                       "quadrant": quadrant}]}
+    x_pos, y_pos = events["x"] > 30, events["y"] > 60
+    expected = (x_pos if quadrant[0] == "+" else ~x_pos) & (y_pos if quadrant[1] == "+" else ~y_pos)
+    np.testing.assert_array_equal(evaluate(spec, events)[1]["q"], expected)
+
+
+@pytest.mark.parametrize("vertices", [
+    [[10, 10], [90, 10], [90, 90], [10, 90]],
+    [[50, 5], [95, 50], [50, 95], [5, 50]],
+    [[10, 10], [90, 20], [30, 40], [85, 80], [15, 90]],    # concave
+    [[20, 20], [80, 80], [80, 20], [20, 80]],                # bow tie (crossing edges)
+])
+def test_polygon_matches_matplotlib(vertices):
+    events = random_events(5000, seed=1)
+    points = np.column_stack([events["x"], events["y"]])
+    expected = Path(vertices).contains_points(points)
+    np.testing.assert_array_equal(points_in_polygon(events["x"], events["y"], vertices), expected)
+    spec = {"gates": [{"name": "p", "type": "polygon", "x": "x", "y": "y", "vertices": vertices}]}
+    np.testing.assert_array_equal(evaluate(spec, events)[1]["p"], expected)
+
+
+def test_children_are_evaluated_after_parents_and_within_them():
+    events = random_events()
+    # Children listed before their parents
+    spec = {"output": "grandchild", "gates": [
+        {"name": "grandchild", "parent": "child", "type": "polygon", "x": "x", "y": "y",
+         "vertices": [[0, 0], [100, 0], [0, 100]]},
+        {"name": "child", "parent": "root", "type": "quadrant", "x": "x", "y": "y", "threshold": [20, 20],
+         "quadrant": "++"},
+        {"name": "root", "type": "rectangle", "bounds": {"x": [None, 70]}},
+    ]}
+    validate_spec(spec)
+    gates, masks = evaluate(spec, events)
+    assert [name for name, _, _ in gates.gates] == ["root", "child", "grandchild"]
+    assert not (masks["child"] & ~masks["root"]).any()
+    assert not (masks["grandchild"] & ~masks["child"]).any()
+    expected = ((events["x"] < 70) & (events["x"] > 20) & (events["y"] > 20)
+                & (events["x"] + events["y"] < 100))
+    np.testing.assert_array_equal(gates.output_mask(masks, len(expected)), expected)
+
+
+def test_gate_with_missing_channel_passes_parent_through():
+    events = random_events()
+    spec = {"gates": [
+        {"name": "root", "type": "rectangle", "bounds": {"x": [None, 50]}},
+        {"name": "missing", "parent": "root", "type": "ratio", "numerator": "x", "denominator": "w",
+         "range": [0, 1]},
+    ]}
+    gates, masks = evaluate(spec, events)
+    assert gates.skipped == ["missing"]
+    np.testing.assert_array_equal(masks["missing"], masks["root"])
+
+
+@pytest.mark.parametrize("spec, message", [
+    ({"gates": [{"name": "a", "type": "rectangle", "bounds": {}}] * 2}, "unique"),
+    ({"gates": [{"name": "a", "parent": "b", "type": "rectangle", "bounds": {}}]}, "unknown parent"),
+    ({"gates": [{"name": "a", "type": "quadrant", "x": "x", "y": "y", "threshold": [0, 0]}]}, "quadrant"),
+    ({"gates": [{"name": "a", "type": "polygon", "x": "x", "y": "y", "vertices": [[0, 0], [1, 1]]}]}, "3 vertices"),
+    ({"output": "b", "gates": [{"name": "a", "type": "rectangle", "bounds": {}}]}, "Output gate"),
+])
+def test_invalid_specs(spec, message):
+    with pytest.raises(ValueError, match=message):
+        validate_spec(spec)
+
+
+def test_cycle_is_rejected():
+    spec = {"gates": [{"name": "a", "parent": "b", "type": "rectangle", "bounds": {}},
+                      {"name": "b", "parent": "a", "type": "rectangle", "bounds": {}}]}
+    with pytest.raises(ValueError, match="cycle"):
+        evaluate(spec, random_events())
+
+
+@pytest.mark.parametrize("n_events", [0, 3000])
+def test_gate_file_counts_every_gate(tmp_path, n_events):
+    path = str(tmp_path / "sample.fcs")
+    write_synthetic_fcs(path, n_events)
+    result = gate_file(path, {}, str(tmp_path / "gated"), spec=DEFAULT_SPEC, chunk_size=1000)
+    assert set(result["gates"]) == {"lymphocytes", "singlets"}
+    assert result["events"] == n_events
+    assert result["gated"] == result["gates"]["singlets"] <= result["gates"]["lymphocytes"] <= n_events